@@ -0,0 +1,201 @@
+"""
+Fingerprinted static files and compressed responses.
+
+Static files are linked under a name carrying a hash of their content, so a browser can
+keep them for a year without asking again and a changed file is simply a new URL:
+|-- url_for('static', filename='css/index.css')  ->  /static/css/index.3f2a9c1b0e.css
+|-- fingerprinted names are served with Cache-Control: public, max-age=31536000, immutable
+|-- plain names still work, with the usual caching
+
+`flask build-assets` writes a .gz copy (and a .br one when the brotli package is
+installed) next to every text file under static/, and a client that accepts one is sent
+it as is. bin/post_compile runs it when Heroku builds the app. Fingerprints and copies
+are picked up when the app starts, a copy older than its file is ignored.
+
+HTML, css and json responses of COMPRESS_MIN_SIZE bytes or more are compressed on the
+way out, brotli when the client and server both have it, gzip otherwise. A response
+with an ETag (every page_cache page) keeps its compressed body in a small per worker
+LRU, so cache hits are not compressed again.
+|-- STATIC_FINGERPRINT  on unless '0', and off under flask --debug so css edits show up
+|-- COMPRESS            on unless '0'
+|-- COMPRESS_MIN_SIZE   bytes, 1024 by default
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from cachetools import LRUCache
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    # Optional, responses are gzip only without it
+    brotli = None
+
+
+# A year, the longest max-age caches are asked to honour.
+IMMUTABLE_MAX_AGE = 31536000
+
+# Images and fonts are compressed already.
+COMPRESSIBLE = frozenset(('text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+                          'application/json', 'image/svg+xml'))
+
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Pages are compressed per request so favour speed, static files once at build time so favour size.
+DYNAMIC_LEVELS = {'br': 5, 'gzip': 6}
+STATIC_LEVELS = {'br': 11, 'gzip': 9}
+
+FINGERPRINTED = re.compile(r'^(?P<root>.+)\.[0-9a-f]{10}(?P<ext>\.[^./]*)?$')
+
+_compressed = LRUCache(maxsize=256)
+_compressed_lock = threading.Lock()
+
+
+def encodings():
+    '''Encodings this Process can Compress with, Preferred First'''
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    # mtime=0 keeps the output the same for the same input
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _files(folder):
+    '''Paths of the Files under folder, Relative and with / Separators, Precompressed Copies Left Out'''
+    for directory, _, names in os.walk(folder):
+        for name in sorted(names):
+            if os.path.splitext(name)[1] not in ('.gz', '.br'):
+                yield os.path.relpath(os.path.join(directory, name), folder).replace(os.sep, '/')
+
+
+class Manifest:
+    '''Fingerprinted Names and Precompressed Copies of the Files under static/'''
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.names = {}     # css/index.css -> css/index.3f2a9c1b0e.css
+        self.sources = {}   # and back
+        self.variants = {}  # css/index.css -> encodings with an up to date copy on disk
+        for path in _files(folder):
+            full = os.path.join(folder, path)
+            with open(full, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:10]
+            root, ext = os.path.splitext(path)
+            name = '%s.%s%s' % (root, digest, ext)
+            self.names[path] = name
+            self.sources[name] = path
+            modified = os.path.getmtime(full)
+            variants = [encoding for encoding, suffix in SUFFIXES.items()
+                        if os.path.exists(full + suffix) and os.path.getmtime(full + suffix) >= modified]
+            if variants:
+                self.variants[path] = variants
+
+
+def _fingerprint(endpoint, values):
+    '''url_for Hook, Swaps a Static Filename for its Fingerprinted One'''
+    if endpoint == 'static' and 'filename' in values:
+        names = current_app.extensions['assets'].names
+        values['filename'] = names.get(values['filename'], values['filename'])
+
+
+def serve_static(filename):
+    '''The Static Route, Fingerprinted Names are Cached for Good'''
+    manifest = current_app.extensions['assets']
+    source = manifest.sources.get(filename)
+    if source is None:
+        # A plain name, or a fingerprint from before the file changed (a page cached across a deploy)
+        match = FINGERPRINTED.match(filename)
+        if match and match.group('root') + (match.group('ext') or '') in manifest.names:
+            filename = match.group('root') + (match.group('ext') or '')
+        return current_app.send_static_file(filename)
+
+    variants = manifest.variants.get(source, ())
+    encoding = request.accept_encodings.best_match(variants) if variants else None
+    if encoding:
+        response = send_from_directory(
+            manifest.folder, source + SUFFIXES[encoding], max_age=IMMUTABLE_MAX_AGE,
+            mimetype=mimetypes.guess_type(source)[0] or 'application/octet-stream')
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(manifest.folder, source, max_age=IMMUTABLE_MAX_AGE)
+    if variants:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+
+def _compress(response):
+    '''Compress Large Enough Text Responses when the Client Accepts it'''
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE):
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(encodings())
+    if encoding is None:
+        return response
+
+    etag, weak = response.get_etag()
+    key = (etag, encoding)
+    body = None
+    if etag and not weak:
+        with _compressed_lock:
+            body = _compressed.get(key)
+    if body is None:
+        body = compress(data, encoding, DYNAMIC_LEVELS[encoding])
+        if etag and not weak:
+            with _compressed_lock:
+                _compressed[key] = body
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        # Different bytes for the same page, a weak ETag still matches the client's If-None-Match
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    '''Fingerprint static/ and Register the Compression Hook, each only when Configured'''
+    if app.config.get('STATIC_FINGERPRINT') and not app.debug:
+        app.extensions['assets'] = Manifest(app.static_folder)
+        app.url_defaults(_fingerprint)
+        app.view_functions['static'] = serve_static
+    if app.config.get('COMPRESS'):
+        app.after_request(_compress)
+
+
+def build(folder):
+    '''Write Precompressed Copies of the Text Files under folder, Returns Bytes before and after per Encoding'''
+    totals = {encoding: [0, 0] for encoding in encodings()}
+    for path in _files(folder):
+        if mimetypes.guess_type(path)[0] not in COMPRESSIBLE:
+            continue
+        full = os.path.join(folder, path)
+        with open(full, 'rb') as f:
+            data = f.read()
+        for encoding in encodings():
+            body = compress(data, encoding, STATIC_LEVELS[encoding])
+            target = full + SUFFIXES[encoding]
+            if len(body) >= len(data):
+                # Too small to gain anything, the file is sent as it is
+                if os.path.exists(target):
+                    os.remove(target)
+                body = data
+            else:
+                with open(target + '.tmp', 'wb') as f:
+                    f.write(body)
+                os.replace(target + '.tmp', target)
+            totals[encoding][0] += len(data)
+            totals[encoding][1] += len(body)
+    return totals
@@ -0,0 +1,189 @@
+"""
+Accounts: registering, logging in and out, deleting an account, and the cached
+identity Flask-Login hands every request as current_user.
+"""
+from datetime import datetime
+import os
+import threading
+
+from cachetools import cached, TTLCache
+from flask import Blueprint, flash, redirect, render_template, request
+from flask_login import UserMixin, current_user, login_required, login_user, logout_user
+from flask_wtf import FlaskForm
+from wtforms import PasswordField, StringField, SubmitField
+from wtforms.validators import InputRequired, Length, ValidationError
+
+from extensions import db, hasher, job_queue, login_manager, login_throttle
+from models import NewStory, User
+from stories import story_genres
+import counters
+import hashing
+import page_cache
+import search
+
+
+bp = Blueprint('auth', __name__)
+
+# Logged in users are looked up once per USER_CACHE_TTL seconds per worker instead of on every request.
+# Read here rather than from app.config, the cache is built when the module is imported.
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
+
+
+###################################################
+#               User Identity                     #
+###################################################
+
+@login_manager.user_loader
+def load_user(user_id):
+    # Cached, see user_identity(). A deleted account is logged out on every worker within USER_CACHE_TTL
+    return user_identity(int(user_id))
+
+
+class UserIdentity(UserMixin):
+    '''current_user for a Request, the Id and Username without the Row'''
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+
+# Per worker, so most requests from a logged in user run no query for them at all. Routes that need more
+# than the id and username load the row themselves. forget_user() drops an entry on this worker, the
+# others catch up when the TTL runs out.
+@cached(TTLCache(maxsize=4096, ttl=USER_CACHE_TTL), lock=threading.Lock())
+def user_identity(user_id):
+    '''Identity of a Live Account, None once it is Deleted'''
+    row = db.session.query(User.id, User.username).filter_by(id=user_id, deleted_at=None).first()
+    return UserIdentity(row.id, row.username) if row else None
+
+
+def forget_user(user_id):
+    with user_identity.cache_lock:
+        user_identity.cache.pop(user_identity.cache_key(user_id), None)
+
+
+class RegisterForm(FlaskForm):
+    username = StringField(validators=[InputRequired(), Length(min=4, max=20)], render_kw={"placeholder" : "Username"})
+    password = PasswordField(validators=[InputRequired(), Length(min=4, max=20)], render_kw={"placeholder" : "Password"})
+    submit = SubmitField("Register")
+    
+    def validate_username(self, username):
+        '''Restrict Usernames to only Unique'''
+        existing_user_username = User.query.filter_by(username=username.data).first()
+        if existing_user_username:
+            raise ValidationError("Username Exists, try again..")
+
+
+class LoginForm(FlaskForm):
+    username = StringField(validators=[InputRequired(), Length(min=4, max=20)], render_kw={"placeholder" : "Username"})
+    password = PasswordField(validators=[InputRequired(), Length(min=4, max=20)], render_kw={"placeholder" : "Password"})
+    submit = SubmitField("Login")
+
+
+class DeleteAccountForm(FlaskForm):
+    password = PasswordField(validators=[InputRequired(), Length(min=4, max=20)], render_kw={"placeholder" : "Password"})
+    submit = SubmitField("Delete My Account")
+
+
+###################################################
+#                 Login Routes                    #
+###################################################
+
+@bp.route('/register/', methods=['GET', 'POST'])
+def register():
+    '''First Time Register'''
+    form = RegisterForm()
+    if form.validate_on_submit():
+        try:
+            hashed_password = hasher.hash_password(form.password.data)
+        except hashing.HashingBusy:
+            flash("The bar is packed right now, try again in a moment.")
+            return render_template('register.html', form=form), 503
+        new_user = User(username=form.username.data, password=hashed_password)
+        db.session.add(new_user)
+        db.session.commit()
+        # SQLite can hand out a deleted account's id again, and that id may be cached as deleted
+        forget_user(new_user.id)
+        return redirect('/')
+
+    return render_template('register.html', form=form)
+
+
+
+@bp.route('/login/', methods=['GET', 'POST'])
+def login():
+    '''Central Login'''
+    form = LoginForm()
+    if form.validate_on_submit():
+        # The client's address as our proxy saw it, ProxyFix takes it from X-Forwarded-For (see main.py)
+        if not login_throttle.allow(request.remote_addr):
+            flash("Too many login attempts, take a breather and try again in a minute.")
+            return render_template('login.html', form=form), 429
+
+        user = User.query.filter_by(username=form.username.data, deleted_at=None).first()
+        if user:
+            try:
+                if hasher.check_password(user.password, form.password.data):
+                    # Hashes made under an older BCRYPT_LOG_ROUNDS are upgraded while we have the password
+                    if hasher.needs_rehash(user.password):
+                        try:
+                            user.password = hasher.hash_password(form.password.data)
+                            db.session.commit()
+                        except hashing.HashingBusy:
+                            # The password checked out, the old hash does for now and is upgraded next time
+                            pass
+                    login_user(user)
+                    return redirect('/')
+            except hashing.HashingBusy:
+                flash("The bar is packed right now, try again in a moment.")
+                return render_template('login.html', form=form), 503
+
+    return render_template('login.html', form=form)
+
+
+
+@bp.route('/logout/', methods=['GET', 'POST'])
+@login_required
+def logout():
+    logout_user()
+    return redirect('/')
+
+
+
+@bp.route('/delete_account/', methods=['GET', 'POST'])
+@login_required
+def delete_account():
+    '''Delete the Current User, their Stories and Merge Requests'''
+    form = DeleteAccountForm()
+    if form.validate_on_submit():
+        account = db.session.get(User, current_user.id)
+        try:
+            if not hasher.check_password(account.password, form.password.data):
+                flash("That password doesn't match.")
+                return render_template('delete_account.html', form=form)
+        except hashing.HashingBusy:
+            flash("The bar is packed right now, try again in a moment.")
+            return render_template('delete_account.html', form=form), 503
+
+        # Everything is hidden in this one commit, the rows themselves are purged in the background.
+        user_id = current_user.id
+        now = datetime.utcnow()
+        story_ids = [story_id for (story_id,) in db.session.query(NewStory.id).filter_by(author_id=user_id, deleted_at=None)]
+        NewStory.query.filter(NewStory.id.in_(story_ids)).update({'deleted_at': now}, synchronize_session=False)
+        for story_id in story_ids:
+            search.remove_story(db.session.connection(), story_id)
+            counters.forget_story(db.session.connection(), story_id)
+        account.deleted_at = now
+        job_queue.enqueue('purge_user', {'user_id': user_id}, key='purge_user:%d' % user_id)
+        db.session.commit()
+        forget_user(user_id)
+
+        # Invalidated here rather than queued, deleted stories must not be served again even for a moment
+        story_genres.cache_clear()
+        for story_id in story_ids:
+            page_cache.invalidate('story', story_id)
+        page_cache.invalidate('user', user_id)
+        logout_user()
+        return redirect('/')
+
+    return render_template('delete_account.html', form=form)
@@ -0,0 +1,121 @@
+"""
+Startup time and memory of the web process.
+
+Reports the median time to `import main` in a fresh interpreter, then starts gunicorn
+with gunicorn.conf.py with and without --preload and reports
+|-- boot      seconds from launch until every worker has finished loading the app
+|-- scale     seconds from `kill -TTIN` until the extra worker is ready
+|-- pss       proportional set size of the master and its workers after some requests
+
+run from the repo root:
+|-- python benchmarks/boot.py
+|-- python benchmarks/boot.py --workers 8 --imports 20
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness
+
+# Runs gunicorn.conf.py and adds a hook that records each worker once it can serve
+WRAPPER = '''
+exec(open(%r).read())
+
+def post_worker_init(worker):
+    with open(%r, 'a') as f:
+        f.write('%%d\\n' %% worker.pid)
+'''
+
+
+def import_time(env, imports):
+    times = []
+    for _ in range(imports):
+        output = subprocess.run(
+            [sys.executable, '-c', 'import time\nstart = time.perf_counter()\nimport main\n'
+             'print(time.perf_counter() - start)'],
+            cwd=harness.ROOT, env=env, check=True, capture_output=True, text=True).stdout
+        times.append(float(output))
+    return statistics.median(times)
+
+
+def ready(path, count, timeout=60):
+    '''Wait until count Workers have Written their pid'''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            with open(path) as f:
+                pids = [int(line) for line in f if line.strip()]
+            if len(pids) >= count:
+                return pids
+        time.sleep(0.005)
+    raise RuntimeError('workers did not start')
+
+
+def pss(pid):
+    with open('/proc/%d/smaps_rollup' % pid) as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def serve(env, port, workers, preload, requests):
+    directory = tempfile.mkdtemp()
+    pids_path = os.path.join(directory, 'pids')
+    config = os.path.join(directory, 'gunicorn.conf.py')
+    with open(config, 'w') as f:
+        f.write(WRAPPER % (os.path.join(harness.ROOT, 'gunicorn.conf.py'), pids_path))
+    env = dict(env, GUNICORN_PRELOAD='1' if preload else '0')
+
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        ['gunicorn', 'main:app', '-c', config, '-b', '127.0.0.1:%d' % port, '-w', str(workers)],
+        cwd=harness.ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        pids = ready(pids_path, workers)
+        boot = time.perf_counter() - start
+
+        start = time.perf_counter()
+        process.send_signal(signal.SIGTTIN)
+        pids = ready(pids_path, workers + 1)
+        scale = time.perf_counter() - start
+
+        for _ in range(requests):
+            urllib.request.urlopen('http://127.0.0.1:%d/' % port).read()
+        memory = pss(process.pid) + sum(pss(pid) for pid in pids)
+    finally:
+        process.terminate()
+        process.wait()
+    return boot, scale, memory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--imports', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--port', type=int, default=8131)
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=harness.temporary_database(), secret='boot',
+               BCRYPT_POOL_WORKERS='0', PAGE_CACHE='off')
+    harness.create_all(env)
+
+    print(f"import main   {import_time(env, args.imports) * 1000:6.0f} ms (median of {args.imports})")
+    for preload in (False, True):
+        boot, scale, memory = serve(env, args.port, args.workers, preload, args.requests)
+        label = 'preload' if preload else 'no preload'
+        print(f"{label:12}  boot {boot:5.2f} s  scale {scale * 1000:5.0f} ms  "
+              f"pss {memory / 2 ** 20:6.1f} MiB ({args.workers + 1} workers + master)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Latency benchmark for diff_engine on novella length stories.
+
+Builds a ~100k word story, then forks it a few ways (a handful of edited paragraphs,
+scattered word edits, a rewritten chapter) and times diff_html on each. The same story
+with an empty paragraph between each pair of paragraphs, the blocks that repeat most in
+real stories, is diffed with scattered edits and with its halves swapped.
+
+run from the repo root:
+|-- python benchmarks/diff_bench.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import diff_engine
+
+
+WORDS = ['the', 'bar', 'night', 'stranger', 'whiskey', 'rain', 'door', 'story', 'old', 'light', 'quiet', 'road',
+         'glass', 'smoke', 'river', 'letter', 'morning', 'train', 'voice', 'window']
+
+
+def paragraph(rng, words=80):
+    return '<p>' + ' '.join(rng.choice(WORDS) for _ in range(words)) + '.</p>\n'
+
+
+def story(rng, total_words=100_000, words=80):
+    paragraphs = [paragraph(rng, words) for _ in range(total_words // words)]
+    return paragraphs
+
+
+def spaced(paragraphs, blank='<p>&nbsp;</p>\n'):
+    '''An Empty Paragraph after every Paragraph'''
+    return [block for paragraph in paragraphs for block in (paragraph, blank)]
+
+
+def edited_paragraphs(rng, paragraphs, count=10, words=80):
+    paragraphs = list(paragraphs)
+    for _ in range(count):
+        paragraphs[rng.randrange(len(paragraphs))] = paragraph(rng, words)
+    return paragraphs
+
+
+def scattered_words(rng, paragraphs, count=200):
+    paragraphs = list(paragraphs)
+    for _ in range(count):
+        index = rng.randrange(len(paragraphs))
+        words = paragraphs[index].split(' ')
+        words[rng.randrange(1, len(words) - 1)] = rng.choice(WORDS).upper()
+        paragraphs[index] = ' '.join(words)
+    return paragraphs
+
+
+def rewritten_chapter(rng, paragraphs, size=150):
+    paragraphs = list(paragraphs)
+    start = rng.randrange(len(paragraphs) - size)
+    paragraphs[start:start + size] = [paragraph(rng) for _ in range(size)]
+    return paragraphs
+
+
+def main():
+    rng = random.Random(11)
+    original = story(rng)
+    old_html = ''.join(original)
+    print(f"story: {len(old_html.split())} words, {len(original)} paragraphs")
+
+    cases = [
+        ('10 edited paragraphs', edited_paragraphs(rng, original)),
+        ('200 scattered word edits', scattered_words(rng, original)),
+        ('rewritten 150 paragraph chapter', rewritten_chapter(rng, original)),
+        ('identical', original),
+    ]
+    for name, fork in cases:
+        run(name, old_html, fork)
+
+    rng = random.Random(11)
+    original = story(rng, words=20)
+    print(f"spaced story: {len(original)} paragraphs of 20 words, an empty paragraph after each")
+    half = len(original) // 2
+    cases = [
+        ('300 edited paragraphs', edited_paragraphs(rng, original, count=300, words=20)),
+        ('halves swapped', original[half:] + original[:half]),
+    ]
+    old_html = ''.join(spaced(original))
+    for name, fork in cases:
+        run(name, old_html, spaced(fork))
+
+
+def run(name, old_html, fork):
+    new_html = ''.join(fork)
+    start = time.perf_counter()
+    diff = diff_engine.diff_html(old_html, new_html)
+    elapsed = time.perf_counter() - start
+    print(f"{name:34} {elapsed * 1000:8.1f} ms  +{diff.words_added} -{diff.words_removed}")
+
+
+if __name__ == '__main__':
+    main()
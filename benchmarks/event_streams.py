@@ -0,0 +1,111 @@
+"""
+Merge request notifications over /events with many idle streams open.
+
+Starts gunicorn with several workers on a temporary SQLite database and opens idle
+/events streams for a crowd of readers. Then:
+|-- a story owner listens while a forker submits merge requests, and the time from the
+|   POST to the event arriving on the owner's stream is measured (often across workers)
+|-- /story_db/ is read throughout, to show page latency with the streams held open
+|-- streams past EVENTS_MAX_CONNECTIONS are counted as refused, the server answers those
+|   with only a retry: of EVENTS_RETRY_AFTER seconds or more and closes them
+
+run from the repo root:
+|-- python benchmarks/event_streams.py
+|-- python benchmarks/event_streams.py --listeners 400 --gunicorn-args "-w 4 -k gthread --threads 128"
+The owner's stream opens last, so with more listeners than the workers allow it may be
+the one refused and no events arrive.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from harness import Gunicorn, client, create_all, login, post_form, request, temporary_database
+
+RETRY_AFTER = 30
+
+
+def register(base, username):
+    opener = client()
+    post_form(opener, base + '/register/', {'username': username, 'password': username})
+    login(opener, base, username, username)
+    return opener
+
+
+def listen(opener, url, received, opened):
+    '''Read one Stream until the Server Closes it, Recording (event, arrival time)'''
+    try:
+        response = opener.open(url)
+    except urllib.error.HTTPError as e:
+        opened.append(e.code)
+        return
+    # Anything but a stream means the login didn't take and /events redirected to the login page
+    if response.headers.get_content_type() != 'text/event-stream':
+        opened.append('login')
+        return
+    event = None
+    for line in response:
+        line = line.decode().strip()
+        if line.startswith('retry: '):
+            # An open stream asks for 5 s, a refused one for EVENTS_RETRY_AFTER or more
+            opened.append('refused' if int(line[len('retry: '):]) >= RETRY_AFTER * 1000 else response.status)
+        elif line.startswith('event: '):
+            event = line[len('event: '):]
+        elif line.startswith('data: ') and event:
+            received.append((event, time.perf_counter()))
+            event = None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listeners', type=int, default=24, help='idle readers holding a stream open')
+    parser.add_argument('--requests', type=int, default=10, help='merge requests to time')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--gunicorn-args', default='-w 2 -k gthread --threads 128 --graceful-timeout 1')
+    args = parser.parse_args()
+
+    env = dict(os.environ, secret='event-streams', DATABASE_URL=temporary_database(), BCRYPT_LOG_ROUNDS='4',
+               LOGIN_ATTEMPTS='100000',
+               EVENTS_PATH=os.path.join(tempfile.mkdtemp(), 'events.db'), EVENTS_HEARTBEAT='5', EVENTS_MAX_AGE='60',
+               EVENTS_RETRY_AFTER=str(RETRY_AFTER))
+    create_all(env)
+    with Gunicorn(args.port, env, args.gunicorn_args) as server:
+        base = server.base
+        owner, forker = register(base, 'owner'), register(base, 'forker')
+        post_form(owner, base + '/writer/', {'title': 'Events', 'genre': 'Test', 'content': '<p>Once upon a time.</p>'})
+
+        opened = []
+        idle = [threading.Thread(target=listen, args=(register(base, 'reader%d' % i), base + '/events', [], opened),
+                                 daemon=True) for i in range(args.listeners)]
+        for thread in idle:
+            thread.start()
+        received = []
+        threading.Thread(target=listen, args=(owner, base + '/events', received, opened), daemon=True).start()
+        time.sleep(2)
+
+        delays, reads = [], []
+        for i in range(args.requests):
+            sent = time.perf_counter()
+            request(forker, base + '/update/1', {'content': '<p>Fork %d.</p>' % i, 'initiate_merge_request': 'true'})
+            while len(received) <= i and time.perf_counter() - sent < 10:
+                start = time.perf_counter()
+                request(client(), base + '/story_db/')
+                reads.append(time.perf_counter() - start)
+            if len(received) > i:
+                delays.append(received[i][1] - sent)
+
+    print(f"streams opened: {opened.count(200)}, refused: {opened.count('refused')}, not logged in: {opened.count('login')}")
+    print(f"events delivered: {len(delays)}/{args.requests}")
+    if delays:
+        print(f"delivery  median {statistics.median(delays) * 1000:.0f} ms  max {max(delays) * 1000:.0f} ms")
+    if reads:
+        reads.sort()
+        print(f"/story_db/ median {statistics.median(reads) * 1000:.1f} ms  p95 {reads[int(len(reads) * 0.95)] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Throughput and memory of `flask export` and `flask import` as the library grows.
+
+For each size seeds a library on a temporary SQLite database, exports it, then
+imports the file into a second empty database, and reports rows per second and the
+peak Python memory (tracemalloc) of each step. Only one batch of rows is held at a
+time, so the peak follows --batch-size and stays flat as the library grows past a
+batch of stories.
+
+run from the repo root:
+|-- python benchmarks/export_import.py
+|-- python benchmarks/export_import.py --versions 5000 --batch-size 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('secret', 'export-import')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'unused.db')
+os.environ['BCRYPT_POOL_WORKERS'] = '0'
+os.environ['PAGE_CACHE'] = 'off'
+
+
+def measured(run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = run()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--versions', type=int, nargs='+', default=[20000, 60000])
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    from main import create_app
+    from extensions import db
+    import corpus
+    import seed
+
+    for versions in args.versions:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'library.jsonl.gz')
+        source = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'source.db')})
+        target = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'target.db')})
+        with source.app_context():
+            db.create_all()
+            written = seed.generate(users=versions // 50, stories=versions // 10, versions=versions, seed=1,
+                                    progress=lambda _: None)
+            _, export_seconds, export_peak = measured(
+                lambda: corpus.export_corpus(path, batch_size=args.batch_size, progress=lambda _: None))
+        with target.app_context():
+            db.create_all()
+            _, import_seconds, import_peak = measured(
+                lambda: corpus.import_corpus(path, batch_size=args.batch_size, progress=lambda _: None))
+
+        rows = sum(written.values())
+        print(f"{rows:8} rows, {os.path.getsize(path) / 2 ** 20:6.1f} MiB file  "
+              f"export {rows / export_seconds:7.0f} rows/s peak {export_peak / 2 ** 20:5.1f} MiB  "
+              f"import {rows / import_seconds:7.0f} rows/s peak {import_peak / 2 ** 20:5.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Shared helpers for the benchmarks that drive a real gunicorn server over HTTP.
+"""
+import http.cookiejar
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def client():
+    '''URL Opener that Keeps its own Session Cookie'''
+    return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+
+def request(opener, url, data=None):
+    '''Status Code of a GET (or POST when data is given), Errors Included'''
+    body = urllib.parse.urlencode(data, doseq=True).encode() if data is not None else None
+    try:
+        with opener.open(url, body) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def post_form(opener, url, fields):
+    '''POST a FlaskForm Page, Picking up its CSRF Token First'''
+    page = opener.open(url).read().decode()
+    token = _CSRF.search(page)
+    if token:
+        fields = dict(fields, csrf_token=token.group(1))
+    return request(opener, url, fields)
+
+
+def login(opener, base, username, password):
+    return post_form(opener, base + '/login/', {'username': username, 'password': password})
+
+
+def temporary_database():
+    return 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+
+def create_all(env):
+    subprocess.run([sys.executable, '-c', 'from main import app, db\nwith app.app_context(): db.create_all()'],
+                   cwd=ROOT, env=env, check=True)
+
+
+class Gunicorn:
+    '''gunicorn main:app, and the Procfile's Job Worker Process, for the Length of a with Block'''
+
+    def __init__(self, port, env, args=''):
+        self.base = 'http://127.0.0.1:%d' % port
+        self.port = port
+        self.env = env
+        self.args = args
+        self.process = None
+        self.worker = None
+
+    def __enter__(self):
+        self.worker = subprocess.Popen(
+            [sys.executable, '-m', 'flask', '--app', 'main', 'run-jobs'],
+            cwd=ROOT, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.process = subprocess.Popen(
+            ['gunicorn', 'main:app', '-b', '127.0.0.1:%d' % self.port] + shlex.split(self.args),
+            cwd=ROOT, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(200):
+            try:
+                urllib.request.urlopen(self.base + '/')
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.__exit__()
+        raise RuntimeError('gunicorn did not start')
+
+    def __exit__(self, *exc):
+        for process in (self.process, self.worker):
+            process.terminate()
+            process.wait()
+        return False
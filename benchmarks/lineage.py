@@ -0,0 +1,107 @@
+"""
+Common ancestor of two forks, closure table vs walking the parent pointers.
+
+Seeds a library on a temporary SQLite database, rebuilds version_lineage and, for
+random pairs of forks of the same story, finds the closest version both descend from:
+|-- walk     a recursive CTE up each fork's parent_version_id chain, joined
+|-- closure  lineage.common_ancestor(), one join of version_lineage on itself
+Both are checked against the parent pointers walked in Python.
+
+run from the repo root:
+|-- python benchmarks/lineage.py
+|-- python benchmarks/lineage.py --stories 200 --versions 200000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('secret', 'lineage')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'lineage.db')
+
+WALK = (
+    "WITH RECURSIVE a(id, depth) AS ("
+    "  SELECT :first, 0 UNION ALL"
+    "  SELECT v.parent_version_id, a.depth + 1 FROM new_version v JOIN a ON v.id = a.id"
+    "  WHERE v.parent_version_id IS NOT NULL"
+    "), b(id) AS ("
+    "  SELECT :second UNION ALL"
+    "  SELECT v.parent_version_id FROM new_version v JOIN b ON v.id = b.id"
+    "  WHERE v.parent_version_id IS NOT NULL"
+    ") SELECT a.id FROM a JOIN b ON b.id = a.id ORDER BY a.depth LIMIT 1")
+
+
+def expected(parents, first, second):
+    '''The Same Answer from the Parent Pointers in Memory'''
+    chain = set()
+    version = second
+    while version is not None:
+        chain.add(version)
+        version = parents[version]
+    version = first
+    while version is not None and version not in chain:
+        version = parents[version]
+    return version
+
+
+def timed(run, pairs):
+    times, answers = [], []
+    for first, second in pairs:
+        start = time.perf_counter()
+        answers.append(run(first, second))
+        times.append(time.perf_counter() - start)
+    return answers, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--stories', type=int, default=100)
+    parser.add_argument('--versions', type=int, default=50000)
+    parser.add_argument('--pairs', type=int, default=500)
+    args = parser.parse_args()
+
+    from sqlalchemy import text
+    from main import app, db
+    from models import NewVersion
+    import lineage
+    import seed
+    with app.app_context():
+        db.create_all()
+        seed.generate(users=args.users, stories=args.stories, versions=args.versions, merge_rate=0.0, paragraphs=1,
+                      seed=1, progress=lambda _: None)
+        connection = db.session.connection()
+        lineage.rebuild(connection)
+        db.session.commit()
+
+        rows = db.session.query(NewVersion.id, NewVersion.parent_version_id, NewVersion.story_id).all()
+        parents = {version_id: parent_id for version_id, parent_id, _ in rows}
+        forks = {}
+        for version_id, _, story_id in rows:
+            forks.setdefault(story_id, []).append(version_id)
+        rng = random.Random(1)
+        pairs = [tuple(rng.sample(versions, 2)) for versions in
+                 (forks[rng.choice(list(forks))] for _ in range(args.pairs)) if len(versions) > 1]
+
+        connection = db.session.connection()
+        walked, walk_time = timed(
+            lambda first, second: connection.execute(text(WALK), {'first': first, 'second': second}).scalar(), pairs)
+        closure, closure_time = timed(lambda first, second: lineage.common_ancestor(connection, first, second), pairs)
+        truth = [expected(parents, first, second) for first, second in pairs]
+        assert walked == truth, 'the parent walk disagrees with the parent pointers'
+        assert closure == truth, 'common_ancestor disagrees with the parent pointers'
+        shared = sum(answer is not None for answer in truth)
+
+    print(f"{args.stories} stories, {args.versions} versions, {len(pairs)} pairs, {shared} with a common fork")
+    print(f"walk     {walk_time * 1000:8.3f} ms")
+    print(f"closure  {closure_time * 1000:8.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Load test against the real routes.
+
+Seeds a temporary database with `flask seed-library`, starts gunicorn on it (or uses
+--url for a server that is already running), and has --concurrency logged in clients
+hit a weighted mix of routes for --duration seconds:
+|-- GET  /story_db/, /viewstory/<id>, /versions/<id>, /merge_requests/
+|-- POST /update/<id>
+Latency percentiles and throughput per route are written to --out as JSON, so runs
+from two releases can be diffed.
+
+run from the repo root:
+|-- python benchmarks/load_test.py
+|-- python benchmarks/load_test.py --users 10000 --stories 50000 --versions 1000000 --concurrency 32
+|-- python benchmarks/load_test.py --url http://127.0.0.1:8000 --password password
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+from harness import ROOT, Gunicorn, client, create_all, login, request, temporary_database
+
+
+# Share of requests that go to each route.
+MIX = [
+    ('story_db', 30),
+    ('view_story', 35),
+    ('versions', 15),
+    ('merge_requests', 10),
+    ('update', 10),
+]
+
+
+def discover(base):
+    '''Story Ids and Usernames Scraped from the Library and Directory Pages'''
+    story_ids = re.findall(r'/viewstory/(\d+)', urllib.request.urlopen(base + '/story_db/').read().decode())
+    usernames = re.findall(r'class="story-link">([^<]+)</a>', urllib.request.urlopen(base + '/user_dir/').read().decode())
+    if not story_ids or not usernames:
+        raise SystemExit('No stories or users found at %s, seed it first.' % base)
+    return [int(story_id) for story_id in story_ids], usernames
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0
+
+
+def summarize(samples, elapsed):
+    ordered = sorted(latency for latency, _ in samples)
+    ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status in samples if status >= 400),
+        'throughput_rps': round(len(samples) / elapsed, 2),
+        'p50_ms': ms(percentile(ordered, 0.50)),
+        'p95_ms': ms(percentile(ordered, 0.95)),
+        'p99_ms': ms(percentile(ordered, 0.99)),
+    }
+
+
+def drive(base, args):
+    story_ids, usernames = discover(base)
+    routes = [name for name, weight in MIX for _ in range(weight)]
+    samples = {name: [] for name, _ in MIX}
+    lock = threading.Lock()
+    deadline = time.time() + args.duration
+
+    def worker(number):
+        rng = random.Random(number)
+        opener = client()
+        login(opener, base, rng.choice(usernames), args.password)
+        while time.time() < deadline:
+            route = rng.choice(routes)
+            story_id = rng.choice(story_ids)
+            start = time.perf_counter()
+            if route == 'story_db':
+                status = request(opener, base + '/story_db/')
+            elif route == 'view_story':
+                status = request(opener, base + '/viewstory/%d' % story_id)
+            elif route == 'versions':
+                status = request(opener, base + '/versions/%d' % story_id)
+            elif route == 'merge_requests':
+                status = request(opener, base + '/merge_requests/')
+            else:
+                status = request(opener, base + '/update/%d' % story_id, {
+                    'content': '<p>Load test fork %d.</p>' % rng.randrange(10 ** 9),
+                    'initiate_merge_request': 'true'})
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[route].append((elapsed, status))
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    everything = [sample for route_samples in samples.values() for sample in route_samples]
+    return {
+        'routes': {name: summarize(route_samples, elapsed) for name, route_samples in samples.items()},
+        'total': summarize(everything, elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='Existing server to load instead of starting one')
+    parser.add_argument('--password', default='password', help='Password of the seeded users')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=int, default=20, help='seconds')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--stories', type=int, default=1000)
+    parser.add_argument('--versions', type=int, default=10000)
+    parser.add_argument('--port', type=int, default=8731)
+    parser.add_argument('--gunicorn-args', default='-w 2 -k gthread --threads 4')
+    parser.add_argument('--out', default='load_test.json')
+    args = parser.parse_args()
+
+    config = {name: getattr(args, name) for name in ('concurrency', 'duration', 'users', 'stories', 'versions',
+                                                      'gunicorn_args')}
+    if args.url:
+        results = drive(args.url, args)
+        config['url'] = args.url
+    else:
+        env = dict(os.environ, DATABASE_URL=temporary_database(), FLASK_APP='main.py')
+        env.setdefault('secret', 'load-test')
+        # Users share one password, and every client logs in, so throttling would only skew the numbers
+        env.setdefault('LOGIN_ATTEMPTS', '1000000')
+        create_all(env)
+        subprocess.run([sys.executable, '-m', 'flask', 'seed-library', '--users', str(args.users),
+                        '--stories', str(args.stories), '--versions', str(args.versions),
+                        '--password', args.password, '--seed', '1'], cwd=ROOT, env=env, check=True)
+        with Gunicorn(args.port, env, args.gunicorn_args) as server:
+            results = drive(server.base, args)
+
+    report = dict(results, config=config, finished=datetime.utcnow().isoformat() + 'Z')
+    with open(args.out, 'w') as out:
+        json.dump(report, out, indent=2)
+
+    for name, stats in list(results['routes'].items()) + [('total', results['total'])]:
+        print(f"{name:16} {stats['requests']:6} req  {stats['throughput_rps']:7.1f}/s  p50 {stats['p50_ms']:7.1f}  "
+              f"p95 {stats['p95_ms']:7.1f}  p99 {stats['p99_ms']:7.1f} ms  errors {stats['errors']}")
+    print(f"written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
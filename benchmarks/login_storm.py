@@ -0,0 +1,81 @@
+"""
+Story read latency under a login storm.
+
+Starts gunicorn on a temporary SQLite database, then has several clients hammer
+/login/ (each login is a full bcrypt check) while one client keeps reading
+/viewstory/<id>. Runs once with hashing inline in the web workers and once with the
+hashing pool, and prints the read latency for both.
+
+run from the repo root:
+|-- python benchmarks/login_storm.py
+|-- python benchmarks/login_storm.py --storm 16 --seconds 15 --gunicorn-args "-w 2 -k gthread --threads 8"
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+import urllib.request
+
+from harness import Gunicorn, client, create_all, login, post_form, temporary_database
+
+
+def seed(base):
+    opener = client()
+    post_form(opener, base + '/register/', {'username': 'storm', 'password': 'storm'})
+    login(opener, base, 'storm', 'storm')
+    post_form(opener, base + '/writer/', {'title': 'Storm', 'genre': 'Test', 'content': '<p>Once upon a time.</p>' * 200})
+
+
+def run(label, port, env, args):
+    env = dict(os.environ, **env, DATABASE_URL=temporary_database())
+    create_all(env)
+    with Gunicorn(port, env, args.gunicorn_args) as server:
+        base = server.base
+        seed(base)
+        story_url = base + '/viewstory/1'
+
+        stop = threading.Event()
+        logins = []
+
+        def storm():
+            opener = client()
+            while not stop.is_set():
+                logins.append(login(opener, base, 'storm', 'storm'))
+
+        threads = [threading.Thread(target=storm) for _ in range(args.storm)]
+        for thread in threads:
+            thread.start()
+        time.sleep(1)
+
+        reads = []
+        end = time.time() + args.seconds
+        while time.time() < end:
+            start = time.perf_counter()
+            urllib.request.urlopen(story_url).read()
+            reads.append(time.perf_counter() - start)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    reads.sort()
+    ms = lambda seconds: seconds * 1000
+    print(f"{label:8} reads {len(reads):5}  p50 {ms(statistics.median(reads)):7.1f} ms  "
+          f"p95 {ms(reads[int(len(reads) * 0.95)]):7.1f} ms  logins {len(logins)} "
+          f"(busy/throttled {sum(1 for code in logins if code in (429, 503))})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--storm', type=int, default=8, help='concurrent login clients')
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--gunicorn-args', default='-w 2 -k gthread --threads 4')
+    args = parser.parse_args()
+
+    common = {'secret': 'login-storm', 'PAGE_CACHE': 'off', 'LOGIN_ATTEMPTS': '1000000', 'BCRYPT_LOG_ROUNDS': '12'}
+    run('inline', 8711, dict(common, BCRYPT_POOL_WORKERS='0'), args)
+    run('pool', 8712, dict(common, BCRYPT_POOL_WORKERS='1', BCRYPT_QUEUE_DEPTH='2'), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Reading page cost for a novella length story.
+
+Writes one long story on a temporary SQLite database, then requests /viewstory/<id>,
+/read_version/<id> and the next part of each with the page cache off and reports the
+median response size, time and peak Python memory (tracemalloc) per request. After the
+first read a fork's parts are sliced from its cached content, not rebuilt per part.
+
+run from the repo root:
+|-- python benchmarks/long_story.py
+|-- python benchmarks/long_story.py --words 100000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('secret', 'long-story')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'long.db')
+os.environ['PAGE_CACHE'] = 'off'
+
+
+def measure(client, url, requests):
+    sizes, times, peaks = [], [], []
+    for _ in range(requests):
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = client.get(url)
+        times.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        sizes.append(len(response.data))
+    return statistics.median(sizes), statistics.median(times), statistics.median(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=40000)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+
+    from main import app, db
+    from models import NewVersion
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+
+    client = app.test_client()
+    client.post('/register/', data={'username': 'novelist', 'password': 'novelist'})
+    client.post('/login/', data={'username': 'novelist', 'password': 'novelist'})
+    paragraph = ' '.join('word%d' % i for i in range(100))
+    content = ''.join('<p>%s</p>' % paragraph for _ in range(args.words // 100))
+    client.post('/writer/', data={'title': 'Novella', 'genre': 'Test', 'content': content})
+    client.post('/update/1', data={'content': content + '<p>The end.</p>'})
+    with app.app_context():
+        version_id = db.session.query(NewVersion.id).scalar()
+
+    print(f"story of {args.words} words, {len(content) / 1024:.0f} KiB of html")
+    for url in ('/viewstory/1', '/viewstory/1/parts/1', '/read_version/%d' % version_id,
+                '/read_version/%d/parts/1' % version_id):
+        size, seconds, peak = measure(client, url, args.requests)
+        print(f"{url:24} {size / 1024:7.1f} KiB  {seconds * 1000:6.1f} ms  peak {peak / 1024:7.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Writer latency while a huge story is deleted.
+
+Seeds one story with many forks, then deletes it while another connection keeps
+committing small writes to a second story, and reports how long those writes waited.
+Runs twice, on a fresh copy of the data each time:
+|-- single   one DELETE of the story, the schema cascades remove every fork in one transaction
+|-- batched  purge.purge_story(), --batch-size rows per transaction and --pause between them
+
+run from the repo root:
+|-- python benchmarks/purge_load.py
+|-- python benchmarks/purge_load.py --versions 200000 --batch-size 1000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DIRECTORY = tempfile.mkdtemp()
+os.environ.setdefault('secret', 'purge-load')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(DIRECTORY, 'purge.db')
+
+
+def setup(versions):
+    from main import app, db
+    from models import NewStory
+    import seed
+    with app.app_context():
+        db.create_all()
+        seed.generate(users=10, stories=1, versions=versions, merge_rate=0.2, paragraphs=4, seed=1, progress=lambda _: None)
+        db.session.add(NewStory(title='Bystander', content='<p>Still here.</p>', author_id=1))
+        db.session.commit()
+
+
+def run(app, db, delete):
+    '''Time delete() while Another Connection Writes, returns (seconds, write latencies)'''
+    from sqlalchemy import text
+    stop = threading.Event()
+    latencies = []
+
+    def writer():
+        with app.app_context():
+            count = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                db.session.execute(text("UPDATE new_story SET title = :title WHERE title LIKE 'Bystander%'"),
+                                   {'title': 'Bystander %d' % count})
+                db.session.commit()
+                latencies.append(time.perf_counter() - start)
+                count += 1
+                time.sleep(0.005)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    time.sleep(0.2)
+    with app.app_context():
+        start = time.perf_counter()
+        delete()
+        elapsed = time.perf_counter() - start
+    stop.set()
+    thread.join()
+    return elapsed, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--versions', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.1)
+    args = parser.parse_args()
+
+    setup(args.versions)
+    from main import app, db
+    from sqlalchemy import text
+    import purge
+    database = os.path.join(DIRECTORY, 'purge.db')
+    pristine = os.path.join(DIRECTORY, 'pristine.db')
+    with app.app_context():
+        db.engine.dispose()
+    shutil.copy(database, pristine)
+
+    def single():
+        db.session.execute(text("DELETE FROM new_story WHERE id = 1"))
+        db.session.commit()
+
+    def batched():
+        purge.purge_story(db.session, 1, args.batch_size, args.pause)
+
+    print(f"story with {args.versions} forks")
+    for label, delete in (('single', single), ('batched', batched)):
+        with app.app_context():
+            db.engine.dispose()
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+        shutil.copy(pristine, database)
+        elapsed, latencies = run(app, db, delete)
+        with app.app_context():
+            left = db.session.execute(text("SELECT count(*) FROM new_version")).scalar()
+        print(f"{label:8} delete {elapsed:.2f}s  writes {len(latencies)}  "
+              f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms  max {latencies[-1] * 1000:.1f} ms  "
+              f"forks left {left}")
+
+
+if __name__ == '__main__':
+    main()
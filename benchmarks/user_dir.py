@@ -0,0 +1,83 @@
+"""
+Author directory by contribution score, aggregated per request vs read from user_stats.
+
+Seeds a library on a temporary SQLite database and times the query behind
+/user_dir/?sort=score both ways:
+|-- aggregate  scores counted per request, grouping over every story, version and merge request
+|-- counters   user_stats walked backwards along ix_user_stats_points (what user_dir() runs)
+
+run from the repo root:
+|-- python benchmarks/user_dir.py
+|-- python benchmarks/user_dir.py --users 5000 --versions 500000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('secret', 'user-dir')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'user_dir.db')
+
+AGGREGATE = (
+    "SELECT u.id, u.username, coalesce(s.n, 0) * %(story)d + coalesce(v.n, 0) * %(fork)d "
+    " + coalesce(m.n, 0) * %(merge)d AS points FROM \"user\" u "
+    "LEFT JOIN (SELECT author_id, count(*) AS n FROM new_story WHERE deleted_at IS NULL GROUP BY author_id) s "
+    " ON s.author_id = u.id "
+    "LEFT JOIN (SELECT v.author_id, count(*) AS n FROM new_version v JOIN new_story st ON st.id = v.story_id "
+    " WHERE st.deleted_at IS NULL GROUP BY v.author_id) v ON v.author_id = u.id "
+    "LEFT JOIN (SELECT m.requestor_id, count(*) AS n FROM merging_request m JOIN new_story st ON st.id = m.story_id "
+    " WHERE m.status = 'Accepted' AND st.deleted_at IS NULL GROUP BY m.requestor_id) m ON m.requestor_id = u.id "
+    "WHERE u.deleted_at IS NULL AND points > 0 ORDER BY points DESC, u.id DESC")
+
+
+def timed(run, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = run()
+        times.append(time.perf_counter() - start)
+    return rows, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--stories', type=int, default=2000)
+    parser.add_argument('--versions', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    from sqlalchemy import text
+    from main import app, db
+    from models import User, UserStats
+    import counters
+    import seed
+    with app.app_context():
+        db.create_all()
+        seed.generate(users=args.users, stories=args.stories, versions=args.versions, merge_rate=0.2, paragraphs=1,
+                      seed=1, progress=lambda _: None)
+        counters.rebuild(db.session.connection())
+        db.session.commit()
+
+        aggregate = text(AGGREGATE % {'story': counters.STORY_POINTS, 'fork': counters.FORK_POINTS,
+                                      'merge': counters.MERGE_POINTS})
+        query = db.session.query(User.id, User.username, UserStats.points).join(
+            UserStats, UserStats.user_id == User.id).filter(User.deleted_at.is_(None), UserStats.points > 0).order_by(
+            UserStats.points.desc(), UserStats.user_id.desc())
+
+        expected, aggregate_time = timed(lambda: db.session.execute(aggregate).all(), args.repeat)
+        rows, counter_time = timed(query.all, args.repeat)
+        assert [tuple(row) for row in rows] == [tuple(row) for row in expected], 'counters disagree with the aggregate'
+
+    print(f"{args.users} users, {args.stories} stories, {args.versions} versions, {len(rows)} listed")
+    print(f"aggregate {aggregate_time * 1000:8.2f} ms")
+    print(f"counters  {counter_time * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
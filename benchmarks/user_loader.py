@@ -0,0 +1,66 @@
+"""
+Queries per request for a logged in user, with and without the user cache.
+
+Logs a user in on a temporary SQLite database with a small library and requests each
+page many times, counting SQL statements and timing the requests:
+|-- uncached  user_identity() is cleared before every request, one lookup each time (the old load_user)
+|-- cached    the identity comes from the per worker cache after the first request
+
+run from the repo root:
+|-- python benchmarks/user_loader.py
+|-- python benchmarks/user_loader.py --requests 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('secret', 'user-loader')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'users.db')
+os.environ['PAGE_CACHE_PATH'] = os.path.join(tempfile.mkdtemp(), 'page_cache.db')
+
+PAGES = ('/', '/story_db/', '/user_dir/', '/merge_requests/', '/viewstory/1')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200, help='requests per page and mode')
+    args = parser.parse_args()
+
+    from main import app, db
+    from auth import user_identity
+    import query_budget
+    import seed
+    with app.app_context():
+        db.create_all()
+        seed.generate(users=20, stories=50, versions=200, merge_rate=0.2, paragraphs=4, seed=1,
+                      progress=lambda _: None)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+
+    print(f"{'page':20} {'uncached':>22} {'cached':>22}")
+    for url in PAGES:
+        client.get(url)
+        results = []
+        for clear in (True, False):
+            queries, start = 0, time.perf_counter()
+            for _ in range(args.requests):
+                if clear:
+                    user_identity.cache_clear()
+                with app.app_context(), query_budget.QueryCounter(db.engine) as counter:
+                    client.get(url)
+                queries += counter.count
+            elapsed = (time.perf_counter() - start) / args.requests
+            results.append(f"{queries / args.requests:5.1f} q  {elapsed * 1000:6.2f} ms")
+        print(f"{url:20} {results[0]:>22} {results[1]:>22}")
+
+
+if __name__ == '__main__':
+    main()
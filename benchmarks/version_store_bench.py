@@ -0,0 +1,82 @@
+"""
+Size / latency benchmark for version_store.
+
+Builds a synthetic story with 1,000 versions (each one a small edit of the one before,
+the way forks come in through update()) and compares the bytes stored as full copies
+against the snapshot + delta chains, plus the cost of encoding and rebuilding.
+
+run from the repo root:
+|-- python benchmarks/version_store_bench.py
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import version_store
+
+
+VERSIONS = 1000
+PARAGRAPHS = 120
+WORDS = ['the', 'bar', 'night', 'stranger', 'whiskey', 'rain', 'door', 'story', 'old', 'light', 'quiet', 'road']
+
+
+def paragraph(rng):
+    return '<p>' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 90))) + '.</p>\n'
+
+
+def synthetic_versions(seed=7):
+    rng = random.Random(seed)
+    paragraphs = [paragraph(rng) for _ in range(PARAGRAPHS)]
+    for _ in range(VERSIONS):
+        edit = rng.random()
+        index = rng.randrange(len(paragraphs))
+        if edit < 0.6:
+            paragraphs[index] = paragraph(rng)
+        elif edit < 0.85:
+            paragraphs.insert(index, paragraph(rng))
+        else:
+            del paragraphs[index]
+        yield ''.join(paragraphs)
+
+
+def main():
+    chain = {}
+    texts = {}
+    full_bytes = stored_bytes = snapshots = 0
+    encode_times = []
+
+    base_id, base_text, depth = None, None, 0
+    for version_id, text in enumerate(synthetic_versions(), start=1):
+        start = time.perf_counter()
+        payload, is_delta = version_store.encode_version(text, base_text, depth)
+        encode_times.append(time.perf_counter() - start)
+
+        depth = depth + 1 if is_delta else 0
+        snapshots += not is_delta
+        chain[version_id] = (base_id if is_delta else None, payload)
+        texts[version_id] = text
+        full_bytes += len(text.encode('utf-8'))
+        stored_bytes += len(payload)
+        base_id, base_text = version_id, text
+
+    rebuild_times = []
+    for version_id in chain:
+        start = time.perf_counter()
+        rebuilt = version_store.rebuild(version_id, chain)
+        rebuild_times.append(time.perf_counter() - start)
+        assert rebuilt == texts[version_id], version_id
+
+    ms = lambda seconds: seconds * 1000
+    print(f"versions:          {VERSIONS} ({snapshots} snapshots, interval {version_store.SNAPSHOT_INTERVAL})")
+    print(f"full copies:       {full_bytes / 1024:.1f} KiB")
+    print(f"delta store:       {stored_bytes / 1024:.1f} KiB ({full_bytes / stored_bytes:.1f}x smaller)")
+    print(f"encode p50 / max:  {ms(statistics.median(encode_times)):.2f} ms / {ms(max(encode_times)):.2f} ms")
+    print(f"rebuild p50 / max: {ms(statistics.median(rebuild_times)):.2f} ms / {ms(max(rebuild_times)):.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
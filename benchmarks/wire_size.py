@@ -0,0 +1,98 @@
+"""
+Bytes on the wire for the landing page and the story list.
+
+Seeds a library on a temporary SQLite database, runs `flask build-assets` on static/,
+then loads / and /story_db/ the way a browser would, the page and every stylesheet it
+links, once cold and once more with what the first visit cached:
+|-- plain       compression and fingerprinting off, how the app used to serve
+|-- gzip / br   Accept-Encoding sent by the client (br only when the brotli package is installed)
+
+Counted bytes are the status line, headers and body of every response. A stylesheet
+cached as immutable is not requested again, anything else is revalidated with
+If-None-Match / If-Modified-Since.
+
+run from the repo root:
+|-- python benchmarks/wire_size.py
+|-- python benchmarks/wire_size.py --stories 500
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('secret', 'wire-size')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'wire.db')
+os.environ['PAGE_CACHE'] = 'off'
+
+_STYLESHEET = re.compile(r'<link rel="stylesheet" href="(/static/[^"]+)"')
+
+
+def wire_bytes(response):
+    head = len('HTTP/1.1 %s\r\n' % response.status) + sum(
+        len('%s: %s\r\n' % header) for header in response.headers.items()) + 2
+    size = head + len(response.data)
+    response.close()
+    return size
+
+
+def stylesheets(client, url):
+    '''Stylesheets a Page Links, Read from a Request that is not Counted'''
+    return _STYLESHEET.findall(client.get(url, headers={'Accept-Encoding': 'identity'}).get_data(as_text=True))
+
+
+def visit(client, urls, encoding, cache):
+    '''Request what a Browser would, Returns (bytes, requests) and Fills cache for the Next Visit'''
+    total = requests = 0
+    for url in urls:
+        conditional = cache.get(url, {})
+        if conditional == 'immutable':
+            continue
+        response = client.get(url, headers=dict(conditional, **{'Accept-Encoding': encoding}))
+        requests += 1
+        if 'immutable' in response.headers.get('Cache-Control', ''):
+            cache[url] = 'immutable'
+        else:
+            cache[url] = {key: value for key, value in (
+                ('If-None-Match', response.headers.get('ETag')),
+                ('If-Modified-Since', response.headers.get('Last-Modified'))) if value}
+        total += wire_bytes(response)
+    return total, requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--stories', type=int, default=200)
+    args = parser.parse_args()
+
+    import assets
+    for encoding, (before, after) in assets.build(os.path.join(ROOT, 'static')).items():
+        print(f"build-assets {encoding}: static text {before / 1024:.1f} KiB -> {after / 1024:.1f} KiB")
+
+    from main import app, create_app, db
+    import seed
+    with app.app_context():
+        db.create_all()
+        seed.generate(users=args.users, stories=args.stories, versions=args.stories, merge_rate=0.2,
+                      seed=1, progress=lambda _: None)
+
+    variants = [('plain', create_app({'COMPRESS': False, 'STATIC_FINGERPRINT': False}), 'identity')]
+    variants += [(encoding, app, encoding) for encoding in assets.encodings()[::-1]]
+    print(f"{'':14} {'':8} {'first visit':>20} {'repeat visit':>20}")
+    for url in ('/', '/story_db/'):
+        for label, variant, encoding in variants:
+            client = variant.test_client()
+            urls = [url] + stylesheets(client, url)
+            cache = {}
+            first, first_requests = visit(client, urls, encoding, cache)
+            repeat, repeat_requests = visit(client, urls, encoding, cache)
+            print(f"{url:14} {label:8} {first / 1024:8.1f} KiB {first_requests:2} req "
+                  f"{repeat / 1024:8.1f} KiB {repeat_requests:2} req")
+
+
+if __name__ == '__main__':
+    main()
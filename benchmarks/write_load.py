@@ -0,0 +1,103 @@
+"""
+Concurrent write load against /update/<id>.
+
+Starts several worker processes, each with its own app and engine (the way gunicorn
+workers run), all POSTing forks of the same story into one SQLite file. Reports how
+many requests failed with "database is locked" and the overall write throughput.
+
+run from the repo root:
+|-- python benchmarks/write_load.py
+|-- python benchmarks/write_load.py --workers 8 --requests 100
+Point DATABASE_URL at another database to load that instead of a temporary SQLite file.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _app():
+    os.environ.setdefault('secret', 'write-load')
+    from main import app
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app
+
+
+def setup():
+    app = _app()
+    from main import db
+    from models import NewStory
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    client.post('/register/', data={'username': 'loadtest', 'password': 'loadtest'})
+    client.post('/login/', data={'username': 'loadtest', 'password': 'loadtest'})
+    client.post('/writer/', data={'title': 'Load Test', 'genre': 'Test', 'content': '<p>Once upon a time.</p>'})
+    with app.app_context():
+        return NewStory.query.order_by(NewStory.id.desc()).first().id
+
+
+def worker(story_id, requests, results):
+    app = _app()
+    client = app.test_client()
+    client.post('/login/', data={'username': 'loadtest', 'password': 'loadtest'})
+    ok = failed = 0
+    latencies = []
+    for i in range(requests):
+        start = time.perf_counter()
+        try:
+            response = client.post('/update/%d' % story_id, data={
+                'content': '<p>Once upon a time.</p>\n<p>Fork %d from worker %d.</p>' % (i, os.getpid()),
+                'initiate_merge_request': 'true'})
+            # update() redirects to the library on success and answers 503 with the editor when the commit fails
+            if response.status_code == 302 and response.headers['Location'].endswith('/story_db/'):
+                ok += 1
+            else:
+                failed += 1
+        except Exception:
+            failed += 1
+        latencies.append(time.perf_counter() - start)
+    results.put((ok, failed, latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50, help='updates per worker')
+    args = parser.parse_args()
+
+    if 'DATABASE_URL' not in os.environ:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'write_load.db')
+    story_id = setup()
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(story_id, args.requests, results))
+                 for _ in range(args.workers)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    ok = sum(outcome[0] for outcome in outcomes)
+    failed = sum(outcome[1] for outcome in outcomes)
+    latencies = sorted(latency for outcome in outcomes for latency in outcome[2])
+    print(f"database:   {os.environ['DATABASE_URL']}")
+    print(f"workers:    {args.workers} x {args.requests} updates")
+    print(f"succeeded:  {ok}")
+    print(f"failed:     {failed}")
+    print(f"throughput: {ok / elapsed:.1f} writes/s")
+    print(f"p50 / p99:  {latencies[len(latencies) // 2] * 1000:.1f} ms / {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+flask CLI commands: the job worker, rebuilding derived tables, query budgets,
+seeding, purging, exporting and importing the library and precompressing static files.
+
+Registered by main.create_app() only when the app is loaded by the flask command,
+gunicorn workers never import this module.
+"""
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+import click
+from flask import Blueprint, current_app
+from sqlalchemy.orm import load_only
+
+from auth import user_identity
+from extensions import db, job_queue
+from models import NewStory, User
+import assets
+import corpus
+import counters
+import lineage
+import purge
+import query_budget
+import search
+
+
+# cli_group=None puts the commands at the top level, `flask run-jobs` rather than `flask commands run-jobs`
+bp = Blueprint('commands', __name__, cli_group=None)
+
+
+###################################################
+#                  CLI Commands                   # 
+###################################################
+
+@bp.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Run the jobs that are due and exit.')
+def run_jobs(once):
+    '''Job Worker, Runs Queued Jobs until Stopped'''
+    # Heroku sets DYNO, and a dyno's SQLite file is its own, so the web dyno's jobs would never be seen
+    if os.getenv('DYNO') and db.engine.url.get_backend_name() == 'sqlite':
+        raise click.ClickException(
+            "run-jobs on a dyno needs a shared DATABASE_URL such as PostgreSQL, this dyno's SQLite file "
+            "isn't the web dyno's. Set one, or scale the worker process to 0, the web dyno runs the jobs on SQLite.")
+    if once:
+        print(f"Ran {job_queue.run_pending()} jobs.")
+        return
+    current_app.logger.setLevel(logging.INFO)
+    # The dyno's SIGTERM lets the job in hand finish, an unfinished one is picked up again after JOBS_LEASE
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    job_queue.work(stop)
+
+
+
+@bp.cli.command('job-stats')
+def job_stats():
+    '''Queue Depth and Latency of the Job Queue'''
+    print(json.dumps(job_queue.stats(), indent=2))
+
+
+
+@bp.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    '''Rebuild the story_search Full Text Index from new_story'''
+    rows = db.session.query(NewStory.id, NewStory.title, NewStory.genre, NewStory.content).filter(
+        NewStory.deleted_at.is_(None)).yield_per(500)
+    count = search.rebuild(db.session.connection(), rows)
+    db.session.commit()
+    print(f"Indexed {count} stories.")
+
+
+
+# Most statements each page may run, including the Flask-Login user lookup a worker makes once per USER_CACHE_TTL.
+# A template that starts lazy loading per row will blow through these.
+QUERY_BUDGETS = {
+    'story_db': 3,
+    'versions': 3,
+    'view_merge_requests': 2,
+    'user_dir': 2,
+    'user_dir_stories': 3,
+}
+
+
+@bp.cli.command('check-query-budgets')
+def check_query_budgets():
+    '''Render Listing Pages against the Current Database and Fail when over Budget'''
+    story = NewStory.query.options(load_only(NewStory.id, NewStory.author_id)).first()
+    if story is None:
+        print("No stories to check against, write one first.")
+        return
+
+    pages = {
+        'story_db': '/story_db/',
+        'versions': '/versions/%d' % story.id,
+        'view_merge_requests': '/merge_requests/',
+        'user_dir': '/user_dir/',
+        'user_dir_stories': '/user_dir_stories/%d/' % story.author_id,
+    }
+    app = current_app._get_current_object()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(story.author_id)
+        session['_fresh'] = True
+
+    failures = []
+    engine = db.engine
+    for endpoint, url in pages.items():
+        # Own app context per page and a cold user cache, so nothing is reused from the last page
+        user_identity.cache_clear()
+        with app.app_context(), query_budget.QueryCounter(engine) as counter:
+            client.get(url)
+        try:
+            query_budget.assert_query_budget(counter, QUERY_BUDGETS[endpoint], url)
+            print(f"{url:30} {counter.count} / {QUERY_BUDGETS[endpoint]} queries")
+        except query_budget.QueryBudgetExceeded as e:
+            failures.append(str(e))
+
+    if failures:
+        raise SystemExit('\n\n'.join(failures))
+
+
+
+@bp.cli.command('seed-library')
+@click.option('--users', default=100, help='Users to create.')
+@click.option('--stories', default=500, help='Stories to create.')
+@click.option('--versions', default=5000, help='Forks (NewVersion rows) spread across the stories.')
+@click.option('--merge-rate', default=0.2, help='Share of forks that come with a merge request.')
+@click.option('--password', default='password', help='Password every generated user gets.')
+@click.option('--batch-size', default=1000, help='Rows per INSERT batch.')
+@click.option('--seed', default=None, type=int, help='Random seed for repeatable data.')
+def seed_library(users, stories, versions, merge_rate, password, batch_size, seed):
+    '''Bulk Generate a Synthetic Library for Load Testing'''
+    import seed as library_seed
+
+    start = time.perf_counter()
+    written = library_seed.generate(users, stories, versions, merge_rate=merge_rate, password=password,
+                                    batch_size=batch_size, seed=seed)
+    # Core INSERTs skip the ORM events, so the search index is rebuilt in one pass at the end
+    rows = db.session.query(NewStory.id, NewStory.title, NewStory.genre, NewStory.content).yield_per(500)
+    search.rebuild(db.session.connection(), rows)
+    lineage.rebuild(db.session.connection())
+    counters.rebuild(db.session.connection())
+    db.session.commit()
+    print(f"Wrote {written} in {time.perf_counter() - start:.1f}s.")
+
+
+
+@bp.cli.command('purge-deleted')
+def purge_deleted():
+    '''Finish Purging every Story and Account Marked Deleted'''
+    batch_size, pause = current_app.config['PURGE_BATCH_SIZE'], current_app.config['PURGE_PAUSE']
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.deleted_at.isnot(None))]
+    story_ids = [story_id for (story_id,) in db.session.query(NewStory.id).filter(
+        NewStory.deleted_at.isnot(None), NewStory.author_id.notin_(user_ids))]
+    for story_id in story_ids:
+        purge.purge_story(db.session, story_id, batch_size, pause)
+    for user_id in user_ids:
+        purge.purge_user(db.session, user_id, batch_size, pause)
+    print(f"Purged {len(story_ids)} stories and {len(user_ids)} accounts.")
+
+
+
+@bp.cli.command('rebuild-lineage')
+def rebuild_lineage():
+    '''Recompute the version_lineage Closure Table from parent_version_id'''
+    count = lineage.rebuild(db.session.connection())
+    db.session.commit()
+    print(f"Wrote {count} lineage rows.")
+
+
+@bp.cli.command('rebuild-counters')
+def rebuild_counters():
+    '''Recompute user_stats and story_stats from Scratch, Reporting Rows that had Drifted'''
+    connection = db.session.connection()
+    users_before, stories_before = counters.snapshot(connection)
+    counters.rebuild(connection)
+    users_after, stories_after = counters.snapshot(connection)
+    db.session.commit()
+    for label, before, after in (('users', users_before, users_after), ('stories', stories_before, stories_after)):
+        drifted = [key for key in before.keys() | after.keys() if before.get(key) != after.get(key)]
+        print(f"{len(after)} {label}, {len(drifted)} corrected{': ' + ', '.join(map(str, sorted(drifted)[:20])) if drifted else ''}")
+
+
+@bp.cli.command('export')
+@click.argument('path')
+@click.option('--batch-size', default=1000, help='Rows per gzip member and progress checkpoint.')
+def export_library(path, batch_size):
+    '''Stream every Live User, Story, Version and Merge Request to a .jsonl.gz File'''
+    print(corpus.export_corpus(path, batch_size=batch_size))
+
+
+@bp.cli.command('import')
+@click.argument('path')
+@click.option('--batch-size', default=1000, help='Rows per INSERT batch and transaction.')
+def import_library(path, batch_size):
+    '''Load a File Written by `flask export`, Appending to what the Database Holds'''
+    try:
+        print(corpus.import_corpus(path, batch_size=batch_size))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
+@bp.cli.command('build-assets')
+def build_assets():
+    '''Write the .gz/.br Copies of static/ that assets.py Serves'''
+    for encoding, (before, after) in assets.build(current_app.static_folder).items():
+        print(f"{encoding}: {before / 1024:.1f} KiB -> {after / 1024:.1f} KiB")
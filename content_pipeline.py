@@ -0,0 +1,107 @@
+"""
+Write-time content pipeline.
+
+Every story body goes through process() once, when it is written (writer, update
+and merge accept), rather than being cleaned or measured again on every read:
+|-- content          html run through one prebuilt bleach Cleaner
+|-- excerpt          the opening of the plain text, for listings
+|-- word_count       words in the plain text
+|-- reading_minutes  word_count at READING_WPM, at least 1
+|-- content_hash     sha256 of the cleaned html, cheap equality and cache keys
+|-- chunk_offsets    where the html splits into parts of about CHUNK_WORDS words, as a
+|                    json list of character offsets from 0 to len(content)
+
+NewStory and NewVersion both carry the derived columns, so listing and version pages
+render from them without loading the Text body or decoding a version payload, and the
+reading pages send a long story one part at a time.
+"""
+import hashlib
+import json
+import math
+import re
+import threading
+
+from diff_engine import blocks
+from search import plain_text
+
+
+# Allowed on top of bleach's own defaults
+EXTRA_TAGS = frozenset({'p', 'br', 'strong', 'em', 'u', 'h1', 'h2', 'h3', 'ul', 'ol', 'li', 'blockquote'})
+
+EXCERPT_LENGTH = 280
+READING_WPM = 200
+CHUNK_WORDS = 1500
+
+# Column names process() fills in besides content, shared by NewStory and NewVersion.
+DERIVED = ('excerpt', 'word_count', 'reading_minutes', 'content_hash', 'chunk_offsets')
+
+# Parts are cut between blocks, but never inside a list or quote, which would leave each half broken.
+_CONTAINER = re.compile(r'<(/?)(?:ul|ol|blockquote)\b', re.I)
+
+# A Cleaner builds its html5lib parser and filters once, but isn't thread safe, so one per thread.
+_local = threading.local()
+
+
+def _cleaner():
+    cleaner = getattr(_local, 'cleaner', None)
+    if cleaner is None:
+        # Imported on the first write, bleach and html5lib are a good part of a worker's boot and reads never need them
+        import bleach
+        tags = frozenset(bleach.sanitizer.ALLOWED_TAGS) | EXTRA_TAGS
+        cleaner = _local.cleaner = bleach.sanitizer.Cleaner(tags=tags, strip=True)
+    return cleaner
+
+
+def sanitize(html):
+    return _cleaner().clean(html or '')
+
+
+def excerpt(text, length=EXCERPT_LENGTH):
+    '''Cut Plain Text at a Word Boundary'''
+    if len(text) <= length:
+        return text
+    cut = text[:length - 3].rsplit(' ', 1)[0]
+    return cut.rstrip(' ,.;:') + '...'
+
+
+def chunk_offsets(clean, words=CHUNK_WORDS):
+    '''Offsets Splitting Html into Parts of about `words` Words at Block Boundaries, 0 First and len(clean) Last'''
+    offsets, position, count, depth = [0], 0, 0, 0
+    for block in blocks(clean):
+        position += len(block)
+        count += len(plain_text(block).split())
+        for closing in _CONTAINER.findall(block):
+            depth += -1 if closing else 1
+        if count >= words and depth <= 0 and position < len(clean):
+            offsets.append(position)
+            count = 0
+    offsets.append(len(clean))
+    return offsets
+
+
+def derive(clean):
+    '''DERIVED Columns for Html that is Already Clean'''
+    text = plain_text(clean)
+    words = len(text.split())
+    return {
+        'excerpt': excerpt(text),
+        'word_count': words,
+        'reading_minutes': max(1, math.ceil(words / READING_WPM)),
+        'content_hash': hashlib.sha256(clean.encode('utf-8')).hexdigest(),
+        'chunk_offsets': json.dumps(chunk_offsets(clean)),
+    }
+
+
+def process(html):
+    '''
+    Clean Html and Derive the Summary Columns
+    |-- returns a dict of content plus DERIVED, ready to pass as model keyword arguments
+    '''
+    clean = sanitize(html)
+    return dict(derive(clean), content=clean)
+
+
+def apply(target, processed):
+    '''Copy the DERIVED Columns onto a Model'''
+    for name in DERIVED:
+        setattr(target, name, processed[name])
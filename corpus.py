@@ -0,0 +1,328 @@
+"""
+Streaming export and import of the story corpus.
+
+`flask export library.jsonl.gz` writes every live user, story, version and merge
+request as one JSON object per line, gzip compressed, and `flask import
+library.jsonl.gz` writes them into another database. Neither holds more than one batch
+of rows in memory, whatever the size of the library.
+
+The file
+|-- a header line, {"format": "branchlibrary", "version": 1, ...}
+|-- user, new_story, new_version and merging_request rows, in that order and by id,
+|   {"table": "new_story", "id": 7, ...} with every column, version payloads base64
+|-- current_version rows, each story's current_version_id, which points forward at new_version
+Deleted stories and accounts are left out, and so are the tables rebuilt from these
+(version_lineage, story_search, user_stats, story_stats) and the job queue.
+
+Export reads each table through one streaming cursor (yield_per, a server side cursor
+on PostgreSQL). The highest id of every table is noted when it starts and nothing
+above it is written, so rows added while it runs can't leave the file pointing at
+rows it doesn't have. The file is a series of gzip members, one per batch, and
+FILE.state records where the last complete one ends. Run again after an interruption
+it truncates the file there and carries on after the last id written.
+
+Import adds each table's current highest id to the ids it reads, so an empty database
+gets the original ids and a populated one gets the rows after its own. Rows go in as
+executemany INSERTs, one transaction per batch, with SQLite's foreign key checks
+deferred to the commit. FILE.import-state keeps the offsets, run again after an
+interruption it skips the rows that made it in. The derived tables are rebuilt at the
+end, as `flask seed-library` does, and PostgreSQL's id sequences moved past the new rows.
+"""
+import base64
+from datetime import datetime
+import gzip
+import json
+import os
+import time
+
+from sqlalchemy import DateTime, LargeBinary, and_, bindparam, case, func, select, text, update
+
+from extensions import db
+from models import MergingRequest, NewStory, NewVersion, User
+import counters
+import database
+import lineage
+import search
+
+
+FORMAT = 'branchlibrary'
+VERSION = 1
+
+TABLES = (User.__table__, NewStory.__table__, NewVersion.__table__, MergingRequest.__table__)
+
+# Seconds between progress lines.
+REPORT_EVERY = 5
+
+
+class _Meter:
+    '''Rows Done per Table, with a Progress Line every REPORT_EVERY Seconds'''
+
+    def __init__(self, progress):
+        self.progress = progress
+        self.started = self.reported = time.perf_counter()
+        self.rows = {}
+
+    def add(self, name, count):
+        self.rows[name] = self.rows.get(name, 0) + count
+        now = time.perf_counter()
+        if now - self.reported >= REPORT_EVERY:
+            self.reported = now
+            self.progress(f"{name}: {self.rows[name]} rows ({self.rate():.0f} rows/s)")
+
+    def rate(self):
+        return sum(self.rows.values()) / max(time.perf_counter() - self.started, 1e-9)
+
+    def summary(self):
+        counts = ', '.join(f"{name} {count}" for name, count in self.rows.items())
+        return (f"{sum(self.rows.values())} rows in {time.perf_counter() - self.started:.1f}s "
+                f"({self.rate():.0f} rows/s): {counts or 'nothing to do'}")
+
+
+def _load_state(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_state(path, state):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def _column_types(table):
+    return ({column.name for column in table.c if isinstance(column.type, DateTime)},
+            {column.name for column in table.c if isinstance(column.type, LargeBinary)})
+
+
+###################################################
+#                     Export                      #
+###################################################
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _sections(top):
+    '''(name, select) for each Part of the File, the First Column of each is its Order and Resume Key'''
+    user, story, version, request = TABLES
+    story_author = user.alias('story_author')
+    version_author = user.alias('version_author')
+    requestor = user.alias('requestor')
+
+    def exported(table, column):
+        return column <= top[table.name]
+
+    # Live stories of live authors, the same set every later section is limited to
+    live_story = and_(story.c.deleted_at.is_(None), story_author.c.deleted_at.is_(None),
+                      exported(story, story.c.id), exported(user, story_author.c.id))
+    stories = story.join(story_author, story_author.c.id == story.c.author_id)
+
+    # A fork whose author is gone (or newer than the export) is kept unattributed, as purge_user() leaves it
+    version_columns = [column for column in version.c if column.name != 'author_id'] + [case(
+        (and_(version_author.c.deleted_at.is_(None), exported(user, version_author.c.id)), version.c.author_id),
+        else_=None).label('author_id')]
+
+    return [
+        ('user', select(*user.c).where(user.c.deleted_at.is_(None), exported(user, user.c.id))),
+        ('new_story', select(*[column for column in story.c if column.name != 'current_version_id'])
+            .select_from(stories).where(live_story)),
+        ('new_version', select(*version_columns)
+            .select_from(version.join(stories, story.c.id == version.c.story_id)
+                         .outerjoin(version_author, version_author.c.id == version.c.author_id))
+            .where(live_story, exported(version, version.c.id))),
+        ('merging_request', select(*request.c)
+            .select_from(request.join(stories, story.c.id == request.c.story_id)
+                         .join(requestor, requestor.c.id == request.c.requestor_id))
+            .where(live_story, requestor.c.deleted_at.is_(None), exported(user, requestor.c.id),
+                   exported(request, request.c.id), exported(version, request.c.version_id))),
+        ('current_version', select(story.c.id.label('story_id'), story.c.current_version_id.label('version_id'))
+            .select_from(stories)
+            .where(live_story, story.c.current_version_id.isnot(None), exported(version, story.c.current_version_id))),
+    ]
+
+
+def _write_member(raw, lines):
+    '''Append one Complete gzip Member and Make Sure it is on Disk'''
+    with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6, mtime=0) as member:
+        member.write(''.join(lines).encode('utf-8'))
+    raw.flush()
+    os.fsync(raw.fileno())
+
+
+def _rows(query, batch_size):
+    '''Stream a Query's Rows as Dicts, batch_size at a Time off the Cursor'''
+    for row in db.session.execute(query.execution_options(yield_per=batch_size)).mappings():
+        yield {name: _encode(value) for name, value in row.items()}
+
+
+def export_corpus(path, batch_size=1000, progress=print):
+    '''Write the Corpus to path, Carrying on from path.state if an Earlier Run was Interrupted'''
+    state_path = path + '.state'
+    state = _load_state(state_path)
+    if state is None:
+        top = {table.name: db.session.query(func.max(table.c.id)).scalar() or 0 for table in TABLES}
+        state = {'top': top, 'section': None, 'after': 0, 'offset': 0}
+        raw = open(path, 'wb')
+        _write_member(raw, [json.dumps({'format': FORMAT, 'version': VERSION, 'exported_at': _encode(
+            datetime.utcnow()), 'tables': [table.name for table in TABLES]}) + '\n'])
+        state['offset'] = raw.tell()
+        _save_state(state_path, state)
+    else:
+        progress(f"Resuming after {state['section'] or 'the header'} {state['after'] or ''}".rstrip())
+        raw = open(path, 'r+b')
+        # Whatever follows the last complete member was cut off mid write
+        raw.truncate(state['offset'])
+        raw.seek(state['offset'])
+
+    meter = _Meter(progress)
+    sections = _sections(state['top'])
+    names = [name for name, _ in sections]
+    with raw:
+        for name, query in sections[names.index(state['section']) if state['section'] else 0:]:
+            key = query.selected_columns[0]
+            after = state['after'] if name == state['section'] else 0
+            lines = []
+            for row in _rows(query.where(key > after).order_by(key), batch_size):
+                lines.append(json.dumps({'table': name, **row}, ensure_ascii=False, separators=(',', ':')) + '\n')
+                if len(lines) >= batch_size:
+                    _write_member(raw, lines)
+                    state.update(section=name, after=row[key.name], offset=raw.tell())
+                    _save_state(state_path, state)
+                    meter.add(name, len(lines))
+                    lines = []
+            if lines:
+                _write_member(raw, lines)
+                state.update(section=name, after=row[key.name], offset=raw.tell())
+                _save_state(state_path, state)
+                meter.add(name, len(lines))
+    os.remove(state_path)
+    return meter.summary()
+
+
+###################################################
+#                     Import                      #
+###################################################
+
+def _defer_constraints(connection):
+    '''Foreign Keys Checked once at Commit instead of per Row'''
+    # Reset by SQLite at every commit, so it is set again for each batch. The foreign keys aren't
+    # DEFERRABLE on PostgreSQL, there the file's order keeps each row's references already written.
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('PRAGMA defer_foreign_keys=ON'))
+
+
+def _remap(table, offsets):
+    '''Column Name -> Offset for the Row's own id and every Foreign Key'''
+    columns = {'id': offsets[table.name]}
+    for foreign_key in table.foreign_keys:
+        columns[foreign_key.parent.name] = offsets[foreign_key.column.table.name]
+    return columns
+
+
+class _Writer:
+    '''Buffers one Table's Rows and Writes them a Batch per Transaction'''
+
+    def __init__(self, batch_size, meter):
+        self.batch_size = batch_size
+        self.meter = meter
+        self.name = None
+        self.statement = None
+        self.rows = []
+
+    def add(self, name, statement, row):
+        if name != self.name:
+            self.flush()
+            self.name, self.statement = name, statement
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.name == 'user':
+            _check_usernames([row['username'] for row in self.rows])
+        _defer_constraints(db.session.connection())
+        db.session.execute(self.statement, self.rows)
+        db.session.commit()
+        self.meter.add(self.name, len(self.rows))
+        self.rows = []
+
+
+def _check_usernames(usernames):
+    taken = db.session.execute(select(User.username).where(User.username.in_(usernames))).scalars().all()
+    if taken:
+        raise ValueError('The database already has users named %s' % ', '.join(sorted(taken)[:20]))
+
+
+def _rebuild_derived():
+    '''What Core INSERTs Skip the ORM Events for, Rebuilt in one Pass each'''
+    connection = db.session.connection()
+    rows = db.session.query(NewStory.id, NewStory.title, NewStory.genre, NewStory.content).filter(
+        NewStory.deleted_at.is_(None)).yield_per(500)
+    search.rebuild(connection, rows)
+    lineage.rebuild(connection)
+    counters.rebuild(connection)
+    database.advance_sequences(connection, TABLES)
+    db.session.commit()
+
+
+def import_corpus(path, batch_size=1000, progress=print):
+    '''Write an Exported Corpus into this Database, Carrying on from path.import-state if Interrupted'''
+    state_path = path + '.import-state'
+    state = _load_state(state_path)
+    # Rows at or below these ids are already here, theirs on a fresh import and ours on a resumed one
+    done = {table.name: db.session.query(func.max(table.c.id)).scalar() or 0 for table in TABLES}
+    if state is None:
+        state = {'offsets': done}
+        _save_state(state_path, state)
+    else:
+        progress('Resuming, ' + ', '.join(f"{name} past id {done[name]}" for name in done))
+    offsets = state['offsets']
+
+    tables = {table.name: table for table in TABLES}
+    remaps = {name: _remap(table, offsets) for name, table in tables.items()}
+    types = {name: _column_types(table) for name, table in tables.items()}
+    statements = {name: table.insert() for name, table in tables.items()}
+    story = tables['new_story']
+    statements['current_version'] = update(story).where(story.c.id == bindparam('story')).values(
+        current_version_id=bindparam('version'))
+
+    meter = _Meter(progress)
+    writer = _Writer(batch_size, meter)
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('format') != FORMAT or header.get('version') != VERSION:
+            raise ValueError('%s is not a version %d %s export' % (path, VERSION, FORMAT))
+        for line in f:
+            row = json.loads(line)
+            name = row.pop('table')
+            if name == 'current_version':
+                # Set again on a resumed run, which changes nothing
+                writer.add(name, statements[name], {'story': row['story_id'] + offsets['new_story'],
+                                                    'version': row['version_id'] + offsets['new_version']})
+                continue
+            for column, offset in remaps[name].items():
+                if row.get(column) is not None:
+                    row[column] += offset
+            if row['id'] <= done[name]:
+                continue
+            dates, binaries = types[name]
+            for column in dates:
+                if row.get(column) is not None:
+                    row[column] = datetime.fromisoformat(row[column])
+            for column in binaries:
+                if row.get(column) is not None:
+                    row[column] = base64.b64decode(row[column])
+            writer.add(name, statements[name], row)
+    writer.flush()
+
+    _rebuild_derived()
+    os.remove(state_path)
+    return meter.summary()
@@ -0,0 +1,109 @@
+"""
+Contribution points and activity counters.
+
+user_stats and story_stats hold running counts, so the author directory reads one
+indexed row per user instead of grouping over every story, version and merge request:
+|-- user_stats   stories, versions and merges_accepted per user, and their points
+|-- story_stats  forks and pending_requests per story
+
+points = STORY_POINTS a story + FORK_POINTS a version + MERGE_POINTS an accepted merge.
+Only live stories count, deleting a story takes what it earned off its author and
+everyone who forked it.
+
+models.py moves the counts with SQLAlchemy events as rows are written, delete() and
+delete_account() call forget_story(), and `flask rebuild-counters` recomputes both
+tables from scratch.
+"""
+from sqlalchemy import text
+
+
+STORY_POINTS = 10
+FORK_POINTS = 2
+MERGE_POINTS = 25
+
+BUMP_USER = text(
+    "INSERT INTO user_stats (user_id, stories, versions, merges_accepted, points) "
+    "VALUES (:id, :stories, :versions, :merges_accepted, :points) "
+    "ON CONFLICT (user_id) DO UPDATE SET "
+    "stories = user_stats.stories + excluded.stories, "
+    "versions = user_stats.versions + excluded.versions, "
+    "merges_accepted = user_stats.merges_accepted + excluded.merges_accepted, "
+    "points = user_stats.points + excluded.points")
+
+BUMP_STORY = text(
+    "INSERT INTO story_stats (story_id, forks, pending_requests) VALUES (:id, :forks, :pending_requests) "
+    "ON CONFLICT (story_id) DO UPDATE SET "
+    "forks = story_stats.forks + excluded.forks, "
+    "pending_requests = story_stats.pending_requests + excluded.pending_requests")
+
+REBUILD_USERS = text(
+    "INSERT INTO user_stats (user_id, stories, versions, merges_accepted, points) "
+    "SELECT id, stories, versions, merges_accepted, "
+    "stories * %d + versions * %d + merges_accepted * %d FROM (SELECT u.id, "
+    "(SELECT count(*) FROM new_story s WHERE s.author_id = u.id AND s.deleted_at IS NULL) AS stories, "
+    "(SELECT count(*) FROM new_version v JOIN new_story s ON s.id = v.story_id "
+    " WHERE v.author_id = u.id AND s.deleted_at IS NULL) AS versions, "
+    "(SELECT count(*) FROM merging_request m JOIN new_story s ON s.id = m.story_id "
+    " WHERE m.requestor_id = u.id AND m.status = 'Accepted' AND s.deleted_at IS NULL) AS merges_accepted "
+    'FROM "user" u) counts' % (STORY_POINTS, FORK_POINTS, MERGE_POINTS))
+
+REBUILD_STORIES = text(
+    "INSERT INTO story_stats (story_id, forks, pending_requests) SELECT s.id, "
+    "(SELECT count(*) FROM new_version v WHERE v.story_id = s.id), "
+    "(SELECT count(*) FROM merging_request m WHERE m.story_id = s.id AND m.status = 'Pending') "
+    "FROM new_story s WHERE s.deleted_at IS NULL")
+
+
+def bump_user(connection, user_id, stories=0, versions=0, merges_accepted=0):
+    '''Add to a User's Counts, Creating their Row if Needed'''
+    points = stories * STORY_POINTS + versions * FORK_POINTS + merges_accepted * MERGE_POINTS
+    connection.execute(BUMP_USER, {'id': user_id, 'stories': stories, 'versions': versions,
+                                   'merges_accepted': merges_accepted, 'points': points})
+
+
+def bump_story(connection, story_id, forks=0, pending_requests=0):
+    '''Add to a Story's Counts, Creating its Row if Needed'''
+    connection.execute(BUMP_STORY, {'id': story_id, 'forks': forks, 'pending_requests': pending_requests})
+
+
+def forget_story(connection, story_id):
+    '''Take what a Story being Deleted Earned off its Author and Contributors'''
+    author_id = connection.execute(text("SELECT author_id FROM new_story WHERE id = :id"), {'id': story_id}).scalar()
+    if author_id is not None:
+        bump_user(connection, author_id, stories=-1)
+    for user_id, versions in connection.execute(text(
+            "SELECT author_id, count(*) FROM new_version WHERE story_id = :id AND author_id IS NOT NULL "
+            "GROUP BY author_id"), {'id': story_id}).all():
+        bump_user(connection, user_id, versions=-versions)
+    for user_id, merges in connection.execute(text(
+            "SELECT requestor_id, count(*) FROM merging_request WHERE story_id = :id AND status = 'Accepted' "
+            "GROUP BY requestor_id"), {'id': story_id}).all():
+        bump_user(connection, user_id, merges_accepted=-merges)
+    connection.execute(text("DELETE FROM story_stats WHERE story_id = :id"), {'id': story_id})
+
+
+def forget_requests(connection, user_id):
+    '''Stop Counting a User's Pending Merge Requests on the Stories they were Made to'''
+    # Recounted without them rather than subtracted, so a purge that is retried can run it again
+    connection.execute(text(
+        "UPDATE story_stats SET pending_requests = (SELECT count(*) FROM merging_request m "
+        " WHERE m.story_id = story_stats.story_id AND m.status = 'Pending' AND m.requestor_id != :id) "
+        "WHERE story_id IN (SELECT story_id FROM merging_request WHERE requestor_id = :id AND status = 'Pending')"),
+        {'id': user_id})
+
+
+def snapshot(connection):
+    '''Every Counter Row, for Comparing before and after a Rebuild'''
+    users = {row[0]: tuple(row[1:]) for row in connection.execute(
+        text("SELECT user_id, stories, versions, merges_accepted, points FROM user_stats"))}
+    stories = {row[0]: tuple(row[1:]) for row in connection.execute(
+        text("SELECT story_id, forks, pending_requests FROM story_stats"))}
+    return users, stories
+
+
+def rebuild(connection):
+    '''Recompute user_stats and story_stats from the Stories, Versions and Merge Requests'''
+    connection.execute(text("DELETE FROM user_stats"))
+    connection.execute(text("DELETE FROM story_stats"))
+    connection.execute(REBUILD_USERS)
+    connection.execute(REBUILD_STORIES)
@@ -0,0 +1,103 @@
+"""
+Database engine configuration.
+
+Everything comes from the environment so the same code runs on a laptop against
+SQLite and on the dyno against PostgreSQL:
+|-- DATABASE_URL        defaults to sqlite:///test.db (Heroku's postgres:// is accepted)
+|-- DB_POOL_SIZE        pooled connections per worker (PostgreSQL), by default one per
+|                       request thread, see request_threads()
+|-- DB_MAX_OVERFLOW     extra connections allowed past the pool under bursts (PostgreSQL)
+|-- DB_POOL_TIMEOUT     seconds to wait for a pooled connection (PostgreSQL)
+|-- DB_POOL_RECYCLE     seconds before a connection is replaced (PostgreSQL)
+|-- DB_BUSY_TIMEOUT     seconds a SQLite writer waits on the lock before giving up
+|-- SQLITE_MMAP_SIZE    bytes of the SQLite file to memory map
+
+A gthread worker runs GUNICORN_THREADS threads, and up to EVENTS_MAX_CONNECTIONS of
+them idle on /events streams, which hold no connection. The rest serve pages and each
+needs one, so the pool defaults to their number and a page never waits DB_POOL_TIMEOUT
+for a connection another thread could have had. PostgreSQL then sees up to
+WEB_CONCURRENCY x (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections per dyno, when that
+is past the plan's limit lower GUNICORN_THREADS along with EVENTS_MAX_CONNECTIONS, or
+set DB_POOL_SIZE and accept the wait.
+
+SQLite connections are switched to WAL on connect, so readers no longer block the
+writer and gunicorn workers only queue behind each other for the write itself.
+
+Bulk writers that insert explicit ids (seed.py, corpus.py) call advance_sequences()
+afterwards, PostgreSQL's serial sequences don't see those rows.
+"""
+import os
+import sqlite3
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+
+DEFAULT_URL = 'sqlite:///test.db'
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def database_url():
+    url = os.getenv('DATABASE_URL', DEFAULT_URL)
+    # SQLAlchemy 1.4+ only knows the postgresql:// scheme
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+def request_threads():
+    '''gunicorn Threads per Worker Left for Pages once the /events Streams have Theirs'''
+    # The same defaults as gunicorn.conf.py and main.py
+    threads = _env_int('GUNICORN_THREADS', 128)
+    if os.getenv('EVENTS', 'sqlite') == 'off':
+        return threads
+    return max(1, threads - _env_int('EVENTS_MAX_CONNECTIONS', 96))
+
+
+def is_sqlite(url):
+    return url.startswith('sqlite')
+
+
+def engine_options(url):
+    '''SQLALCHEMY_ENGINE_OPTIONS for the given URL'''
+    if is_sqlite(url):
+        # pysqlite's own lock timeout, the busy_timeout pragma below covers raw connections too
+        return {'connect_args': {'timeout': _env_int('DB_BUSY_TIMEOUT', 15)}}
+
+    return {
+        'pool_size': _env_int('DB_POOL_SIZE', request_threads()),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 5),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 10),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        # Drop connections the server (or a dyno restart) closed instead of erroring the request
+        'pool_pre_ping': True,
+    }
+
+
+def advance_sequences(connection, tables):
+    '''Move each Table's id Sequence past its Highest id, so the next ORM Insert doesn't Collide (PostgreSQL)'''
+    if connection.dialect.name != 'postgresql':
+        return
+    for table in tables:
+        name = connection.dialect.identifier_preparer.quote(table.name)
+        connection.execute(text("SELECT setval(pg_get_serial_sequence('%s', 'id'), coalesce(max(id), 0) + 1, false) "
+                                "FROM %s" % (name, name)))
+
+
+@event.listens_for(Engine, 'connect')
+def tune_sqlite(dbapi_connection, connection_record):
+    '''WAL and Friends for every new SQLite Connection'''
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    # NORMAL is durable across application crashes in WAL mode, only an OS crash can lose the last commits
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=%d' % (_env_int('DB_BUSY_TIMEOUT', 15) * 1000))
+    cursor.execute('PRAGMA mmap_size=%d' % _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    # SQLite leaves foreign keys unenforced by default, the ON DELETE cascades depend on them
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
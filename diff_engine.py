@@ -0,0 +1,203 @@
+"""
+Fork difference engine for review_changes.
+
+Compares a fork (NewVersion) against the story's current content and marks what the
+fork added with <ins> and what it removed with <del>, keeping the story's html intact.
+
+The diff runs in two passes so novella length stories stay fast:
+|-- block pass: paragraphs (and the other block tags writer() allows) are matched as whole units
+|-- word pass: only the blocks that changed are diffed word by word
+A changed region bigger than MAX_WORD_TOKENS is shown as a whole block swap rather
+than diffed word by word, which caps the worst case.
+
+The block pass hands SequenceMatcher at most MAX_BLOCK_PAIRS (old x new blocks) at a
+time. Its cost grows with every repeat of a block, and long stories repeat a lot (an
+empty paragraph between each, scene breaks). A bigger region is first split at the
+blocks that occur exactly once on both sides, patience diff style, and one with no
+such block left is shown as a replace.
+"""
+from bisect import bisect_left
+from collections import Counter
+from difflib import SequenceMatcher
+import re
+
+
+# Block level tags from the bleach allow-list in writer(), a block ends at their closing tag.
+BLOCK_TAGS = {'p', 'h1', 'h2', 'h3', 'ul', 'ol', 'li', 'blockquote', 'br'}
+
+# Largest changed region (old + new tokens) diffed word by word.
+MAX_WORD_TOKENS = 6000
+
+# Largest region (old x new blocks) the block pass matches with SequenceMatcher.
+MAX_BLOCK_PAIRS = 40000
+
+# A block runs up to and including a closing block tag (or a <br>).
+_BLOCK = re.compile(
+    r'.*?(?:</\s*(?:%s)\s*>|<br\s*/?>)|.+' % '|'.join(sorted(BLOCK_TAGS - {'br'})),
+    re.S | re.I)
+
+# Tags, words with the whitespace after them, or leading whitespace.
+_TOKEN = re.compile(r'<[^>]*>|[^<\s]+\s*|\s+')
+
+
+class Diff:
+    '''Rendered Diff plus Word Counts for the Summary'''
+
+    def __init__(self, html, words_added, words_removed):
+        self.html = html
+        self.words_added = words_added
+        self.words_removed = words_removed
+
+    @property
+    def changed(self):
+        return bool(self.words_added or self.words_removed)
+
+
+def _is_tag(token):
+    return token.startswith('<')
+
+
+def blocks(html):
+    '''Split Html into Block Strings'''
+    return _BLOCK.findall(html or '')
+
+
+def tokenize(html):
+    '''Split Html into Tag and Word Tokens'''
+    return _TOKEN.findall(html)
+
+
+class _Writer:
+    '''Collects Output and Word Counts while Walking Opcodes'''
+
+    def __init__(self):
+        self.parts = []
+        self.added = 0
+        self.removed = 0
+
+    def same(self, parts):
+        self.parts.extend(parts)
+
+    def mark(self, tokens, tag, keep_tags):
+        '''Wrap Runs of Words in <tag>, Tags are Kept or Dropped'''
+        run = []
+        for token in tokens:
+            if _is_tag(token):
+                if run:
+                    self.parts.append('<%s>%s</%s>' % (tag, ''.join(run), tag))
+                    run = []
+                if keep_tags:
+                    self.parts.append(token)
+            else:
+                if token.strip():
+                    if tag == 'ins':
+                        self.added += 1
+                    else:
+                        self.removed += 1
+                run.append(token)
+        if run:
+            self.parts.append('<%s>%s</%s>' % (tag, ''.join(run), tag))
+
+
+def _diff_words(old_html, new_html, out):
+    old_tokens, new_tokens = tokenize(old_html), tokenize(new_html)
+    if len(old_tokens) + len(new_tokens) > MAX_WORD_TOKENS:
+        # Too big to diff word by word, show it as the old blocks going and the new ones coming in.
+        out.mark(old_tokens, 'del', keep_tags=True)
+        out.mark(new_tokens, 'ins', keep_tags=True)
+        return
+
+    matcher = SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            out.same(new_tokens[j1:j2])
+            continue
+        # The story's new structure wins, removed tags are dropped so the markup stays balanced
+        if i1 != i2:
+            out.mark(old_tokens[i1:i2], 'del', keep_tags=False)
+        if j1 != j2:
+            out.mark(new_tokens[j1:j2], 'ins', keep_tags=True)
+
+
+def _unique_anchors(old, new, i1, i2, j1, j2):
+    '''(i, j) of the Blocks Occurring once on each Side, the Longest Run of them in the Same Order'''
+    old_counts, new_counts = Counter(old[i1:i2]), Counter(new[j1:j2])
+    positions = {new[j]: j for j in range(j1, j2) if new_counts[new[j]] == 1}
+    pairs = [(i, positions[old[i]]) for i in range(i1, i2) if old_counts[old[i]] == 1 and old[i] in positions]
+
+    # Longest increasing run of j, pairs are already in i order
+    tails, ends, previous = [], [], [None] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        at = bisect_left(tails, j)
+        if at:
+            previous[k] = ends[at - 1]
+        if at == len(tails):
+            tails.append(j)
+            ends.append(k)
+        else:
+            tails[at], ends[at] = j, k
+    anchors, k = [], ends[-1] if ends else None
+    while k is not None:
+        anchors.append(pairs[k])
+        k = previous[k]
+    return anchors[::-1]
+
+
+def _block_opcodes(old, new, i1, i2, j1, j2):
+    '''SequenceMatcher Style Opcodes for old[i1:i2] against new[j1:j2]'''
+    head_i, head_j = i1, j1
+    while i1 < i2 and j1 < j2 and old[i1] == new[j1]:
+        i1, j1 = i1 + 1, j1 + 1
+    tail_i, tail_j = i2, j2
+    while i2 > i1 and j2 > j1 and old[i2 - 1] == new[j2 - 1]:
+        i2, j2 = i2 - 1, j2 - 1
+
+    if i1 > head_i:
+        yield 'equal', head_i, i1, head_j, j1
+    if i1 == i2 and j1 == j2:
+        pass
+    elif i1 == i2:
+        yield 'insert', i1, i2, j1, j2
+    elif j1 == j2:
+        yield 'delete', i1, i2, j1, j2
+    elif (i2 - i1) * (j2 - j1) <= MAX_BLOCK_PAIRS:
+        matcher = SequenceMatcher(None, old[i1:i2], new[j1:j2], autojunk=False)
+        for tag, a1, a2, b1, b2 in matcher.get_opcodes():
+            yield tag, i1 + a1, i1 + a2, j1 + b1, j1 + b2
+    else:
+        anchors = _unique_anchors(old, new, i1, i2, j1, j2)
+        if not anchors:
+            yield 'replace', i1, i2, j1, j2
+        for i, j in anchors:
+            yield from _block_opcodes(old, new, i1, i, j1, j)
+            yield 'equal', i, i + 1, j, j + 1
+            i1, j1 = i + 1, j + 1
+        if anchors:
+            yield from _block_opcodes(old, new, i1, i2, j1, j2)
+    if i2 < tail_i:
+        yield 'equal', i2, tail_i, j2, tail_j
+
+
+def diff_html(old_html, new_html):
+    '''
+    Diff Story Content against a Fork
+    |-- old_html: the story as it is now
+    |-- new_html: the fork's content
+    '''
+    out = _Writer()
+
+    # Blocks are compared as whole strings, forks usually only touch a few paragraphs
+    # and everything else is passed through without being split into words. Repeated
+    # blocks (empty paragraphs, scene breaks) can still anchor a match, see MAX_BLOCK_PAIRS.
+    old_blocks, new_blocks = blocks(old_html), blocks(new_html)
+    for tag, i1, i2, j1, j2 in _block_opcodes(old_blocks, new_blocks, 0, len(old_blocks), 0, len(new_blocks)):
+        if tag == 'equal':
+            out.same(new_blocks[j1:j2])
+        elif tag == 'delete':
+            out.mark(tokenize(''.join(old_blocks[i1:i2])), 'del', keep_tags=True)
+        elif tag == 'insert':
+            out.mark(tokenize(''.join(new_blocks[j1:j2])), 'ins', keep_tags=True)
+        else:
+            _diff_words(''.join(old_blocks[i1:i2]), ''.join(new_blocks[j1:j2]), out)
+
+    return Diff(''.join(out.parts), out.added, out.removed)
@@ -0,0 +1,249 @@
+"""
+Server-Sent Events for merge request notifications.
+
+Each logged in browser holds one /events stream instead of reloading /merge_requests/.
+publish() is called after a commit and the event reaches every stream that user has
+open, on whichever gunicorn worker it landed:
+|-- 'merge_request'   to a story's author, someone asked to merge a fork
+|-- 'merge_accepted'  to the requestor
+|-- 'merge_denied'    to the requestor
+
+Streams are fanned out from an in-process Hub. Picked with EVENTS:
+|-- 'sqlite' (default)  publish() appends to a local SQLite file and one thread per worker
+|                       tails it into the Hub, so every worker on the dyno sees every event
+|-- 'memory'            publish() goes straight to the Hub, only streams on the same worker hear it
+|-- 'off'               /events answers 204 and publish() does nothing
+
+An open stream holds a gunicorn thread, so the Hub takes at most EVENTS_MAX_CONNECTIONS
+streams per worker (EVENTS_MAX_PER_USER per user), keep it under GUNICORN_THREADS so
+pages still have threads to run on. A browser turned away gets an empty stream whose
+retry: line tells EventSource to come back in EVENTS_RETRY_AFTER to twice that many
+seconds (a 503 would make it give up for good). Each stream ends after EVENTS_MAX_AGE
+seconds, the browser reconnects on its own. A comment line every
+EVENTS_HEARTBEAT seconds keeps proxies from closing idle streams and notices clients
+that have gone away.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+
+class TooManyListeners(Exception):
+    '''The Worker or User is at its Stream Limit'''
+
+
+class Subscription:
+    '''One Open Stream'''
+
+    def __init__(self, user_id, maxsize=100):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=maxsize)
+
+
+class Hub:
+    '''In-Process Fan Out from User Id to Open Streams'''
+
+    def __init__(self, max_connections=96, max_per_user=3):
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        self.subscribers = {}
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        with self.lock:
+            streams = self.subscribers.setdefault(user_id, set())
+            if self.count >= self.max_connections or len(streams) >= self.max_per_user:
+                if not streams:
+                    del self.subscribers[user_id]
+                raise TooManyListeners()
+            subscription = Subscription(user_id)
+            streams.add(subscription)
+            self.count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            streams = self.subscribers.get(subscription.user_id)
+            if streams and subscription in streams:
+                streams.remove(subscription)
+                self.count -= 1
+                if not streams:
+                    del self.subscribers[subscription.user_id]
+
+    def deliver(self, user_id, event, data):
+        with self.lock:
+            streams = list(self.subscribers.get(user_id, ()))
+        for subscription in streams:
+            try:
+                subscription.queue.put_nowait((event, data))
+            except queue.Full:
+                # A stream that stopped reading loses events rather than holding up the rest
+                pass
+
+
+class MemoryBroker:
+    '''Events Stay on the Worker that Published them'''
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, user_id, event, data):
+        self.hub.deliver(user_id, event, data)
+
+    def start(self):
+        pass
+
+
+class SQLiteBroker:
+    '''Event Log in a Local SQLite File, Tailed by one Thread per Worker'''
+
+    def __init__(self, hub, path, poll=0.25, keep=300, logger=None):
+        self.hub = hub
+        self.path = path
+        self.logger = logger or logging.getLogger(__name__)
+        self.poll = poll
+        self.keep = keep
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _connection(self):
+        # One connection per thread, and a fresh one after gunicorn forks a worker
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS events '
+                '(id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, event TEXT, data TEXT, created REAL)')
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return connection
+
+    def publish(self, user_id, event, data):
+        connection = self._connection()
+        connection.execute('INSERT INTO events (user_id, event, data, created) VALUES (?, ?, ?, ?)',
+                           (user_id, event, json.dumps(data), time.time()))
+        # Old events are swept now and then, a stream only ever reads what arrived after it opened
+        if connection.execute('SELECT last_insert_rowid()').fetchone()[0] % 100 == 0:
+            connection.execute('DELETE FROM events WHERE created < ?', (time.time() - self.keep,))
+
+    def start(self):
+        '''Start the Tail Thread, once per Worker Process'''
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        last_id = self._connection().execute('SELECT coalesce(max(id), 0) FROM events').fetchone()[0]
+        threading.Thread(target=self._tail, args=(last_id,), name='events-tail', daemon=True).start()
+
+    def _tail(self, last_id):
+        try:
+            while True:
+                time.sleep(self.poll)
+                try:
+                    last_id = self._read(last_id)
+                except sqlite3.Error:
+                    # A locked or replaced file, drop the connection and try again on the next poll
+                    self.logger.exception('Reading the event log failed')
+                    self.local.connection = None
+        finally:
+            # Lets the next subscribe() start a new tail rather than leave this worker deaf
+            with self.lock:
+                if self.pid == os.getpid():
+                    self.pid = None
+
+    def _read(self, last_id):
+        '''Deliver the Events after last_id, Returns the new Position'''
+        connection = self._connection()
+        # Nobody listening on this worker, skip the read but keep the position
+        if not self.hub.count:
+            return connection.execute('SELECT coalesce(max(id), ?) FROM events', (last_id,)).fetchone()[0]
+        rows = connection.execute(
+            'SELECT id, user_id, event, data FROM events WHERE id > ? ORDER BY id', (last_id,)).fetchall()
+        for event_id, user_id, event, data in rows:
+            last_id = event_id
+            try:
+                data = json.loads(data)
+            except ValueError:
+                self.logger.warning('Skipped unreadable event %d', event_id)
+                continue
+            self.hub.deliver(user_id, event, data)
+        return last_id
+
+
+def init_app(app):
+    '''Pick the Broker from EVENTS / EVENTS_PATH and Size the Hub'''
+    kind = app.config.get('EVENTS', 'sqlite')
+    hub = Hub(max_connections=app.config.get('EVENTS_MAX_CONNECTIONS', 96),
+              max_per_user=app.config.get('EVENTS_MAX_PER_USER', 3))
+    if kind == 'memory':
+        broker = MemoryBroker(hub)
+    elif kind == 'sqlite':
+        path = app.config.get('EVENTS_PATH') or os.path.join(app.instance_path, 'events.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        broker = SQLiteBroker(hub, path, logger=app.logger)
+    else:
+        broker = None
+    app.extensions['events'] = broker
+
+
+def _broker():
+    return current_app.extensions.get('events')
+
+
+def publish(user_id, event, data):
+    '''Send an Event to every Stream user_id has Open, call after the Commit'''
+    broker = _broker()
+    if broker is not None:
+        broker.publish(user_id, event, data)
+
+
+def subscribe(user_id):
+    '''Open a Subscription, None when Events are Off, raises TooManyListeners'''
+    broker = _broker()
+    if broker is None:
+        return None
+    broker.start()
+    return broker.hub.subscribe(user_id)
+
+
+def _format(event, data):
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
+
+
+def turned_away(retry_after=30):
+    '''Body for a Stream the Hub Refused, EventSource Reconnects after its retry: Delay'''
+    # Spread out, so the browsers a full worker refused don't all come back at once
+    return 'retry: %d\n\n' % random.randint(retry_after * 1000, retry_after * 2000)
+
+
+def stream(subscription, heartbeat=15, max_age=300):
+    '''
+    Body of a text/event-stream Response
+    |-- touches neither the request nor the database, so it runs after both are torn down
+    |-- the subscription is released however the stream ends, including a client hanging up
+    '''
+    hub = _broker().hub
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            deadline = time.monotonic() + max_age
+            while time.monotonic() < deadline:
+                try:
+                    event, data = subscription.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': heartbeat\n\n'
+                    continue
+                yield _format(event, data)
+        finally:
+            hub.unsubscribe(subscription)
+    return generate()
@@ -0,0 +1,21 @@
+"""
+Extension objects shared by the models, blueprints and jobs.
+
+Created here without an app so any module can import them, main.create_app() binds
+each one to the app with init_app(). Nothing in this module touches the database or
+starts a thread, which keeps importing it cheap and safe before gunicorn forks.
+"""
+from flask_login import LoginManager
+from flask_sqlalchemy import SQLAlchemy
+
+import hashing
+import jobs
+
+
+db = SQLAlchemy()
+login_manager = LoginManager()
+# Password hashing runs in a bounded process pool, logins are throttled per address, see hashing.py
+hasher = hashing.Hasher()
+login_throttle = hashing.LoginThrottle()
+# Work that follows a write is queued in the job table and run by `flask run-jobs`, see jobs.py
+job_queue = jobs.JobQueue()
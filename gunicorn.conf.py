@@ -0,0 +1,40 @@
+"""
+gunicorn settings for the web dyno, `gunicorn main:app -c gunicorn.conf.py` in the Procfile.
+
+|-- WEB_CONCURRENCY    worker processes, read by gunicorn itself (Heroku sets it per dyno size)
+|-- GUNICORN_THREADS   threads per gthread worker, an open /events stream idles on one.
+|                      Those left after EVENTS_MAX_CONNECTIONS serve pages, and the
+|                      PostgreSQL pool is sized to them (see database.py)
+|-- GUNICORN_PRELOAD   build the app once in the master and fork the workers from it (default on)
+
+With preload the master imports main before forking, so every worker, whether started
+at boot, replacing one that died or added with `kill -TTIN`, is serving as soon as it
+has forked, and the imported modules are shared copy-on-write instead of loaded once
+per worker. create_app() opens no connections and starts no threads, the database
+pool, bcrypt pool, page cache and event connections are all made on first use inside
+the worker.
+"""
+import gc
+import os
+
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 128))
+preload_app = os.getenv('GUNICORN_PRELOAD', '1').lower() in ('1', 'true', 'yes')
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        # Loaded lazily by content_pipeline, imported here so the workers share one copy
+        import bleach  # noqa: F401
+        # Everything loaded so far lives as long as the master, keeping the collector off it
+        # stops the workers' gc passes from writing to (and so copying) the shared pages
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from extensions import db
+        from main import app
+        with app.app_context():
+            # Drops any connection made before the fork without closing it under the master
+            db.engine.dispose(close=False)
@@ -0,0 +1,155 @@
+"""
+Password hashing off the request path.
+
+bcrypt is deliberately slow, and a burst of logins used to pin every gunicorn worker
+on it while story reads queued behind. Hashes are now computed in a small process
+pool per worker, with a cap on how many may be waiting; past the cap the request is
+turned away straight away (HashingBusy) instead of holding a worker. A pool whose
+process died (killed for memory, say) is replaced and the hash tried once more.
+
+|-- BCRYPT_LOG_ROUNDS     bcrypt cost, existing hashes are upgraded on the next login
+|-- BCRYPT_POOL_WORKERS   processes in the pool, 0 hashes inline in the worker
+|-- BCRYPT_QUEUE_DEPTH    hashes allowed in flight (running + waiting) per worker
+
+LoginThrottle caps login attempts per client address, so one client can't fill the
+queue on its own. The address is request.remote_addr, which ProxyFix sets from the
+X-Forwarded-For entry added by our own proxy (PROXY_HOPS in main.py).
+|-- LOGIN_ATTEMPTS        attempts allowed per address per LOGIN_WINDOW seconds
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import threading
+import time
+
+from cachetools import TTLCache
+import bcrypt
+
+
+# Pool processes are started from a clean server process (or spawned where there is none) rather than
+# forked from the gthread worker, a fork would copy locks that its other threads happened to hold.
+_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+class HashingBusy(Exception):
+    '''Too many Hashes Already Waiting'''
+
+
+def _to_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(password, pw_hash)
+
+
+def hash_rounds(pw_hash):
+    '''Cost a Hash was Made with, "$2b$12$..." -> 12'''
+    try:
+        return int(_to_bytes(pw_hash).split(b'$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class Hasher:
+    '''Bounded Process Pool for bcrypt'''
+
+    def __init__(self, rounds=12, workers=None, queue_depth=None):
+        self.rounds = rounds
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.queue_depth = queue_depth if queue_depth is not None else self.workers * 4
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.pool_lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+
+    def init_app(self, app):
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', self.rounds)
+        self.workers = app.config.get('BCRYPT_POOL_WORKERS', self.workers)
+        self.queue_depth = app.config.get('BCRYPT_QUEUE_DEPTH') or self.workers * 4
+
+    def _executor(self):
+        # Started lazily, and again after a fork, a pool can't be shared across gunicorn workers
+        with self.pool_lock:
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context(_START_METHOD))
+                self.pid = os.getpid()
+            return self.executor
+
+    def _replace(self, broken):
+        '''Swap a Broken Pool for a New One, unless Another Thread Already has'''
+        with self.pool_lock:
+            if self.executor is broken:
+                broken.shutdown(wait=False)
+                self.executor = None
+
+    def _submit(self, fn, *args):
+        executor = self._executor()
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # A pool process died and took the pool with it, every later hash would fail the same way
+            self._replace(executor)
+            return self._executor().submit(fn, *args).result()
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        with self.lock:
+            if self.in_flight >= self.queue_depth:
+                raise HashingBusy()
+            self.in_flight += 1
+        try:
+            return self._submit(fn, *args)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def hash_password(self, password):
+        if not password:
+            raise ValueError('Password must be non-empty.')
+        return self._run(_hash, _to_bytes(password), self.rounds)
+
+    def check_password(self, pw_hash, password):
+        return self._run(_check, _to_bytes(pw_hash), _to_bytes(password))
+
+    def needs_rehash(self, pw_hash):
+        return hash_rounds(pw_hash) != self.rounds
+
+
+class LoginThrottle:
+    '''Sliding Window of Login Attempts per Client Address'''
+
+    def __init__(self, attempts=10, window=60):
+        self.attempts = attempts
+        self.window = window
+        self.clients = TTLCache(maxsize=10000, ttl=window)
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.attempts = app.config.get('LOGIN_ATTEMPTS', self.attempts)
+        self.window = app.config.get('LOGIN_WINDOW', self.window)
+        self.clients = TTLCache(maxsize=10000, ttl=self.window)
+
+    def allow(self, address):
+        '''Record an Attempt, False once the Address is over its Limit'''
+        now = time.monotonic()
+        with self.lock:
+            attempts = self.clients.get(address) or deque()
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if len(attempts) >= self.attempts:
+                return False
+            attempts.append(now)
+            # Re-set so the TTL runs from the latest attempt
+            self.clients[address] = attempts
+            return True
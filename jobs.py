@@ -0,0 +1,239 @@
+"""
+Durable job queue for the work that follows a write.
+
+Search indexing, fork diffs and purges used to run inside the request after its commit. Now the request adds a row to the job table in
+the same transaction as its write, so a job exists exactly when the write committed,
+and a worker runs it afterwards. The queue lives in the app's own database, and
+JOBS picks what drains it:
+|-- 'thread'  a thread in each web worker drains the queue, the default on SQLite
+|-- 'worker'  `flask run-jobs`, the Procfile's worker process, the default on any other
+|             database. Scale it to at least 1, the web workers don't run jobs then
+
+Jobs only touch the database, so the worker can run on any machine that reaches the
+same DATABASE_URL. A separate dyno has its own filesystem and so its own SQLite file,
+which is why SQLite defaults to 'thread' and `flask run-jobs` refuses to start on a
+dyno against SQLite. Page cache invalidation and notifications stay in the request,
+straight after its commit: both go to the web worker's own memory or disk (see
+page_cache.py and events.py), which a job running elsewhere can't reach.
+
+Each job is claimed by one worker and
+|-- retried with a doubling delay (JOBS_RETRY_DELAY, 2x, 4x ...) until JOBS_MAX_ATTEMPTS,
+|   then left as 'failed' with its last error
+|-- handed back to the queue if its worker died mid-run (running longer than JOBS_LEASE)
+|-- deduplicated by an optional idempotency key, enqueueing a key that is already in the
+|   table does nothing. Finished jobs are kept JOBS_KEEP seconds, and keys with them
+Handlers can run more than once (a retry after a partial run, a lost lease), so they
+are written to be safe to repeat.
+
+Queue depth and latency come from stats(), printed by `flask job-stats`, logged by the
+worker every JOBS_STATS_INTERVAL seconds and served at /_debug/jobs (local requests only) with PERF_INSTRUMENTATION.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+
+from flask import jsonify
+from sqlalchemy import text
+
+from perf import local_only
+
+
+INSERT = text(
+    "INSERT INTO job (kind, payload, idempotency_key, status, attempts, max_attempts, run_at, created_at) "
+    "VALUES (:kind, :payload, :key, 'queued', 0, :max_attempts, :run_at, :now) ON CONFLICT DO NOTHING")
+
+# Finished jobs the latency figures in stats() are taken from.
+RECENT = 500
+
+
+def _percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))] if values else None
+
+
+class JobQueue:
+    '''Job Table Producer, Handler Registry and Worker'''
+
+    def __init__(self, max_attempts=5, retry_delay=10, lease=600, keep=86400, poll=0.25, stats_interval=60):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.keep = keep
+        self.poll = poll
+        self.stats_interval = stats_interval
+        self.handlers = {}
+        self.app = None
+        self.session = None
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def init_app(self, app, session):
+        self.app = app
+        self.session = session
+        self.max_attempts = app.config.get('JOBS_MAX_ATTEMPTS', self.max_attempts)
+        self.retry_delay = app.config.get('JOBS_RETRY_DELAY', self.retry_delay)
+        self.lease = app.config.get('JOBS_LEASE', self.lease)
+        self.keep = app.config.get('JOBS_KEEP', self.keep)
+        self.poll = app.config.get('JOBS_POLL', self.poll)
+        self.stats_interval = app.config.get('JOBS_STATS_INTERVAL', self.stats_interval)
+        if app.config.get('JOBS') == 'thread':
+            app.before_request(self._start)
+        app.extensions['jobs'] = self
+
+        if app.config.get('PERF_INSTRUMENTATION'):
+            @app.route('/_debug/jobs', methods=['GET'])
+            @local_only
+            def job_stats():
+                return jsonify(self.stats())
+
+    def handler(self, kind):
+        '''Register the Function that Runs Jobs of this Kind, it gets the Payload as Keywords'''
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    def enqueue(self, kind, payload=None, key=None, delay=0, connection=None):
+        '''
+        Add a Job to the Current Transaction, it Runs once that Commits
+        |-- connection: pass the mapper event's connection when called during a flush
+        '''
+        now = time.time()
+        params = {'kind': kind, 'payload': json.dumps(payload or {}), 'key': key, 'max_attempts': self.max_attempts,
+                  'run_at': now + delay, 'now': now}
+        (connection if connection is not None else self.session).execute(INSERT, params)
+
+    # Worker
+
+    def _start(self):
+        # Started lazily, and again after a fork, threads don't survive into gunicorn workers
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self.work, name='jobs', daemon=True).start()
+
+    def _claim(self):
+        '''Mark the Next Due Job Running, returns its Row or None'''
+        now = time.time()
+        while True:
+            row = self.session.execute(text(
+                "SELECT id FROM job WHERE status = 'queued' AND run_at <= :now ORDER BY run_at, id LIMIT 1"),
+                {'now': now}).first()
+            if row is None:
+                self.session.rollback()
+                return None
+            # Another worker may have got there first, then try the next one
+            claimed = self.session.execute(text(
+                "UPDATE job SET status = 'running', attempts = attempts + 1, started_at = :now "
+                "WHERE id = :id AND status = 'queued'"), {'id': row.id, 'now': now}).rowcount
+            self.session.commit()
+            if claimed:
+                return self.session.execute(text(
+                    "SELECT id, kind, payload, attempts, max_attempts FROM job WHERE id = :id"), {'id': row.id}).first()
+
+    def run_next(self):
+        '''Claim and Run one Job, returns False when Nothing was Due'''
+        job = self._claim()
+        if job is None:
+            return False
+        try:
+            handler = self.handlers[job.kind]
+            handler(**json.loads(job.payload))
+            # Marked done after the handler, so a handler that doesn't commit finishes in the same transaction
+            self.session.execute(text("UPDATE job SET status = 'done', finished_at = :now WHERE id = :id"),
+                                 {'id': job.id, 'now': time.time()})
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            self.app.logger.exception('Job %s (%s) failed, attempt %s of %s', job.id, job.kind, job.attempts,
+                                      job.max_attempts)
+            failed = job.attempts >= job.max_attempts
+            self.session.execute(text(
+                "UPDATE job SET status = :status, run_at = :run_at, finished_at = :finished, last_error = :error "
+                "WHERE id = :id"), {
+                'id': job.id, 'status': 'failed' if failed else 'queued',
+                'run_at': time.time() + self.retry_delay * 2 ** (job.attempts - 1),
+                'finished': time.time() if failed else None, 'error': traceback.format_exc()[-2000:]})
+            self.session.commit()
+        return True
+
+    def run_pending(self):
+        '''Run every Job that is Due, returns how many Ran'''
+        count = 0
+        with self.app.app_context():
+            try:
+                while self.run_next():
+                    count += 1
+            finally:
+                self.session.remove()
+        return count
+
+    def maintain(self):
+        '''Requeue Jobs whose Worker Died and Drop Finished Jobs past JOBS_KEEP'''
+        now = time.time()
+        requeued = self.session.execute(text(
+            "UPDATE job SET status = 'queued', run_at = :now WHERE status = 'running' AND started_at < :expired"),
+            {'now': now, 'expired': now - self.lease}).rowcount
+        self.session.execute(text("DELETE FROM job WHERE status = 'done' AND finished_at < :cutoff"),
+                             {'cutoff': now - self.keep})
+        self.session.commit()
+        return requeued
+
+    def work(self, stop=None):
+        '''Run Jobs until stop is Set, Polling every JOBS_POLL Seconds when the Queue is Empty'''
+        stop = stop or threading.Event()
+        next_maintenance = 0
+        while not stop.is_set():
+            with self.app.app_context():
+                try:
+                    if time.time() >= next_maintenance:
+                        if self.maintain():
+                            self.app.logger.warning('Requeued jobs from a worker that stopped mid-run')
+                        self.app.logger.info('Jobs %s', json.dumps(self.stats()))
+                        next_maintenance = time.time() + self.stats_interval
+                    ran = self.run_next()
+                except Exception:
+                    # The database going away shouldn't end the worker, it tries again after the poll
+                    self.session.rollback()
+                    self.app.logger.exception('Job worker error')
+                    ran = False
+                finally:
+                    self.session.remove()
+            if not ran:
+                stop.wait(self.poll)
+
+    # Metrics
+
+    def stats(self):
+        '''
+        Queue Depth and Latency
+        |-- depth: jobs due now, delayed (waiting on a retry), running and failed
+        |-- oldest_due: seconds the longest waiting due job has waited
+        |-- wait / run: p50 and p95 seconds from enqueue to start and from start to finish,
+        |   over the last RECENT finished jobs, per kind
+        '''
+        now = time.time()
+        depth = {'due': 0, 'delayed': 0, 'running': 0, 'failed': 0}
+        for status, jobs in self.session.execute(text(
+                "SELECT status, count(*) FROM job WHERE status != 'done' GROUP BY status")):
+            depth['delayed' if status == 'queued' else status] = jobs
+        due, oldest = self.session.execute(text(
+            "SELECT count(*), min(run_at) FROM job WHERE status = 'queued' AND run_at <= :now"), {'now': now}).one()
+        depth['due'], depth['delayed'] = due, depth['delayed'] - due
+
+        finished = self.session.execute(text(
+            "SELECT kind, created_at, started_at, finished_at FROM job WHERE status = 'done' "
+            "ORDER BY finished_at DESC LIMIT :limit"), {'limit': RECENT}).all()
+        timings = {}
+        for row in finished:
+            wait, run = timings.setdefault(row.kind, ([], []))
+            wait.append(row.started_at - row.created_at)
+            run.append(row.finished_at - row.started_at)
+        latency = {}
+        for kind, (wait, run) in timings.items():
+            latency[kind] = {'count': len(wait)}
+            for name, values in (('wait', sorted(wait)), ('run', sorted(run))):
+                latency[kind][name] = {'p50': round(_percentile(values, 0.5), 4),
+                                       'p95': round(_percentile(values, 0.95), 4)}
+        return {'depth': depth, 'oldest_due': round(now - oldest, 3) if oldest else 0.0, 'latency': latency}
@@ -0,0 +1,74 @@
+"""
+Fork lineage as a closure table.
+
+Every version knows the version it was forked from (new_version.parent_version_id,
+NULL when it was forked from the story's original text). version_lineage holds one
+row per (ancestor, descendant) pair, each version paired with itself at depth 0,
+so lineage questions are single indexed lookups instead of recursive walks:
+|-- ancestors(v)           rows where descendant_id = v
+|-- descendants(v)         rows where ancestor_id = v
+|-- common_ancestor(a, b)  the shared ancestor with the smallest depth below a
+
+Rows are added as each fork is inserted (record_fork copies the parent's ancestors),
+and rebuild() recomputes the whole table with a recursive query.
+"""
+from sqlalchemy import text
+
+
+REBUILD = text(
+    "INSERT INTO version_lineage (ancestor_id, descendant_id, depth) "
+    "WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS ("
+    "  SELECT id, id, 0 FROM new_version"
+    "  UNION ALL"
+    "  SELECT tree.ancestor_id, new_version.id, tree.depth + 1"
+    "  FROM tree JOIN new_version ON new_version.parent_version_id = tree.descendant_id"
+    ") SELECT ancestor_id, descendant_id, depth FROM tree")
+
+
+def record_fork(connection, version_id, parent_id):
+    '''Add a New Version below its Parent'''
+    connection.execute(
+        text("INSERT INTO version_lineage (ancestor_id, descendant_id, depth) VALUES (:id, :id, 0)"),
+        {'id': version_id})
+    if parent_id is not None:
+        connection.execute(text(
+            "INSERT INTO version_lineage (ancestor_id, descendant_id, depth) "
+            "SELECT ancestor_id, :id, depth + 1 FROM version_lineage WHERE descendant_id = :parent_id"),
+            {'id': version_id, 'parent_id': parent_id})
+
+
+def forget_version(connection, version_id):
+    connection.execute(
+        text("DELETE FROM version_lineage WHERE descendant_id = :id OR ancestor_id = :id"), {'id': version_id})
+
+
+def ancestors(connection, version_id):
+    '''Ancestor Ids, Nearest First'''
+    rows = connection.execute(text(
+        "SELECT ancestor_id FROM version_lineage WHERE descendant_id = :id AND depth > 0 ORDER BY depth"),
+        {'id': version_id})
+    return [row[0] for row in rows]
+
+
+def descendants(connection, version_id):
+    '''Descendant Ids, Nearest First'''
+    rows = connection.execute(text(
+        "SELECT descendant_id FROM version_lineage WHERE ancestor_id = :id AND depth > 0 ORDER BY depth, descendant_id"),
+        {'id': version_id})
+    return [row[0] for row in rows]
+
+
+def common_ancestor(connection, first_id, second_id):
+    '''Closest Version both Forks Descend from (either one counts), None when they only Share the Story'''
+    return connection.execute(text(
+        "SELECT a.ancestor_id FROM version_lineage a "
+        "JOIN version_lineage b ON b.ancestor_id = a.ancestor_id AND b.descendant_id = :second "
+        "WHERE a.descendant_id = :first ORDER BY a.depth LIMIT 1"),
+        {'first': first_id, 'second': second_id}).scalar()
+
+
+def rebuild(connection):
+    '''Recompute version_lineage from parent_version_id'''
+    connection.execute(text("DELETE FROM version_lineage"))
+    connection.execute(REBUILD)
+    return connection.execute(text("SELECT count(*) FROM version_lineage")).scalar()
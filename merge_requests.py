@@ -0,0 +1,182 @@
+"""
+Merge requests: the author's inbox, reviewing one fork or many at once, and the
+notification stream that tells both sides what happened.
+"""
+from datetime import datetime
+
+from flask import Blueprint, Response, abort, current_app, flash, jsonify, redirect, render_template, request
+from flask_login import current_user, login_required
+from sqlalchemy.orm import contains_eager, joinedload
+
+from extensions import db, job_queue
+from models import MergingRequest, NewStory, NewVersion, User, fork_diff, load_version_content
+import content_pipeline
+import events
+import page_cache
+
+
+bp = Blueprint('merge_requests', __name__)
+
+
+###################################################
+#               Merge Requests                    #
+###################################################
+
+def decide_merge_request(merge_request, accept):
+    '''
+    Accept or Deny a Pending Merge Request
+    |-- accepting copies the fork into the story and points current_version at it
+    |-- the request is kept with its status, the caller commits and then hands what this returns to announce()
+    '''
+    if accept:
+        story = merge_request.story
+        # Run again rather than copied from the version, forks written before the pipeline were never cleaned.
+        processed = content_pipeline.process(load_version_content(merge_request.version))
+        story.content = processed['content']
+        content_pipeline.apply(story, processed)
+        story.current_version_id = merge_request.version_id
+        merge_request.status = 'Accepted'
+    else:
+        merge_request.status = 'Denied'
+    merge_request.updated_at = datetime.utcnow()
+    # Taken now, the commit expires the rows
+    return (merge_request.story.author_id, merge_request.requestor_id, 'merge_accepted' if accept else 'merge_denied',
+            {'merge_request_id': merge_request.id, 'story_id': merge_request.story_id,
+             'title': merge_request.story.title})
+
+
+def announce(decisions):
+    '''After the Commit: Refresh each Author's Library and tell each Requestor how their Fork Fared'''
+    for author_id, requestor_id, event, data in decisions:
+        page_cache.invalidate('user', author_id)
+        events.publish(requestor_id, event, data)
+
+
+def story_changed(story_id):
+    '''Queue the Diffs that Follow Merging into a Story, the Caller Commits then Invalidates its Page'''
+    # The other pending forks were diffed against the old content
+    job_queue.enqueue('diff_forks', {'story_id': story_id})
+
+
+
+@bp.route('/merge_requests/', methods=['GET'])
+@login_required
+def view_merge_requests():
+    '''Show User PR Req'''
+    # The story is already joined for the filter, the requestor comes in the same query.
+    merge_requests = MergingRequest.query.join( NewStory, MergingRequest.story_id == NewStory.id).options(
+        contains_eager(MergingRequest.story).load_only(NewStory.id, NewStory.title),
+        joinedload(MergingRequest.requestor).load_only(User.username)).filter(
+        NewStory.author_id == current_user.id,
+        NewStory.deleted_at.is_(None),
+        MergingRequest.status == "Pending").all()
+    return render_template('merge_requests.html', merge_requests=merge_requests)
+
+
+
+@bp.route('/merge_requests/review', methods=['POST'])
+@login_required
+def review_merge_requests():
+    '''
+    Accept or Deny Many Merge Requests in One Transaction
+    |-- form: merge_request_ids (repeated) and action, from merge_requests.html
+    |-- json: {"ids": [...], "action": "accept" | "deny"}, answers with what was updated
+    '''
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or payload.get('action') not in ('accept', 'deny'):
+            abort(400)
+        ids, accept = payload.get('ids', []), payload['action'] == 'accept'
+        # bool is an int subclass, true and false aren't ids
+        if not isinstance(ids, list) or not all(type(merge_request_id) is int for merge_request_id in ids):
+            abort(400)
+    else:
+        ids, accept = request.form.getlist('merge_request_ids'), request.form.get('action') == 'Accept Changes'
+        try:
+            ids = [int(merge_request_id) for merge_request_id in ids]
+        except ValueError:
+            abort(400)
+
+    # Only pending requests on the current user's own stories, oldest first so the newest accepted fork wins.
+    merge_requests = MergingRequest.query.join(NewStory, MergingRequest.story_id == NewStory.id).options(
+        contains_eager(MergingRequest.story)).filter(
+        MergingRequest.id.in_(ids),
+        NewStory.author_id == current_user.id,
+        NewStory.deleted_at.is_(None),
+        MergingRequest.status == 'Pending').order_by(MergingRequest.created_at, MergingRequest.id).all()
+
+    decisions = [decide_merge_request(merge_request, accept) for merge_request in merge_requests]
+    changed = {merge_request.story_id for merge_request in merge_requests} if accept else set()
+    updated = [merge_request.id for merge_request in merge_requests]
+    for story_id in changed:
+        story_changed(story_id)
+    db.session.commit()
+    announce(decisions)
+    for story_id in changed:
+        page_cache.invalidate('story', story_id)
+
+    if request.is_json:
+        return jsonify({
+            'status': 'Accepted' if accept else 'Denied',
+            'updated': updated,
+        })
+    return redirect('/merge_requests/')
+
+
+
+# This route is slightly more complicated.
+@bp.route('/review_changes/<int:version_id>', methods=['GET', 'POST'])
+@login_required
+def review_changes(version_id):
+    '''Review Merge Req Version'''
+    # Retrieve version to replace original.
+    version = NewVersion.query.get_or_404(version_id)
+    story = version.story
+    if story.deleted_at:
+        abort(404)
+    
+    if request.method == "POST":
+        # Only the story's author decides what gets merged into it.
+        if story.author_id != current_user.id:
+            abort(403)
+
+        # The HTML template uses "action" buttons with corresponding aliases.
+        # The merge request is kept, its status records whether it was approved or denied.
+        action = request.form.get('action')
+        merging_request = MergingRequest.query.filter_by(version_id=version.id, status='Pending').first()
+
+        if merging_request and action in ("Accept Changes", "Deny Changes"):
+            accept = action == "Accept Changes"
+            story_id = story.id
+            decision = decide_merge_request(merging_request, accept)
+            if accept:
+                story_changed(story_id)
+            db.session.commit()
+            announce([decision])
+            if accept:
+                page_cache.invalidate('story', story_id)
+            if not accept:
+                flash("Merge Denied", "Info")
+        return redirect('/merge_requests/')
+    diff = fork_diff(story, version)
+    return render_template('review_changes.html', version=version, story=story, diff=diff)
+
+
+
+@bp.route('/events', methods=['GET'])
+@login_required
+def event_stream():
+    '''Merge Request Notifications for the Current User, as Server-Sent Events'''
+    config = current_app.config
+    try:
+        subscription = events.subscribe(current_user.id)
+    except events.TooManyListeners:
+        # A 200 that ends at once, EventSource stops retrying for good after a 503
+        return Response(events.turned_away(config['EVENTS_RETRY_AFTER']), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+    if subscription is None:
+        return Response(status=204)
+    # The stream outlives the request context on purpose, it must not hold a database connection.
+    body = events.stream(subscription, heartbeat=config['EVENTS_HEARTBEAT'], max_age=config['EVENTS_MAX_AGE'])
+    return Response(body, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
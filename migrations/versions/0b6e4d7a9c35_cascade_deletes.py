@@ -0,0 +1,116 @@
+"""cascade deletes
+
+Revision ID: 0b6e4d7a9c35
+Revises: f5a1d2c8e934
+Create Date: 2024-05-04 09:41:12.835390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6e4d7a9c35'
+down_revision = 'f5a1d2c8e934'
+branch_labels = None
+depends_on = None
+
+
+# SQLite reflects unnamed foreign keys without a name, batch mode names them by this convention.
+NAMING = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+# (column, referred table, ON DELETE, constraint name or None when it was created unnamed)
+FOREIGN_KEYS = {
+    'new_story': [
+        ('author_id', 'user', 'CASCADE', 'fk_new_story_author_id'),
+        ('current_version_id', 'new_version', 'SET NULL', 'fk_new_story_current_version_id'),
+    ],
+    'new_version': [
+        ('story_id', 'new_story', 'CASCADE', 'fk_new_version_story_id'),
+        ('author_id', 'user', 'SET NULL', 'fk_new_version_author_id'),
+    ],
+    'merging_request': [
+        ('story_id', 'new_story', 'CASCADE', None),
+        ('version_id', 'new_version', 'CASCADE', None),
+        ('requestor_id', 'user', 'CASCADE', None),
+    ],
+    'version_lineage': [
+        ('ancestor_id', 'new_version', 'CASCADE', None),
+        ('descendant_id', 'new_version', 'CASCADE', None),
+    ],
+}
+
+# Every column a cascade looks rows up by, without these each deleted row is a table scan.
+INDEXES = {
+    'new_story': ['author_id', 'current_version_id'],
+    'new_version': ['story_id', 'author_id', 'base_version_id', 'snapshot_id'],
+    'merging_request': ['story_id', 'version_id', 'requestor_id'],
+}
+
+
+def _existing_name(table, column, referred):
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys(table):
+        if foreign_key['constrained_columns'] == [column] and foreign_key['name']:
+            return foreign_key['name']
+    return NAMING['fk'] % {'table_name': table, 'column_0_name': column, 'referred_table_name': referred}
+
+
+def _rebuild_foreign_keys(table, ondelete):
+    '''Recreate a Table's Foreign Keys with (upgrade) or without (downgrade) their ON DELETE'''
+    if ondelete and op.get_bind().dialect.name != 'sqlite':
+        # create_all also emitted an unnamed duplicate of each named constraint, batch mode on
+        # SQLite drops those when it copies the table, elsewhere they go by hand.
+        for column, referred, _, name in FOREIGN_KEYS[table]:
+            if name:
+                op.execute('ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s_%s_fkey' % (table, table, column))
+
+    with op.batch_alter_table(table, schema=None, naming_convention=NAMING) as batch_op:
+        for column, referred, action, name in FOREIGN_KEYS[table]:
+            # Constraints that were created unnamed come back named
+            batch_op.drop_constraint(_existing_name(table, column, referred), type_='foreignkey')
+            batch_op.create_foreign_key(name or 'fk_%s_%s' % (table, column), referred, [column], ['id'],
+                                        ondelete=action if ondelete else None)
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+    with op.batch_alter_table('new_story', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+    with op.batch_alter_table('new_version', schema=None) as batch_op:
+        batch_op.alter_column('author_id', existing_type=sa.Integer(), nullable=True)
+
+    for table, columns in INDEXES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in columns:
+                batch_op.create_index(batch_op.f('ix_%s_%s' % (table, column)), [column], unique=False)
+
+    # ### end Alembic commands ###
+
+    for table in FOREIGN_KEYS:
+        _rebuild_foreign_keys(table, ondelete=True)
+
+
+def downgrade():
+    for table in FOREIGN_KEYS:
+        _rebuild_foreign_keys(table, ondelete=False)
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    for table, columns in INDEXES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in columns:
+                batch_op.drop_index(batch_op.f('ix_%s_%s' % (table, column)))
+
+    with op.batch_alter_table('new_version', schema=None) as batch_op:
+        batch_op.alter_column('author_id', existing_type=sa.Integer(), nullable=False)
+
+    with op.batch_alter_table('new_story', schema=None) as batch_op:
+        batch_op.drop_column('deleted_at')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('deleted_at')
+
+    # ### end Alembic commands ###
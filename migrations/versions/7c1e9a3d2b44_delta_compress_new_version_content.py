@@ -0,0 +1,86 @@
+"""delta compress new_version content
+
+Revision ID: 7c1e9a3d2b44
+Revises: 52f0b4b49531
+Create Date: 2024-04-02 19:12:41.118230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import version_store
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e9a3d2b44'
+down_revision = '52f0b4b49531'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('new_version') as batch_op:
+        batch_op.add_column(sa.Column('payload', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('base_version_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('snapshot_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('chain_depth', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.create_foreign_key('fk_new_version_base_version_id', 'new_version', ['base_version_id'], ['id'])
+        batch_op.create_foreign_key('fk_new_version_snapshot_id', 'new_version', ['snapshot_id'], ['id'])
+
+    # Re-encode existing rows story by story, oldest first, the same way add_version() does.
+    conn = op.get_bind()
+    story_ids = [row[0] for row in conn.execute(sa.text('SELECT DISTINCT story_id FROM new_version'))]
+    for story_id in story_ids:
+        version_ids = [row[0] for row in conn.execute(
+            sa.text('SELECT id FROM new_version WHERE story_id = :story_id ORDER BY id'),
+            {'story_id': story_id})]
+
+        base_id = snapshot_id = None
+        base_text = None
+        depth = 0
+        for version_id in version_ids:
+            text = conn.execute(sa.text('SELECT content FROM new_version WHERE id = :id'), {'id': version_id}).scalar()
+            payload, is_delta = version_store.encode_version(text, base_text, depth)
+            if is_delta:
+                depth += 1
+                row_base, row_snapshot = base_id, snapshot_id
+            else:
+                depth = 0
+                row_base = row_snapshot = None
+                snapshot_id = version_id
+            conn.execute(
+                sa.text('UPDATE new_version SET payload = :payload, base_version_id = :base, '
+                        'snapshot_id = :snapshot, chain_depth = :depth WHERE id = :id'),
+                {'payload': payload, 'base': row_base, 'snapshot': row_snapshot, 'depth': depth, 'id': version_id})
+            base_id, base_text = version_id, text
+
+    with op.batch_alter_table('new_version') as batch_op:
+        batch_op.alter_column('payload', existing_type=sa.LargeBinary(), nullable=False)
+        batch_op.drop_column('content')
+
+
+def downgrade():
+    with op.batch_alter_table('new_version') as batch_op:
+        batch_op.add_column(sa.Column('content', sa.Text(), nullable=True))
+
+    # Chains only ever point backwards, so rebuilding in id order always has the base at hand.
+    conn = op.get_bind()
+    texts = {}
+    rows = conn.execute(sa.text('SELECT id, story_id, base_version_id FROM new_version ORDER BY story_id, id')).fetchall()
+    current_story = None
+    for version_id, story_id, base_id in rows:
+        if story_id != current_story:
+            texts, current_story = {}, story_id
+        payload = conn.execute(sa.text('SELECT payload FROM new_version WHERE id = :id'), {'id': version_id}).scalar()
+        texts[version_id] = version_store.decode(payload, texts.get(base_id))
+        conn.execute(sa.text('UPDATE new_version SET content = :content WHERE id = :id'),
+                     {'content': texts[version_id], 'id': version_id})
+
+    with op.batch_alter_table('new_version') as batch_op:
+        batch_op.alter_column('content', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_constraint('fk_new_version_snapshot_id', type_='foreignkey')
+        batch_op.drop_constraint('fk_new_version_base_version_id', type_='foreignkey')
+        batch_op.drop_column('chain_depth')
+        batch_op.drop_column('snapshot_id')
+        batch_op.drop_column('base_version_id')
+        batch_op.drop_column('payload')
@@ -0,0 +1,29 @@
+"""create story_search fts5 index
+
+Revision ID: d91b5e0f3a6c
+Revises: a4d8f2c61e07
+Create Date: 2024-04-13 16:48:09.771342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import search
+
+
+# revision identifiers, used by Alembic.
+revision = 'd91b5e0f3a6c'
+down_revision = 'a4d8f2c61e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 virtual tables are outside of what autogenerate knows about, written by hand.
+    conn = op.get_bind()
+    rows = conn.execute(sa.text('SELECT id, title, genre, content FROM new_story')).fetchall()
+    search.rebuild(conn, rows)
+
+
+def downgrade():
+    op.execute('DROP TABLE IF EXISTS story_search')
@@ -0,0 +1,366 @@
+"""
+Database schemas, the events that keep derived tables in step with them, and the
+version storage helpers the blueprints share.
+
+Migrations live in migrations/ and run through Flask-Migrate, see main.create_app().
+"""
+from datetime import datetime
+import hashlib
+import threading
+
+from cachetools import cached, LRUCache
+from flask_login import UserMixin
+from sqlalchemy import DDL, ForeignKeyConstraint, event, inspect, or_
+from sqlalchemy.orm import backref, load_only
+
+from extensions import db, job_queue
+import content_pipeline
+import counters
+import diff_engine
+import lineage
+import search
+import version_store
+
+
+""" Database Notes """
+# Deleting a story from the 'NewStory' class will remove all subsequent Versions and Merge Requests for that story.
+# The database does the removing (ON DELETE CASCADE), and large deletes are batched in the background by purge.py.
+
+
+###################################################
+#               Core Story Entries                #
+###################################################
+
+class NewStory(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False) 
+    genre = db.Column(db.String(200), nullable=True)
+    content = db.Column(db.Text, nullable=False)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    # Foreign keys are indexed so each cascaded delete finds the referencing rows without a scan
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    current_version_id = db.Column(db.Integer, db.ForeignKey('new_version.id', ondelete='SET NULL'), nullable=True,
+                                   index=True)
+    # Set by delete(), the story is hidden from then on and purge.py removes the rows in the background
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    # Derived from content when it is written, see content_pipeline.py
+    excerpt = db.Column(db.String(300), nullable=True)
+    word_count = db.Column(db.Integer, nullable=True)
+    reading_minutes = db.Column(db.Integer, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)
+    chunk_offsets = db.Column(db.Text, nullable=True)
+
+    # Relationships
+    __table_args__ = (
+        ForeignKeyConstraint(['author_id'], ['user.id'], name='fk_new_story_author_id', ondelete='CASCADE'),
+        ForeignKeyConstraint(['current_version_id'], ['new_version.id'], name='fk_new_story_current_version_id',
+                             ondelete='SET NULL'),
+        # (date_created, id) backs the keyset pagination in story_db()
+        db.Index('ix_new_story_date_created', 'date_created', 'id'),
+        db.Index('ix_new_story_genre', 'genre')
+    )
+
+    current_version = db.relationship('NewVersion', foreign_keys=[current_version_id], post_update=True)
+    # passive_deletes leaves the versions to ON DELETE CASCADE instead of loading every one to delete it
+    versions = db.relationship('NewVersion', backref='story', lazy=True, cascade='all, delete-orphan', passive_deletes=True,
+                               foreign_keys='NewVersion.story_id')
+
+    def __repr__(self):
+        return '<new_story %r>' % self.id
+
+
+class NewVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # Content is stored through version_store, either a compressed snapshot or a delta
+    # against base_version_id. Deferred so version lists never pull the bodies.
+    payload = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    base_version_id = db.Column(db.Integer, db.ForeignKey('new_version.id'), nullable=True, index=True)
+    snapshot_id = db.Column(db.Integer, db.ForeignKey('new_version.id'), nullable=True, index=True)
+    chain_depth = db.Column(db.Integer, default=0, nullable=False)
+    # The version this one was forked from, NULL when forked from the story's original text
+    parent_version_id = db.Column(db.Integer, db.ForeignKey('new_version.id'), nullable=True, index=True)
+    # Derived from the fork's content when it is written, see content_pipeline.py
+    excerpt = db.Column(db.String(300), nullable=True)
+    word_count = db.Column(db.Integer, nullable=True)
+    reading_minutes = db.Column(db.Integer, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)
+    chunk_offsets = db.Column(db.Text, nullable=True)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    story_id = db.Column(db.Integer, db.ForeignKey('new_story.id', ondelete='CASCADE'), nullable=False, index=True)
+    # NULL once the author deletes their account, forks of other people's stories are kept
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True, index=True)
+    
+    # Relationships
+    __table_args__ = (
+        ForeignKeyConstraint(['story_id'], ['new_story.id'], name='fk_new_version_story_id', ondelete='CASCADE'),
+        ForeignKeyConstraint(['author_id'], ['user.id'], name='fk_new_version_author_id', ondelete='SET NULL'),
+        ForeignKeyConstraint(['base_version_id'], ['new_version.id'], name='fk_new_version_base_version_id'),
+        ForeignKeyConstraint(['snapshot_id'], ['new_version.id'], name='fk_new_version_snapshot_id'),
+        ForeignKeyConstraint(['parent_version_id'], ['new_version.id'], name='fk_new_version_parent_version_id')
+    )
+    
+    author = db.relationship('User', backref=backref('versions', passive_deletes=True), foreign_keys=[author_id])
+    
+    def __repr__(self):
+        return '<new_version %r>' % self.id
+
+
+class VersionLineage(db.Model):
+    # Closure table of fork ancestry, maintained by the NewVersion events below (see lineage.py)
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('new_version.id', ondelete='CASCADE'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('new_version.id', ondelete='CASCADE'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_version_lineage_descendant', 'descendant_id', 'depth'),
+    )
+
+
+class MergingRequest(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    story_id = db.Column(db.Integer, db.ForeignKey('new_story.id', ondelete='CASCADE'), nullable=False, index=True)
+    version_id = db.Column(db.Integer, db.ForeignKey('new_version.id', ondelete='CASCADE'), nullable=False, index=True) 
+    requestor_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True) 
+    status = db.Column(db.String(20), default='Pending', nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate = datetime.utcnow)
+    # The fork's diff against the story, worked out by the diff_forks job. Only good while the
+    # story's content_hash still matches diff_base_hash, fork_diff() falls back to diffing on the spot.
+    diff_html = db.deferred(db.Column(db.Text, nullable=True))
+    diff_words_added = db.Column(db.Integer, nullable=True)
+    diff_words_removed = db.Column(db.Integer, nullable=True)
+    diff_base_hash = db.Column(db.String(64), nullable=True)
+
+    # Relationships
+    story = db.relationship('NewStory', backref=backref('merging_requests', cascade='all, delete', lazy=True,
+                                                         passive_deletes=True))
+    version = db.relationship('NewVersion', backref=backref('merging_requests', uselist=False, passive_deletes=True))
+    requestor = db.relationship('User', backref=backref('merging_requests', lazy=True, passive_deletes=True))
+
+
+###################################################
+#               Contribution Counters             #
+###################################################
+
+# Running counts kept by the events below instead of counted per request (see counters.py).
+# `flask rebuild-counters` recomputes them if they ever drift.
+class UserStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    stories = db.Column(db.Integer, default=0, nullable=False)
+    versions = db.Column(db.Integer, default=0, nullable=False)
+    merges_accepted = db.Column(db.Integer, default=0, nullable=False)
+    points = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        # user_dir()'s score order, read straight off the index
+        db.Index('ix_user_stats_points', 'points', 'user_id'),
+    )
+
+
+class StoryStats(db.Model):
+    story_id = db.Column(db.Integer, db.ForeignKey('new_story.id', ondelete='CASCADE'), primary_key=True)
+    forks = db.Column(db.Integer, default=0, nullable=False)
+    pending_requests = db.Column(db.Integer, default=0, nullable=False)
+
+    story = db.relationship('NewStory', backref=backref('stats', uselist=False, passive_deletes=True))
+
+
+###################################################
+#               Job Queue                         #
+###################################################
+
+class Job(db.Model):
+    # Deferred work, queued with the write that calls for it and run by `flask run-jobs` (see jobs.py).
+    # Times are unix seconds so the worker can order and measure by them directly.
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    idempotency_key = db.Column(db.String(200), nullable=True)
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+    run_at = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.Float, nullable=False)
+    started_at = db.Column(db.Float, nullable=True)
+    finished_at = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('idempotency_key', name='uq_job_idempotency_key'),
+        # The worker's claim, the next due job
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+
+###################################################
+#               Search Index Sync                 #
+###################################################
+
+# Keeps the story_search FTS5 mirror (see search.py) in step with the stories. Indexing is queued in the
+# story write's transaction and done by the job worker, removing a story from the index is done straight away.
+# FTS5 is SQLite only, on other databases search.py skips indexing and /search comes back empty.
+event.listen(db.metadata, 'after_create', DDL(search.CREATE_INDEX).execute_if(dialect='sqlite'))
+
+
+@event.listens_for(NewStory, 'after_insert')
+def index_new_story(mapper, connection, target):
+    job_queue.enqueue('index_story', {'story_id': target.id}, connection=connection)
+
+
+@event.listens_for(NewStory, 'after_update')
+def reindex_story(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ('title', 'genre', 'content')):
+        job_queue.enqueue('index_story', {'story_id': target.id}, connection=connection)
+
+
+@event.listens_for(NewStory, 'after_delete')
+def unindex_story(mapper, connection, target):
+    search.remove_story(connection, target.id)
+
+
+###################################################
+#               Fork Lineage Sync                 #
+###################################################
+
+@event.listens_for(NewVersion, 'after_insert')
+def record_fork(mapper, connection, target):
+    lineage.record_fork(connection, target.id, target.parent_version_id)
+
+
+@event.listens_for(NewVersion, 'after_delete')
+def forget_fork(mapper, connection, target):
+    lineage.forget_version(connection, target.id)
+
+
+###################################################
+#               Contribution Counters Sync        #
+###################################################
+
+# Moved in the same flush as the row that earns them. Deleting goes through counters.forget_story(),
+# delete() and delete_account() only mark stories, and purge.py removes rows without the ORM.
+
+@event.listens_for(NewStory, 'after_insert')
+def count_story(mapper, connection, target):
+    counters.bump_story(connection, target.id)
+    counters.bump_user(connection, target.author_id, stories=1)
+
+
+@event.listens_for(NewVersion, 'after_insert')
+def count_fork(mapper, connection, target):
+    counters.bump_story(connection, target.story_id, forks=1)
+    if target.author_id is not None:
+        counters.bump_user(connection, target.author_id, versions=1)
+
+
+@event.listens_for(MergingRequest, 'after_insert')
+def count_merge_request(mapper, connection, target):
+    if target.status == 'Pending':
+        counters.bump_story(connection, target.story_id, pending_requests=1)
+
+
+@event.listens_for(MergingRequest, 'after_update')
+def count_merge_decision(mapper, connection, target):
+    history = inspect(target).attrs.status.history
+    if not history.has_changes() or 'Pending' not in history.deleted:
+        return
+    counters.bump_story(connection, target.story_id, pending_requests=-1)
+    if target.status == 'Accepted':
+        counters.bump_user(connection, target.requestor_id, merges_accepted=1)
+
+
+###################################################
+#               Version Storage                   #
+###################################################
+
+def live_story(id, *options):
+    '''A Story that hasn't been Deleted, or 404'''
+    return NewStory.query.options(*options).filter(NewStory.id == id, NewStory.deleted_at.is_(None)).first_or_404()
+
+
+def load_version_content(version):
+    '''Rebuild a Version's Content from its Delta Chain'''
+    if version.base_version_id is None:
+        return version_store.decode(version.payload)
+
+    # One query pulls the snapshot and every delta after it, capped by SNAPSHOT_INTERVAL.
+    root_id = version.snapshot_id
+    rows = db.session.query(NewVersion.id, NewVersion.base_version_id, NewVersion.payload).filter(
+        or_(NewVersion.id == root_id, NewVersion.snapshot_id == root_id),
+        NewVersion.id <= version.id).all()
+    chain = {row.id: (row.base_version_id, row.payload) for row in rows}
+    return version_store.rebuild(version.id, chain)
+
+
+# Rebuilt fork content keyed by (version id, content hash), up to VERSION_CACHE_CHARS characters in all.
+# Reading a fork part by part rebuilds its delta chain on the first part only, and a hit never loads
+# the deferred payload.
+VERSION_CACHE_CHARS = 16 * 2 ** 20
+
+
+@cached(LRUCache(maxsize=VERSION_CACHE_CHARS, getsizeof=len),
+        key=lambda version: (version.id, version.content_hash), lock=threading.Lock())
+def version_content(version):
+    '''A Version's Content, Rebuilt from its Delta Chain on the First Read and Cached after'''
+    return load_version_content(version)
+
+
+def add_version(story, content, author_id, parent_version_id=None):
+    '''Stage a New Version as a Delta against the Story's Latest Version'''
+    # Forks are cleaned here, once, review_changes.html and read_version.html render them as html.
+    processed = content_pipeline.process(content)
+    base = NewVersion.query.options(
+        load_only(NewVersion.id, NewVersion.base_version_id, NewVersion.snapshot_id, NewVersion.chain_depth)
+    ).filter_by(story_id=story.id).order_by(NewVersion.id.desc()).first()
+
+    base_content = load_version_content(base) if base else None
+    payload, is_delta = version_store.encode_version(processed['content'], base_content, base.chain_depth if base else 0)
+
+    new_version = NewVersion(payload=payload, story_id=story.id, author_id=author_id,
+                             parent_version_id=parent_version_id)
+    content_pipeline.apply(new_version, processed)
+    if is_delta:
+        new_version.base_version_id = base.id
+        new_version.snapshot_id = base.snapshot_id or base.id
+        new_version.chain_depth = base.chain_depth + 1
+    else:
+        new_version.chain_depth = 0
+    db.session.add(new_version)
+    return new_version
+
+
+# Fork diffs keyed by (story content hash, version id). Versions never change after they
+# are written, so an entry only goes stale when the story itself moves on.
+@cached(LRUCache(maxsize=128), key=lambda content_hash, version, story_content: (content_hash, version.id),
+        lock=threading.Lock())
+def _fork_diff(content_hash, version, story_content):
+    return diff_engine.diff_html(story_content, version_content(version))
+
+
+def story_hash(story):
+    # content_hash is written with the content, stories older than it are hashed here.
+    return story.content_hash or hashlib.sha256(story.content.encode('utf-8')).hexdigest()
+
+
+def fork_diff(story, version):
+    '''Diff a Fork against the Story's Current Content'''
+    content_hash = story_hash(story)
+    # Usually the diff_forks job has stored it already
+    merge_request = version.merging_requests
+    if merge_request is not None and merge_request.diff_base_hash == content_hash:
+        return diff_engine.Diff(merge_request.diff_html, merge_request.diff_words_added,
+                                merge_request.diff_words_removed)
+    return _fork_diff(content_hash, version, story.content)
+
+
+###################################################
+#               User Schemas                      #
+###################################################
+
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(20), nullable=False, unique=True)
+    password = db.Column(db.String(80), nullable=False)
+    # Set when the account is deleted, the user is logged out and purge.py removes the rows in the background
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    stories = db.relationship('NewStory', backref='author', lazy=True, passive_deletes=True, foreign_keys=[NewStory.author_id])
@@ -0,0 +1,188 @@
+"""
+Rendered page cache for the read heavy routes.
+
+A cached page remembers the tags it was built from (the story it shows, the author
+whose list it is) and the generation each tag was at. Writes bump the generation of
+the tags they touch, so any page built from older data misses on its next read.
+|-- @cached_page              on a view, caches its 200 GET responses
+|-- tag_page('story', id)     inside the view, declares what the page depends on
+|-- invalidate('story', id)   after a commit that changes it
+A page is keyed by its path and the KEY_ARGS it was asked for, any other query
+arguments are ignored, so junk ones can't fill the cache with copies of a page.
+A cached view that starts reading another argument has to be added to KEY_ARGS.
+
+Two backends, picked with PAGE_CACHE:
+|-- 'sqlite' (default)  a local file shared by every gunicorn worker on the dyno
+|-- 'memory'            an in-process LRU, invalidation only reaches the worker that wrote
+|-- 'off'               no caching
+Cached responses carry an ETag and Last-Modified so browsers can revalidate with a 304.
+"""
+from email.utils import formatdate
+from functools import wraps
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cachetools import TTLCache
+from flask import current_app, g, make_response, request
+from flask_login import current_user
+
+
+class MemoryBackend:
+    '''Per Worker LRU with TTL'''
+
+    def __init__(self, maxsize=512, ttl=300):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+
+    def generation(self, tag):
+        return self.generations.get(tag, 0)
+
+    def bump(self, tag):
+        with self.lock:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+
+
+class SQLiteBackend:
+    '''Entries and Generations in a Local SQLite File Shared across Workers'''
+
+    def __init__(self, path, ttl=300):
+        self.path = path
+        self.ttl = ttl
+        self.local = threading.local()
+
+    def _connection(self):
+        # One connection per thread, and a fresh one after gunicorn forks a worker
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS page_cache (key TEXT PRIMARY KEY, entry TEXT, expires REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS page_generation (tag TEXT PRIMARY KEY, generation INTEGER)')
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT entry FROM page_cache WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, entry):
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO page_cache (key, entry, expires) VALUES (?, ?, ?)',
+                           (key, json.dumps(entry), time.time() + self.ttl))
+        # Expired rows are swept now and then rather than on every write
+        if hash(key) % 100 == 0:
+            connection.execute('DELETE FROM page_cache WHERE expires <= ?', (time.time(),))
+
+    def generation(self, tag):
+        row = self._connection().execute('SELECT generation FROM page_generation WHERE tag = ?', (tag,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, tag):
+        self._connection().execute(
+            'INSERT INTO page_generation (tag, generation) VALUES (?, 1) '
+            'ON CONFLICT(tag) DO UPDATE SET generation = generation + 1', (tag,))
+
+
+def init_app(app):
+    '''Pick the Backend from PAGE_CACHE / PAGE_CACHE_TTL / PAGE_CACHE_PATH'''
+    kind = app.config.get('PAGE_CACHE', 'sqlite')
+    ttl = app.config.get('PAGE_CACHE_TTL', 300)
+    if kind == 'memory':
+        backend = MemoryBackend(ttl=ttl)
+    elif kind == 'sqlite':
+        path = app.config.get('PAGE_CACHE_PATH') or os.path.join(app.instance_path, 'page_cache.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        backend = SQLiteBackend(path, ttl=ttl)
+    else:
+        backend = None
+    app.extensions['page_cache'] = backend
+
+
+def _backend():
+    return current_app.extensions.get('page_cache')
+
+
+def _tag(kind, id):
+    return '%s:%s' % (kind, id)
+
+
+def tag_page(kind, id):
+    '''Declare that the Page being Rendered Depends on (kind, id)'''
+    backend = _backend()
+    if backend is not None and 'page_cache_tags' in g:
+        tag = _tag(kind, id)
+        g.page_cache_tags[tag] = backend.generation(tag)
+
+
+def invalidate(kind, id):
+    '''Expire every Cached Page Tagged with (kind, id)'''
+    backend = _backend()
+    if backend is not None:
+        backend.bump(_tag(kind, id))
+
+
+def _respond(entry):
+    response = make_response(entry['body'])
+    response.set_etag(entry['etag'])
+    response.headers['Last-Modified'] = formatdate(entry['modified'], usegmt=True)
+    # Pages differ for logged in users, and must be revalidated rather than reused blindly
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+
+# Query arguments the cached views read, all of them as ints: ?part= of the reading pages, ?focus= of fork_lineage.
+KEY_ARGS = ('part', 'focus')
+
+
+def _key(variant):
+    '''The Path plus the KEY_ARGS Given, Read the way the Views Read them'''
+    values = ((name, request.args.get(name, type=int)) for name in KEY_ARGS)
+    query = '&'.join('%s=%d' % (name, value) for name, value in values if value is not None)
+    return '%s?%s|%s' % (request.path, query, variant)
+
+
+def cached_page(view):
+    '''Cache a View's Rendered 200 Responses'''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        backend = _backend()
+        if backend is None or request.method != 'GET':
+            return view(*args, **kwargs)
+
+        variant = 'user' if current_user.is_authenticated else 'anon'
+        key = _key(variant)
+        entry = backend.get(key)
+        if entry and all(backend.generation(tag) == generation for tag, generation in entry['tags'].items()):
+            return _respond(entry)
+
+        g.page_cache_tags = {}
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+
+        body = response.get_data(as_text=True)
+        entry = {
+            'body': body,
+            'etag': hashlib.sha1(body.encode('utf-8')).hexdigest(),
+            'modified': time.time(),
+            'tags': g.page_cache_tags,
+        }
+        backend.set(key, entry)
+        return _respond(entry)
+    return wrapper
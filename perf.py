@@ -0,0 +1,199 @@
+"""
+Opt-in request instrumentation.
+
+When PERF_INSTRUMENTATION is set, every request records its latency, how many SQL
+statements it ran and how long they took, and how long Jinja spent rendering. Totals
+are kept in memory per endpoint (one set per gunicorn worker) and served from
+|-- /_debug/perf          json summary with the slowest statements
+|-- /_debug/perf/metrics  prometheus text format
+Both answer local requests only (a scraper or shell on the same machine), anyone else gets a 404.
+
+When it is not set none of the hooks are registered, so requests pay nothing for it.
+"""
+from bisect import bisect_left
+from functools import wraps
+import heapq
+import threading
+import time
+
+from flask import Response, abort, g, has_request_context, jsonify, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Peer addresses allowed to read the debug endpoints.
+LOCAL_ADDRESSES = frozenset(('127.0.0.1', '::1'))
+
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# How many of the slowest statements are kept.
+SLOW_STATEMENTS = 20
+
+
+class EndpointStats:
+    '''Running Totals for One Endpoint'''
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            'requests': self.count,
+            'avg_ms': round(self.seconds / self.count * 1000, 2) if self.count else 0,
+            'queries': self.queries,
+            'queries_per_request': round(self.queries / self.count, 2) if self.count else 0,
+            'sql_ms': round(self.sql_seconds * 1000, 2),
+            'template_ms': round(self.template_seconds * 1000, 2),
+            'histogram': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], self.buckets)),
+        }
+
+
+class Recorder:
+    '''In Memory Store of Request Timings'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.slowest = []
+
+    def record_request(self, endpoint, seconds, queries, sql_seconds, template_seconds):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, EndpointStats())
+            stats.buckets[bisect_left(BUCKETS, seconds)] += 1
+            stats.count += 1
+            stats.seconds += seconds
+            stats.queries += queries
+            stats.sql_seconds += sql_seconds
+            stats.template_seconds += template_seconds
+
+    def record_statement(self, endpoint, statement, seconds):
+        entry = (seconds, endpoint, ' '.join(statement.split()))
+        with self.lock:
+            if len(self.slowest) < SLOW_STATEMENTS:
+                heapq.heappush(self.slowest, entry)
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'endpoints': {name: stats.as_dict() for name, stats in sorted(self.endpoints.items())},
+                'slowest_statements': [
+                    {'ms': round(seconds * 1000, 2), 'endpoint': endpoint, 'statement': statement}
+                    for seconds, endpoint, statement in sorted(self.slowest, reverse=True)
+                ],
+            }
+
+    def prometheus(self):
+        lines = [
+            '# TYPE branchlibrary_request_duration_seconds histogram',
+        ]
+        with self.lock:
+            items = sorted(self.endpoints.items())
+            for name, stats in items:
+                cumulative = 0
+                for bound, hits in zip(BUCKETS + ('+Inf',), stats.buckets):
+                    cumulative += hits
+                    lines.append('branchlibrary_request_duration_seconds_bucket{endpoint="%s",le="%s"} %d'
+                                 % (name, bound, cumulative))
+                lines.append('branchlibrary_request_duration_seconds_sum{endpoint="%s"} %f' % (name, stats.seconds))
+                lines.append('branchlibrary_request_duration_seconds_count{endpoint="%s"} %d' % (name, stats.count))
+
+            for metric, attribute, kind in (
+                    ('branchlibrary_sql_queries_total', 'queries', '%d'),
+                    ('branchlibrary_sql_duration_seconds_total', 'sql_seconds', '%f'),
+                    ('branchlibrary_template_duration_seconds_total', 'template_seconds', '%f')):
+                lines.append('# TYPE %s counter' % metric)
+                for name, stats in items:
+                    lines.append(('%s{endpoint="%s"} ' + kind) % (metric, name, getattr(stats, attribute)))
+        return '\n'.join(lines) + '\n'
+
+
+recorder = Recorder()
+
+
+def local_only(view):
+    '''Serve a Debug Endpoint to Requests from this Machine, 404 for Anyone Else'''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # The socket's own address, before ProxyFix swaps in X-Forwarded-For, which a client can write
+        peer = request.environ.get('werkzeug.proxy_fix.orig', request.environ).get('REMOTE_ADDR')
+        if peer not in LOCAL_ADDRESSES:
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+###################################################
+#                     Hooks                       #
+###################################################
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g._perf_statement_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context() or 'perf_start' not in g:
+        return
+    seconds = time.perf_counter() - g.pop('_perf_statement_start', time.perf_counter())
+    g.perf_queries += 1
+    g.perf_sql_seconds += seconds
+    recorder.record_statement(_endpoint(), statement, seconds)
+
+
+def _before_render(sender, template, context, **extra):
+    g._perf_render_start = time.perf_counter()
+
+
+def _rendered(sender, template, context, **extra):
+    if 'perf_start' in g:
+        g.perf_template_seconds += time.perf_counter() - g.pop('_perf_render_start', time.perf_counter())
+
+
+def _start_request():
+    g.perf_start = time.perf_counter()
+    g.perf_queries = 0
+    g.perf_sql_seconds = 0.0
+    g.perf_template_seconds = 0.0
+
+
+def _finish_request(exc):
+    if 'perf_start' not in g or request.endpoint in ('perf_summary', 'perf_metrics'):
+        return
+    recorder.record_request(_endpoint(), time.perf_counter() - g.perf_start,
+                            g.perf_queries, g.perf_sql_seconds, g.perf_template_seconds)
+
+
+def init_app(app):
+    '''Register the Hooks and Debug Endpoints, only when PERF_INSTRUMENTATION is On'''
+    if not app.config.get('PERF_INSTRUMENTATION'):
+        return
+
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.before_request(_start_request)
+    app.teardown_request(_finish_request)
+
+    @app.route('/_debug/perf', methods=['GET'])
+    @local_only
+    def perf_summary():
+        return jsonify(recorder.snapshot())
+
+    @app.route('/_debug/perf/metrics', methods=['GET'])
+    @local_only
+    def perf_metrics():
+        return Response(recorder.prometheus(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,80 @@
+"""
+Story and account deletion in bounded batches.
+
+Deleting a story used to load and delete every version through the ORM inside the
+request, holding SQLite's write lock for as long as that took. Now the request only
+marks the row (deleted_at), which hides it everywhere, and the rows are removed here
+in batches of PURGE_BATCH_SIZE, each its own short transaction with PURGE_PAUSE seconds
+after it, so other writers get the lock in between:
+|-- purge_story(id)  merge requests, then versions newest first, then the story
+|-- purge_user(id)   every story of theirs, their merge requests, unattributes their
+|                    forks of other people's stories, then the account
+
+The schema cascades (ON DELETE CASCADE) clean up whatever hangs off each deleted row,
+version_lineage and merge requests included. Versions go newest first because a fork's
+delta base, snapshot and parent are always older versions of the same story.
+
+Purges are queued as jobs with the marking commit (see jobs.py), and `flask purge-deleted`
+finishes any whose job gave up.
+"""
+import time
+
+from sqlalchemy import text
+
+import counters
+import search
+
+
+def _batches(session, statement, params, batch_size, pause):
+    '''Run a Bounded DELETE/UPDATE until it Stops Matching, one Commit per Batch'''
+    total = 0
+    while True:
+        count = session.execute(statement, dict(params, limit=batch_size)).rowcount
+        session.commit()
+        total += count
+        if count < batch_size:
+            return total
+        # A waiting SQLite writer only retries the lock every 100ms or so, going straight into
+        # the next batch would keep taking it first.
+        time.sleep(pause)
+
+
+def purge_story(session, story_id, batch_size=500, pause=0.1):
+    '''Remove a Story and Everything Forked from it, returns Versions Removed'''
+    _batches(session, text(
+        "DELETE FROM merging_request WHERE id IN "
+        "(SELECT id FROM merging_request WHERE story_id = :id LIMIT :limit)"), {'id': story_id}, batch_size, pause)
+
+    session.execute(text("UPDATE new_story SET current_version_id = NULL WHERE id = :id"), {'id': story_id})
+    session.commit()
+    versions = _batches(session, text(
+        "DELETE FROM new_version WHERE id IN "
+        "(SELECT id FROM new_version WHERE story_id = :id ORDER BY id DESC LIMIT :limit)"), {'id': story_id},
+        batch_size, pause)
+
+    session.execute(text("DELETE FROM new_story WHERE id = :id"), {'id': story_id})
+    search.remove_story(session.connection(), story_id)
+    session.commit()
+    return versions
+
+
+def purge_user(session, user_id, batch_size=500, pause=0.1):
+    '''Remove an Account, its Stories and Merge Requests, Keeping its Forks of Other Stories'''
+    story_ids = [row[0] for row in session.execute(
+        text("SELECT id FROM new_story WHERE author_id = :id"), {'id': user_id})]
+    for story_id in story_ids:
+        purge_story(session, story_id, batch_size, pause)
+
+    # Their requests stop counting as pending on other people's stories before they go
+    counters.forget_requests(session.connection(), user_id)
+    session.commit()
+    _batches(session, text(
+        "DELETE FROM merging_request WHERE id IN "
+        "(SELECT id FROM merging_request WHERE requestor_id = :id LIMIT :limit)"), {'id': user_id}, batch_size, pause)
+    # Other stories' delta chains run through these forks, so they stay, just without an author.
+    _batches(session, text(
+        "UPDATE new_version SET author_id = NULL WHERE id IN "
+        "(SELECT id FROM new_version WHERE author_id = :id LIMIT :limit)"), {'id': user_id}, batch_size, pause)
+
+    session.execute(text('DELETE FROM "user" WHERE id = :id'), {'id': user_id})
+    session.commit()
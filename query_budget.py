@@ -0,0 +1,47 @@
+"""
+Query counting for routes.
+
+Counts the SQL statements an engine runs (hooked on before_cursor_execute) so a page
+that starts lazy loading one row at a time shows up as a broken budget instead of a
+slow page in production. Used by `flask check-query-budgets` in commands.py.
+"""
+from sqlalchemy import event
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    '''
+    Context Manager Counting Statements on an Engine
+    |-- with QueryCounter(db.engine) as counter: ...
+    |-- counter.count, counter.statements
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+        return False
+
+
+def assert_query_budget(counter, budget, label=''):
+    '''Raise QueryBudgetExceeded Listing the Statements when over Budget'''
+    if counter.count > budget:
+        statements = '\n'.join('  %s' % ' '.join(statement.split()) for statement in counter.statements)
+        raise QueryBudgetExceeded(
+            '%s ran %d queries, budget is %d:\n%s' % (label, counter.count, budget, statements))
@@ -0,0 +1,118 @@
+"""
+Full text search over stories.
+
+Stories are mirrored into an SQLite FTS5 virtual table (story_search) keyed by the
+story id, so /search is an index lookup ranked by bm25 rather than a LIKE scan over
+every content body. The html is reduced to plain text before it is indexed.
+FTS5 is SQLite only, on any other database these functions do nothing.
+
+The SQLAlchemy events on NewStory in models.py queue an index_story job with each
+write, and the job (tasks.py) brings the story's row up to date once it runs, so a new
+or edited story shows up in /search as soon as the job queue gets to it (see jobs.py).
+`flask rebuild-search-index` rebuilds the mirror from scratch.
+"""
+from html import escape, unescape
+import re
+
+from sqlalchemy import text
+
+
+CREATE_INDEX = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS story_search "
+    "USING fts5(title, genre, content, tokenize='porter unicode61')"
+)
+
+# Column weights for bm25, a hit in the title counts for more than one in the body.
+_RANK = "bm25(story_search, 10.0, 5.0, 1.0)"
+
+# Snippets are built with control characters as markers so the text can be
+# escaped first and the markers swapped for <mark> tags afterwards.
+_OPEN, _CLOSE = '\x02', '\x03'
+
+_TAG = re.compile(r'<[^>]+>')
+_SPACE = re.compile(r'\s+')
+
+
+def plain_text(html):
+    '''Strip Tags and Entities from Story Html'''
+    return _SPACE.sub(' ', unescape(_TAG.sub(' ', html or ''))).strip()
+
+
+def match_expression(query):
+    '''
+    Turn User Input into a Safe FTS5 Query
+    |-- every word is quoted so operators and stray quotes can't break the syntax
+    |-- the last word is a prefix match so results show up while typing
+    '''
+    words = [word.replace('"', '""') for word in query.split()]
+    if not words:
+        return None
+    terms = ['"%s"' % word for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def supported(connection):
+    return connection.dialect.name == 'sqlite'
+
+
+def index_story(connection, story_id, title, genre, content):
+    if not supported(connection):
+        return
+    connection.execute(text("DELETE FROM story_search WHERE rowid = :id"), {'id': story_id})
+    connection.execute(
+        text("INSERT INTO story_search (rowid, title, genre, content) VALUES (:id, :title, :genre, :content)"),
+        {'id': story_id, 'title': title, 'genre': genre or '', 'content': plain_text(content)})
+
+
+def remove_story(connection, story_id):
+    if not supported(connection):
+        return
+    connection.execute(text("DELETE FROM story_search WHERE rowid = :id"), {'id': story_id})
+
+
+def rebuild(connection, rows, batch_size=500):
+    '''Replace the Index with rows of (id, title, genre, content)'''
+    if not supported(connection):
+        return 0
+    connection.execute(text(CREATE_INDEX))
+    connection.execute(text("DELETE FROM story_search"))
+    insert = text("INSERT INTO story_search (rowid, title, genre, content) VALUES (:id, :title, :genre, :content)")
+    batch = []
+    count = 0
+    for story_id, title, genre, content in rows:
+        batch.append({'id': story_id, 'title': title, 'genre': genre or '', 'content': plain_text(content)})
+        if len(batch) >= batch_size:
+            connection.execute(insert, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        connection.execute(insert, batch)
+        count += len(batch)
+    return count
+
+
+def _highlight(snippet):
+    return escape(snippet).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def search(connection, query, limit=25):
+    '''
+    Ranked Story Matches
+    |-- returns dicts of story_id, title, genre and an html snippet with <mark> highlights
+    '''
+    expression = match_expression(query)
+    if expression is None or not supported(connection):
+        return []
+
+    rows = connection.execute(text(
+        "SELECT rowid, title, genre, "
+        "snippet(story_search, 2, :open, :close, '...', 24) AS snippet "
+        "FROM story_search WHERE story_search MATCH :query "
+        "ORDER BY " + _RANK + " LIMIT :limit"),
+        {'open': _OPEN, 'close': _CLOSE, 'query': expression, 'limit': limit})
+
+    return [
+        {'story_id': row.rowid, 'title': row.title, 'genre': row.genre, 'snippet': _highlight(row.snippet)}
+        for row in rows
+    ]
@@ -0,0 +1,151 @@
+"""
+Synthetic BranchLibrary data for load testing.
+
+Generates users, stories, forks (NewVersion) and merge requests at whatever scale is
+asked for, e.g. `flask seed-library --users 10000 --stories 50000 --versions 1000000`.
+Rows are written with batched core INSERTs and explicit ids rather than one ORM
+object at a time, so a million versions is minutes rather than hours. Forks are
+encoded through version_store the same way add_version() does it, and hang off a
+random earlier fork of their story (version_lineage is rebuilt afterwards).
+
+The generated html is known to be clean, so rows get content_pipeline.derive()
+rather than a bleach pass each.
+
+Explicit ids leave PostgreSQL's serial sequences behind, so they are moved past the
+new rows at the end (database.advance_sequences).
+
+Every generated user has the same password (--password) so the load test can log in
+as any of them.
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert
+
+import content_pipeline
+import database
+import version_store
+from extensions import db, hasher
+from models import User, NewStory, NewVersion, MergingRequest
+
+
+GENRES = ['Noir', 'Fantasy', 'Sci-Fi', 'Horror', 'Romance', 'Western', 'Mystery', 'Comedy']
+WORDS = ['the', 'bar', 'night', 'stranger', 'whiskey', 'rain', 'door', 'story', 'old', 'light', 'quiet', 'road',
+         'glass', 'smoke', 'river', 'letter', 'morning', 'train', 'voice', 'window', 'dragon', 'ship', 'star']
+
+
+def _paragraph(rng):
+    return '<p>' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(30, 80))) + '.</p>\n'
+
+
+def _next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+class _Batcher:
+    '''Collects Rows per Table and Flushes them as executemany INSERTs'''
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.rows = {}
+        self.written = {}
+
+    def add(self, model, row):
+        rows = self.rows.setdefault(model, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Tables go out in the order they were first seen, so foreign keys always point at written rows
+        for table in self.rows:
+            rows = self.rows[table]
+            if rows:
+                db.session.execute(insert(table), rows)
+                db.session.commit()
+                self.written[table] = self.written.get(table, 0) + len(rows)
+                self.rows[table] = []
+
+
+def generate(users, stories, versions, merge_rate=0.2, password='password', paragraphs=12, batch_size=1000,
+             seed=None, progress=print):
+    '''Write the Synthetic Library, returns Rows Written per Table Name'''
+    rng = random.Random(seed)
+    batcher = _Batcher(batch_size)
+    started = time.perf_counter()
+    now = datetime.utcnow()
+
+    # One hash shared by every user, hashing a million passwords would be the whole run
+    password_hash = hasher.hash_password(password)
+    first_user = _next_id(User)
+    user_ids = range(first_user, first_user + users)
+    for user_id in user_ids:
+        batcher.add(User, {'id': user_id, 'username': 'reader%d' % user_id, 'password': password_hash})
+    batcher.flush()
+    progress(f"users: {users}")
+
+    # Stories keep their latest text in memory so forks can be encoded as deltas against it
+    first_story = _next_id(NewStory)
+    chains = {}
+    for story_id in range(first_story, first_story + stories):
+        text = ''.join(_paragraph(rng) for _ in range(paragraphs))
+        chains[story_id] = {'text': text, 'base_id': None, 'snapshot_id': None, 'depth': 0, 'forks': []}
+        batcher.add(NewStory, {
+            'id': story_id,
+            'title': ' '.join(rng.choice(WORDS) for _ in range(3)).title(),
+            'genre': rng.choice(GENRES),
+            'content': text,
+            **content_pipeline.derive(text),
+            'date_created': now - timedelta(minutes=rng.randint(0, 525600)),
+            'author_id': rng.choice(user_ids),
+        })
+    batcher.flush()
+    progress(f"stories: {stories}")
+
+    first_version = _next_id(NewVersion)
+    first_request = _next_id(MergingRequest)
+    request_id = first_request
+    story_ids = list(chains)
+    for count, version_id in enumerate(range(first_version, first_version + versions), start=1):
+        story_id = rng.choice(story_ids)
+        chain = chains[story_id]
+        parts = chain['text'].split('\n')[:-1]
+        parts[rng.randrange(len(parts))] = _paragraph(rng).rstrip('\n')
+        text = '\n'.join(parts) + '\n'
+
+        # Like add_version(), a story's first fork is a snapshot and later ones delta against the previous fork
+        base_text = chain['text'] if chain['base_id'] is not None else None
+        payload, is_delta = version_store.encode_version(text, base_text, chain['depth'])
+        # Forks branch from the original text or any earlier fork of the story, so lineage trees get some depth
+        parent_id = rng.choice(chain['forks'] + [None]) if chain['forks'] else None
+        row = {'id': version_id, 'payload': payload, 'story_id': story_id, 'author_id': rng.choice(user_ids),
+               'parent_version_id': parent_id, 'date_created': now - timedelta(minutes=rng.randint(0, 100000)),
+               **content_pipeline.derive(text)}
+        if is_delta:
+            row.update(base_version_id=chain['base_id'], snapshot_id=chain['snapshot_id'], chain_depth=chain['depth'] + 1)
+            chain['depth'] += 1
+        else:
+            row.update(base_version_id=None, snapshot_id=None, chain_depth=0)
+            chain['snapshot_id'], chain['depth'] = version_id, 0
+        chain['base_id'], chain['text'] = version_id, text
+        chain['forks'].append(version_id)
+        batcher.add(NewVersion, row)
+
+        if rng.random() < merge_rate:
+            batcher.add(MergingRequest, {
+                'id': request_id, 'story_id': story_id, 'version_id': version_id, 'requestor_id': row['author_id'],
+                'status': 'Pending' if rng.random() < 0.7 else rng.choice(['Accepted', 'Denied']),
+                'created_at': row['date_created'], 'updated_at': row['date_created'],
+            })
+            request_id += 1
+
+        if count % 100000 == 0:
+            elapsed = time.perf_counter() - started
+            progress(f"versions: {count}/{versions} ({count / elapsed:.0f}/s)")
+    batcher.flush()
+    database.advance_sequences(db.session.connection(), [User.__table__, NewStory.__table__, NewVersion.__table__,
+                                                         MergingRequest.__table__])
+    db.session.commit()
+
+    return {model.__tablename__: written for model, written in batcher.written.items()}
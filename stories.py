@@ -0,0 +1,315 @@
+"""
+Stories: writing, the library and search, reading in parts, editing, deleting, and
+the author directory.
+"""
+from datetime import datetime
+import json
+import threading
+
+from cachetools import cached, TTLCache
+from flask import Blueprint, abort, current_app, flash, redirect, render_template, request, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import joinedload, load_only
+
+from extensions import db, job_queue
+from models import MergingRequest, NewStory, NewVersion, User, UserStats, add_version, live_story, load_version_content
+import content_pipeline
+import counters
+import events
+import page_cache
+import search
+
+
+bp = Blueprint('stories', __name__)
+
+
+###################################################
+#               Reading in Parts                  #
+###################################################
+
+# Long stories are sent one part at a time, cut at the chunk_offsets content_pipeline stores with the
+# content. The reading pages carry the first part (or ?part=n) and story_parts.html fetches the next
+# one from the /parts/<n> route as the reader scrolls towards it.
+
+def part_offsets(row, content=None):
+    '''Part Offsets of a Story or Version, Worked out on the Spot for Rows Older than chunk_offsets'''
+    if row.chunk_offsets:
+        return json.loads(row.chunk_offsets)
+    return content_pipeline.chunk_offsets(content if content is not None else row.content)
+
+
+def story_part(story_id, start, end):
+    '''A Slice of a Story's Content, Cut in the Database so the Rest of the Body is never Loaded'''
+    return db.session.query(func.substr(NewStory.content, start + 1, end - start)).filter(
+        NewStory.id == story_id).scalar()
+
+
+def part_context(offsets, part, read, endpoint, **values):
+    '''Template Values for one Part, read(start, end) Returns its Html'''
+    if not 0 <= part < len(offsets) - 1:
+        abort(404)
+    more = part + 1 < len(offsets) - 1
+    return {
+        'part': part,
+        'parts': len(offsets) - 1,
+        'part_html': read(offsets[part], offsets[part + 1]),
+        'next_url': url_for(endpoint, part=part + 1, **values) if more else None,
+        'next_fetch': url_for(endpoint + '_part', part=part + 1, **values) if more else None,
+    }
+
+
+###################################################
+#           Landing/Content Creation Page         #
+###################################################
+
+@bp.route('/', methods=['GET', 'POST'])
+def index():
+    '''Landing Page / Mission Statement'''
+    return render_template('index.html', current_user=current_user)
+
+
+
+###################################################
+#               Author Canvas GUI                 #
+###################################################
+
+@bp.route('/writer/', methods=['GET', 'POST'])
+def writer():
+    '''GUI where users can Auther and contribute to Stories'''
+    if request.method == 'POST':
+        
+        story_title = request.form['title']
+        # Bleach cleans allowable HTML tags for security, the excerpt and stats come out of the same pass.
+        processed = content_pipeline.process(request.form['content'])
+        story_genre = request.form['genre']
+        author_id = current_user.id
+        add_story = NewStory(title=story_title, genre=story_genre, author_id=author_id, **processed)
+
+        try:
+            db.session.add(add_story)
+            # Search indexing is queued by the NewStory events
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            flash("Something is Wrong..." + str(e))
+            return redirect('/writer/')
+        story_genres.cache_clear()
+        page_cache.invalidate('user', author_id)
+        return redirect('/story_db/')
+
+    else:
+        stories = NewStory.query.order_by(NewStory.date_created).all()
+        return render_template('writer.html', stories=stories, current_user=current_user)
+
+
+
+###################################################
+#           Story Repo and Reading Routes         #
+###################################################
+
+STORIES_PER_PAGE = 50
+
+
+# Cleared by writer() and delete(), other gunicorn workers catch up when the TTL runs out.
+@cached(TTLCache(maxsize=1, ttl=300), lock=threading.Lock())
+def story_genres():
+    '''Distinct Genres for the Library Dropdown'''
+    rows = db.session.query(NewStory.genre).filter(NewStory.genre.isnot(None), NewStory.deleted_at.is_(None)).distinct(
+        ).order_by(NewStory.genre)
+    return [genre for (genre,) in rows]
+
+
+def encode_cursor(story):
+    return '%s_%d' % (story.date_created.isoformat(), story.id)
+
+
+def decode_cursor(cursor):
+    '''Parse "<date_created>_<id>", None when Missing or Malformed'''
+    try:
+        created, story_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created), int(story_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+@bp.route('/story_db/', methods=['GET', 'POST'])
+def story_db():
+    '''View Created Stories'''
+    #### The genre dropdown POSTs, the "next page" link carries the filter in the query string ####
+    select_genre = request.form.get('Genre') or request.args.get('genre') or 'ALL'
+
+    # Only the columns story_db.html renders, the content body stays on disk.
+    query = NewStory.query.options(
+        load_only(NewStory.id, NewStory.title, NewStory.genre, NewStory.date_created, NewStory.author_id,
+                  NewStory.excerpt, NewStory.reading_minutes)).filter(NewStory.deleted_at.is_(None))
+    if select_genre != 'ALL':
+        query = query.filter(NewStory.genre == select_genre)
+
+    # Keyset pagination, seeks straight to the cursor on ix_new_story_date_created instead of OFFSET scanning.
+    after = decode_cursor(request.args.get('after')) if request.method == 'GET' else None
+    if after:
+        query = query.filter(tuple_(NewStory.date_created, NewStory.id) > after)
+
+    stories = query.order_by(NewStory.date_created, NewStory.id).limit(STORIES_PER_PAGE + 1).all()
+    next_cursor = None
+    if len(stories) > STORIES_PER_PAGE:
+        stories = stories[:STORIES_PER_PAGE]
+        next_cursor = encode_cursor(stories[-1])
+
+    return render_template('story_db.html', stories=stories, unique_genres=story_genres(), select_genre=select_genre,
+                           next_cursor=next_cursor, current_user=current_user)
+
+
+
+@bp.route('/search', methods=['GET'])
+def search_stories():
+    '''Full Text Search over Story Titles, Genres and Content'''
+    query = request.args.get('q', '').strip()
+    results = search.search(db.session.connection(), query) if query else []
+    return render_template('search.html', query=query, results=results, current_user=current_user)
+
+
+
+@bp.route('/viewstory/<int:id>', methods=['GET'])
+@page_cache.cached_page
+def view_story(id):
+    '''Hyperlink to Select Story, One Part at a Time (?part=n)'''
+    story, parts = story_parts(id, request.args.get('part', 0, type=int))
+    return render_template('view_story.html', story=story, current_user=current_user, **parts)
+
+
+@bp.route('/viewstory/<int:id>/parts/<int:part>', methods=['GET'])
+@page_cache.cached_page
+def view_story_part(id, part):
+    '''One Part of a Story, for story_parts.html'''
+    story, parts = story_parts(id, part)
+    return render_template('story_part.html', **parts)
+
+
+def story_parts(id, part):
+    page_cache.tag_page('story', id)
+    story = live_story(id, load_only(NewStory.id, NewStory.title, NewStory.chunk_offsets))
+    return story, part_context(part_offsets(story), part, lambda start, end: story_part(id, start, end),
+                               'stories.view_story', id=id)
+
+
+
+###################################################
+#                  CRUD actions                   #
+###################################################
+
+
+@bp.route('/delete/<int:id>')
+@login_required
+def delete(id):
+    '''Delete Posts'''
+    story_to_delete = live_story(id)
+    author_id = story_to_delete.author_id
+    if author_id != current_user.id:
+        abort(403)
+
+    # Marking is one row, the versions and merge requests are purged in batches in the background.
+    story_to_delete.deleted_at = datetime.utcnow()
+    search.remove_story(db.session.connection(), id)
+    counters.forget_story(db.session.connection(), id)
+    job_queue.enqueue('purge_story', {'story_id': id}, key='purge_story:%d' % id)
+    db.session.commit()
+    story_genres.cache_clear()
+    page_cache.invalidate('story', id)
+    page_cache.invalidate('user', author_id)
+    return redirect('/story_db/')
+
+
+
+@bp.route('/update/<int:id>', methods=['GET', 'POST'])
+@login_required
+def update(id):
+    '''Update Post'''
+    story = live_story(id)
+    if request.method == 'POST':
+        
+        try:
+            # Forks branch from the version the editor was opened on, or whatever is merged into the story now.
+            parent = db.session.get(NewVersion, request.form.get('parent_version_id', type=int) or 0)
+            parent_version_id = parent.id if parent and parent.story_id == id else story.current_version_id
+            new_version = add_version(story, request.form['content'], current_user.id, parent_version_id)
+            # Merge request functionality
+            # The request points at the version through the relationship, so both go out in one commit.
+            initiate_merge = request.form.get('initiate_merge_request') == 'true'
+            if initiate_merge:
+                merge_request = MergingRequest(
+                    story_id=id,
+                    version=new_version,
+                    requestor_id=current_user.id,
+                    status='Pending'
+                )
+
+                db.session.add(merge_request)
+                db.session.flush()
+                # The diff the author will review is worked out ahead of them opening it
+                job_queue.enqueue('diff_forks', {'story_id': id})
+            # Read before the commit expires them
+            author_id, title = story.author_id, story.title
+            merge_request_id = merge_request.id if initiate_merge else None
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('Saving a fork of story %d failed', id)
+            flash("Something is Wrong, your changes weren't saved.")
+            # The editor again with what was submitted, as a 503 so clients and load tests see the failure
+            return render_template('update.html', story=story, content=request.form.get('content', ''),
+                                   parent_version_id=request.form.get('parent_version_id', type=int),
+                                   current_user=current_user), 503
+
+        # After the commit, like delete(), so whichever worker serves the next request sees the change
+        page_cache.invalidate('story', id)
+        # The author's library shows the story's fork and pending request counts
+        page_cache.invalidate('user', author_id)
+        if initiate_merge and author_id != current_user.id:
+            events.publish(author_id, 'merge_request', {
+                'merge_request_id': merge_request_id, 'story_id': id, 'title': title,
+                'requestor': current_user.username})
+        return redirect('/story_db/')
+    else:
+        # ?from_version=<id> opens the editor on an older fork instead of the story as it is now
+        parent = NewVersion.query.filter_by(id=request.args.get('from_version', type=int), story_id=id).first()
+        content = load_version_content(parent) if parent else story.content
+        parent_version_id = parent.id if parent else story.current_version_id
+        return render_template('update.html', story=story, content=content, parent_version_id=parent_version_id,
+                               current_user=current_user)
+
+
+
+###################################################
+#               User Directory View               # 
+###################################################
+
+@bp.route('/user_dir/', methods=['GET'])
+def user_dir():
+    '''List of Registered, ?sort=score Puts the Biggest Contributors First'''
+    # Everyone who has written or forked anything, their counts read from user_stats rather than counted here.
+    sort = 'score' if request.args.get('sort') == 'score' else 'name'
+    query = db.session.query(User.id, User.username, UserStats.stories, UserStats.versions, UserStats.merges_accepted,
+                             UserStats.points).join(UserStats, UserStats.user_id == User.id).filter(
+        User.deleted_at.is_(None), UserStats.points > 0)
+    if sort == 'score':
+        # Walks ix_user_stats_points backwards, no sort step
+        query = query.order_by(UserStats.points.desc(), UserStats.user_id.desc())
+    else:
+        query = query.order_by(User.username)
+    return  render_template('user_dir.html', users=query.all(), sort=sort)
+
+
+
+@bp.route('/user_dir_stories/<int:user_id>/', methods=['GET'])
+@page_cache.cached_page
+def user_dir_stories(user_id):
+    '''stories users wrote'''
+    page_cache.tag_page('user', user_id)
+    user = User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
+    stories = NewStory.query.options(
+        load_only(NewStory.id, NewStory.title, NewStory.genre, NewStory.date_created, NewStory.excerpt,
+                  NewStory.reading_minutes), joinedload(NewStory.stats)
+    ).filter_by(author_id=user_id, deleted_at=None).order_by(NewStory.date_created).all()
+    return  render_template('user_dir_stories.html', user=user, stories=stories)
@@ -0,0 +1,63 @@
+"""
+Job handlers, the work the routes queue to run after their commit (see jobs.py).
+
+Imported by main.create_app() so the web workers and `flask run-jobs` register the
+same handlers.
+"""
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+
+from extensions import db, job_queue
+from models import MergingRequest, NewStory, load_version_content, story_hash
+import diff_engine
+import purge
+import search
+
+
+###################################################
+#                Background Jobs                  # 
+###################################################
+
+# Queued by the routes and run by the job queue's worker, see jobs.py. A job may run more than once,
+# so each one works from the rows as they are now rather than from what the request saw.
+
+@job_queue.handler('index_story')
+def index_story_job(story_id):
+    '''Bring a Story's Search Entry up to Date, Dropping it if the Story is Gone'''
+    story = db.session.get(NewStory, story_id)
+    if story is None or story.deleted_at:
+        search.remove_story(db.session.connection(), story_id)
+    else:
+        search.index_story(db.session.connection(), story.id, story.title, story.genre, story.content)
+
+
+@job_queue.handler('diff_forks')
+def diff_forks_job(story_id):
+    '''Store the Diff of every Pending Merge Request that isn't Diffed against the Story as it is Now'''
+    story = db.session.get(NewStory, story_id)
+    if story is None or story.deleted_at:
+        return
+    content_hash = story_hash(story)
+    stale = MergingRequest.query.options(joinedload(MergingRequest.version)).filter(
+        MergingRequest.story_id == story_id,
+        MergingRequest.status == 'Pending',
+        or_(MergingRequest.diff_base_hash.is_(None), MergingRequest.diff_base_hash != content_hash)).all()
+    for merge_request in stale:
+        diff = diff_engine.diff_html(story.content, load_version_content(merge_request.version))
+        # updated_at is kept, it records when the request was decided
+        db.session.execute(db.update(MergingRequest).where(MergingRequest.id == merge_request.id).values(
+            diff_html=diff.html, diff_words_added=diff.words_added, diff_words_removed=diff.words_removed,
+            diff_base_hash=content_hash, updated_at=MergingRequest.updated_at))
+
+
+@job_queue.handler('purge_story')
+def purge_story_job(story_id):
+    purge.purge_story(db.session, story_id, current_app.config['PURGE_BATCH_SIZE'],
+                      current_app.config['PURGE_PAUSE'])
+
+
+@job_queue.handler('purge_user')
+def purge_user_job(user_id):
+    purge.purge_user(db.session, user_id, current_app.config['PURGE_BATCH_SIZE'],
+                     current_app.config['PURGE_PAUSE'])
@@ -0,0 +1,114 @@
+"""
+Delta storage for story versions.
+
+Every fork used to keep a full copy of the story body, so a popular story grew the
+database by (story size x number of versions). Versions are now stored as a chain:
+a zlib compressed full snapshot every SNAPSHOT_INTERVAL versions, and in between a
+compressed list of copy/insert operations against the version before it.
+
+This module only knows about text and bytes, main.py (and the migration that
+converted the old rows) decide which version a delta is taken against.
+"""
+from difflib import SequenceMatcher
+import json
+import re
+import zlib
+
+
+# Longest chain of deltas before a fresh snapshot is written.
+# Rebuilding a version never has to apply more than this many deltas.
+SNAPSHOT_INTERVAL = 16
+
+_SNAPSHOT = b'S'
+_DELTA = b'D'
+
+# Story bodies come out of CKEditor as block level html, so splitting after line
+# breaks and closing paragraph tags lines up edits with what the author changed.
+_TOKEN = re.compile(r'.*?(?:\n|</p>|<br>|<br />)|.+', re.S)
+
+
+def tokenize(text):
+    '''Split Content into Diffable Chunks'''
+    return _TOKEN.findall(text)
+
+
+def encode_snapshot(text):
+    '''Full Compressed Copy'''
+    return _SNAPSHOT + zlib.compress(text.encode('utf-8'))
+
+
+def encode_delta(base_text, text):
+    '''Compressed Copy/Insert Ops against base_text'''
+    base_tokens, tokens = tokenize(base_text), tokenize(text)
+    ops = []
+    matcher = SequenceMatcher(None, base_tokens, tokens)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            # [start, end] copies a run of tokens from the base
+            ops.append([i1, i2])
+        elif j1 != j2:
+            # A plain string is inserted as is, deletes simply aren't copied
+            ops.append(''.join(tokens[j1:j2]))
+    return _DELTA + zlib.compress(json.dumps(ops, separators=(',', ':')).encode('utf-8'))
+
+
+def is_snapshot(payload):
+    return payload[:1] == _SNAPSHOT
+
+
+def _decode_tokens(payload, base_tokens=None):
+    kind, body = payload[:1], zlib.decompress(payload[1:])
+    if kind == _SNAPSHOT:
+        return tokenize(body.decode('utf-8'))
+    if base_tokens is None:
+        raise ValueError("Delta payload needs the content of its base version")
+
+    tokens = []
+    for op in json.loads(body):
+        if isinstance(op, list):
+            tokens.extend(base_tokens[op[0]:op[1]])
+        else:
+            tokens.extend(tokenize(op))
+    return tokens
+
+
+def decode(payload, base_text=None):
+    '''Rebuild Text from a Payload (and its base for deltas)'''
+    if is_snapshot(payload):
+        return zlib.decompress(payload[1:]).decode('utf-8')
+    base_tokens = tokenize(base_text) if base_text is not None else None
+    return ''.join(_decode_tokens(payload, base_tokens))
+
+
+def encode_version(text, base_text=None, base_depth=0):
+    '''
+    Pick the Cheapest Encoding for a New Version
+    |-- returns (payload, is_delta)
+    A snapshot is written for the first version, when the chain is full,
+    or when the delta would not be any smaller than the snapshot.
+    '''
+    snapshot = encode_snapshot(text)
+    if base_text is None or base_depth + 1 >= SNAPSHOT_INTERVAL:
+        return snapshot, False
+    delta = encode_delta(base_text, text)
+    if len(delta) >= len(snapshot):
+        return snapshot, False
+    return delta, True
+
+
+def rebuild(version_id, chain):
+    '''
+    Walk a Chain back to its Snapshot and Replay Deltas
+    |-- chain maps version id -> (base_version_id, payload)
+    '''
+    path = []
+    current = version_id
+    while current is not None:
+        path.append(current)
+        current = chain[current][0]
+
+    # Deltas are replayed on token lists so the text is only joined once at the end
+    tokens = None
+    for current in reversed(path):
+        tokens = _decode_tokens(chain[current][1], tokens)
+    return ''.join(tokens)
@@ -0,0 +1,91 @@
+"""
+Version history: the fork list, reading a fork in parts, and the fork tree.
+"""
+from flask import Blueprint, render_template, request
+from flask_login import current_user
+from sqlalchemy.orm import joinedload, load_only
+
+from extensions import db
+from models import NewStory, NewVersion, User, live_story, version_content
+from stories import part_context, part_offsets
+import lineage
+import page_cache
+
+
+bp = Blueprint('versions', __name__)
+
+
+###################################################
+#           Version Control System Routes         # 
+###################################################
+
+@bp.route('/versions/<int:id>', methods=['GET'])
+@page_cache.cached_page
+def versions(id):
+    '''Version History for Changes to a Story'''
+    page_cache.tag_page('story', id)
+    story = live_story(id, load_only(NewStory.id, NewStory.title))
+    # Authors come in with the versions, versions.html shows a username per row.
+    versions = NewVersion.query.options(joinedload(NewVersion.author).load_only(User.username)).filter_by(
+        story_id=id).order_by(NewVersion.date_created.desc()).all()
+    return render_template('versions.html', story=story, versions=versions, current_user=current_user)
+
+
+
+@bp.route('/read_version/<int:version_id>', methods=['GET'])
+@page_cache.cached_page
+def read_version(version_id):
+    '''Review Version from Version list, One Part at a Time (?part=n)'''
+    version, story, parts = version_parts(version_id, request.args.get('part', 0, type=int))
+    return render_template('read_version.html', version=version, story=story, **parts)
+
+
+@bp.route('/read_version/<int:version_id>/parts/<int:part>', methods=['GET'])
+@page_cache.cached_page
+def read_version_part(version_id, part):
+    '''One Part of a Version, for story_parts.html'''
+    _, _, parts = version_parts(version_id, part)
+    return render_template('story_part.html', **parts)
+
+
+def version_parts(version_id, part):
+    version = NewVersion.query.get_or_404(version_id)
+    page_cache.tag_page('story', version.story_id)
+    # Just what read_version.html shows of the story, not its body
+    story = live_story(version.story_id, load_only(NewStory.id, NewStory.title))
+    # A fork has to be rebuilt from its delta chain whole, the parts are sliced from that, cached across parts
+    content = version_content(version)
+    return version, story, part_context(part_offsets(version, content), part, lambda start, end: content[start:end],
+                                 'versions.read_version', version_id=version_id)
+
+
+
+@bp.route('/lineage/<int:story_id>', methods=['GET'])
+@page_cache.cached_page
+def fork_lineage(story_id):
+    '''Fork Tree of a Story, ?focus=<version_id> Highlights one Fork's Ancestry and Subtree'''
+    page_cache.tag_page('story', story_id)
+    story = live_story(story_id, load_only(NewStory.id, NewStory.title, NewStory.current_version_id))
+    forks = db.session.query(NewVersion.id, NewVersion.parent_version_id, NewVersion.date_created, User.username).outerjoin(
+        User, NewVersion.author_id == User.id).filter(NewVersion.story_id == story_id).order_by(NewVersion.id).all()
+
+    # Walk the adjacency list depth first without recursion, so deep fork chains can't blow the stack
+    children = {}
+    for fork in forks:
+        children.setdefault(fork.parent_version_id, []).append(fork)
+    tree = []
+    stack = [(fork, 0) for fork in reversed(children.get(None, []))]
+    while stack:
+        fork, depth = stack.pop()
+        tree.append((fork, depth))
+        stack.extend((child, depth + 1) for child in reversed(children.get(fork.id, [])))
+
+    focus = request.args.get('focus', type=int)
+    ancestors, descendants = set(), set()
+    if focus:
+        connection = db.session.connection()
+        ancestors = set(lineage.ancestors(connection, focus))
+        descendants = set(lineage.descendants(connection, focus))
+
+    return render_template('lineage.html', story=story, tree=tree, focus=focus, ancestors=ancestors,
+                           descendants=descendants)